@@ -4,6 +4,10 @@ import axios from 'axios';
 import * as d3 from 'd3';
 import './ArrayVisualizer.css';
 
+// Arrays longer than this many elements are sent as bucketed summaries (bucket means,
+// min/max and the exact values around the changed indices) instead of every element
+const ARRAY_LOD_WIDTH = 500;
+
 function ArrayVisualizer() {
   const [data, setData] = useState(null);
   const [visualizationType, setVisualizationType] = useState(null);
@@ -27,7 +31,9 @@ function ArrayVisualizer() {
     setLoading(true);
     try {
       // Fetch array data
-      const dataResponse = await axios.get('http://localhost:8000/api/data/arrays');
+      const dataResponse = await axios.get('http://localhost:8000/api/data/arrays', {
+        params: { width: ARRAY_LOD_WIDTH }
+      });
       
       // Fetch visualization selection
       const visualizationResponse = await axios.get('http://localhost:8000/api/visualization/arrays');
@@ -50,10 +56,26 @@ function ArrayVisualizer() {
 
   // Helper function to calculate changes between array states
   const calculateChanges = (current, previous) => {
+    // The backend ships what every kept step changed against the previous step of the
+    // same array (null for its first step); only older results need the comparison below
+    if (current && 'diff' in current) {
+      const diff = current.diff;
+      if (!diff) {
+        return { added: [], removed: [], modified: [], swaps: [], shift: null };
+      }
+      return {
+        added: diff.added,
+        removed: diff.removed,
+        modified: diff.changed,
+        swaps: diff.swaps,
+        shift: diff.shift
+      };
+    }
+
     if (!previous || !current || 
         !Array.isArray(current.content) || 
         !Array.isArray(previous.content)) {
-      return { added: [], removed: [], modified: [] };
+      return { added: [], removed: [], modified: [], swaps: [], shift: null };
     }
     
     const added = [];
@@ -101,7 +123,7 @@ function ArrayVisualizer() {
       removed.push(previous.content.length - 1);
     }
     
-    return { added, removed, modified };
+    return { added, removed, modified, swaps: [], shift: null };
   };
 
    // Process array data for visualization - FIXED
@@ -546,6 +568,23 @@ useEffect(() => {
     .transition()
     .duration(800)
     .style("opacity", 1);
+
+  // Connect the elements that exchanged their values (from the backend's step diff)
+  arrayGroup.selectAll(".swap-arc")
+    .data(currentState.changes.swaps || [])
+    .enter()
+    .append("path")
+    .attr("class", "swap-arc")
+    .attr("d", ([i, j]) => {
+      const x1 = i * (cellSize + 10) + cellSize / 2;
+      const x2 = j * (cellSize + 10) + cellSize / 2;
+      const y = cellSize + 2;
+      return `M ${x1} ${y} Q ${(x1 + x2) / 2} ${y + 30} ${x2} ${y}`;
+    })
+    .style("opacity", 0)
+    .transition()
+    .duration(800)
+    .style("opacity", 1);
   
   // Add legend at the bottom - COPIED FROM ARRAY COMPARISON
   const legendY = height - 30;
@@ -1425,6 +1464,11 @@ useEffect(() => {
               <div className="d-flex justify-content-between align-items-center mb-2">
                 <div className="step-indicator">
                   Step {currentStep + 1} of {arrayStates.length}
+                  {arrayStates[currentStep]?.lod && (
+                    <Badge bg="secondary" className="ms-2">
+                      {arrayStates[currentStep].lod.length} elements, averaged in buckets of {arrayStates[currentStep].lod.bucket_size}
+                    </Badge>
+                  )}
                 </div>
                 <div className="speed-controls">
                   <span className="me-2">Speed:</span>
@@ -4,6 +4,98 @@ import axios from 'axios';
 import * as d3 from 'd3';
 import './GraphVisualizer.css';
 
+// Packed adjacency matrices (GET /api/data/graphs?format=matrix, see app/adjacency_matrix.py),
+// fetched for the adjacency matrix view. A keyframe step carries the whole N x N bit matrix
+// (base64, row-major, most significant bit first), a delta step only the cells whose bit
+// flipped since the previous step of the same graph, so each step is the previous one with
+// those cells flipped. Node indices refer to the document's node table, whose order never
+// changes between steps, so a cell keeps its place in the view.
+const unpackBits = (encoded, bitCount) => {
+  const packed = atob(encoded);
+  const bits = new Uint8Array(bitCount);
+  for (let position = 0; position < bitCount; position++) {
+    bits[position] = (packed.charCodeAt(position >> 3) >> (7 - (position & 7))) & 1;
+  }
+  return bits;
+};
+
+// The graph states of a matrix document: every step with its matrix ({nodes, size, bits,
+// present}), its adjacency-list content rebuilt from the bits (for the step details), and
+// its changes taken from the flipped cells.
+const decodeAdjacencyMatrixSteps = (matrixDocument) => {
+  const { nodes, size } = matrixDocument;
+  const currentByGraph = {}; // graph ref -> {bits, present}
+  return matrixDocument.steps.map(step => {
+    const graphKey = step.ref || step.name;
+    const previous = currentByGraph[graphKey];
+    let bits, present, flip, flipPresent;
+    if (step.matrix !== undefined) {
+      bits = unpackBits(step.matrix, size * size);
+      present = unpackBits(step.present, size);
+      // Keyframes in the middle of a graph's steps still highlight what changed
+      flip = [];
+      flipPresent = [];
+      if (previous) {
+        bits.forEach((bit, cell) => { if (bit !== previous.bits[cell]) flip.push(cell); });
+        present.forEach((bit, node) => { if (bit !== previous.present[node]) flipPresent.push(node); });
+      }
+    } else {
+      bits = previous.bits.slice();
+      present = previous.present.slice();
+      flip = step.flip;
+      flipPresent = step.flip_present;
+      flip.forEach(cell => { bits[cell] ^= 1; });
+      flipPresent.forEach(node => { present[node] ^= 1; });
+    }
+    currentByGraph[graphKey] = { bits, present };
+
+    const content = {};
+    present.forEach((bit, node) => { if (bit) content[nodes[node]] = []; });
+    bits.forEach((bit, cell) => {
+      if (!bit) return;
+      const source = nodes[Math.floor(cell / size)];
+      (content[source] = content[source] || []).push(nodes[cell % size]);
+    });
+
+    const changes = { addedNodes: [], removedNodes: [], addedEdges: [], removedEdges: [], modifiedNodes: [] };
+    if (previous) {
+      flipPresent.forEach(node => {
+        (present[node] ? changes.addedNodes : changes.removedNodes).push(nodes[node]);
+      });
+      const modified = new Set();
+      flip.forEach(cell => {
+        const edge = { source: nodes[Math.floor(cell / size)], target: nodes[cell % size] };
+        (bits[cell] ? changes.addedEdges : changes.removedEdges).push(edge);
+        if (previous.present[Math.floor(cell / size)]) modified.add(edge.source);
+      });
+      changes.modifiedNodes = Array.from(modified);
+    }
+
+    const metadata = { ...step }; // The event fields, without the packed cells
+    ['matrix', 'present', 'flip', 'flip_present'].forEach(field => { delete metadata[field]; });
+    return { ...metadata, content, changes, matrix: { nodes, size, bits, present, flip } };
+  });
+};
+
+// Rows and columns of the matrix view for a decoded step (the nodes with an adjacency list
+// or an incoming edge, in node table order) and its cell values: 0 no edge, 1 edge,
+// 2 edge added by this step (a flipped cell that is now set).
+const matrixViewCells = (state) => {
+  const { nodes, size, bits, present, flip } = state.matrix;
+  const hasIncomingEdge = new Uint8Array(size);
+  bits.forEach((bit, cell) => { if (bit) hasIncomingEdge[cell % size] = 1; });
+  const shown = [];
+  for (let node = 0; node < size; node++) {
+    if (present[node] || hasIncomingEdge[node]) shown.push(node);
+  }
+  const addedCells = new Set(flip.filter(cell => bits[cell]));
+  const matrix = shown.map(source => shown.map(target => {
+    const cell = source * size + target;
+    return bits[cell] ? (addedCells.has(cell) ? 2 : 1) : 0;
+  }));
+  return { allNodes: shown.map(node => nodes[node]), matrix };
+};
+
 function GraphVisualizer() {
   const [data, setData] = useState(null);
   const [visualizationType, setVisualizationType] = useState(null);
@@ -26,12 +118,15 @@ function GraphVisualizer() {
   const fetchData = async () => {
     setLoading(true);
     try {
-      // Fetch graph data
-      const dataResponse = await axios.get('http://localhost:8000/api/data/graphs');
-      
       // Fetch visualization selection
       const visualizationResponse = await axios.get('http://localhost:8000/api/visualization/graphs');
       
+      // Fetch graph data: packed adjacency matrices for the matrix view, adjacency lists otherwise
+      const isMatrixView = visualizationResponse.data.visualization_type === "ADJACENCY_MATRIX";
+      const dataResponse = await axios.get('http://localhost:8000/api/data/graphs', {
+        params: isMatrixView ? { format: 'matrix' } : {}
+      });
+      
       setData(dataResponse.data);
       setVisualizationType(visualizationResponse.data.visualization_type);
       setVisualizationRationale(visualizationResponse.data.rationale);
@@ -114,6 +209,13 @@ function GraphVisualizer() {
   const graphStates = useMemo(() => {
     if (!data) return [];
     
+    // Packed matrices: the steps are already filtered, their changes come from the flipped cells
+    if (data.format === "adjacency_matrix") {
+      return decodeAdjacencyMatrixSteps(data)
+        .filter(state => state.operation !== "call" && state.operation !== "exit")
+        .map((state, index) => ({ ...state, stepNumber: index + 1 }));
+    }
+    
     // Step 1: Filter out internal calls and exits
     const initialFiltered = data.filter(item => 
       item.operation !== "call" && 
@@ -243,6 +345,24 @@ function GraphVisualizer() {
       isAdded: currentState.changes.addedNodes.includes(id),
       isModified: currentState.changes.modifiedNodes.includes(id)
     }));
+
+    // Start from the positions computed by the backend (app/graph_layout.py) when the state
+    // has them. They are scaled with the bounds of all steps, so nodes that did not change
+    // stay in place between steps and the simulation below only has to settle collisions.
+    const serverLayout = currentState.layout && currentState.layout.positions;
+    if (serverLayout) {
+      const allPositions = graphStates.flatMap(state => Object.values(state.layout?.positions || {}));
+      const [minX, maxX] = d3.extent(allPositions, p => p[0]);
+      const [minY, maxY] = d3.extent(allPositions, p => p[1]);
+      const drawWidth = width - 240; // Keep clear of the legend on the right
+      const scale = Math.min(drawWidth / Math.max(maxX - minX, 1), (height - 2 * nodeRadius) / Math.max(maxY - minY, 1)) * 0.9;
+      nodes.forEach(node => {
+        const position = serverLayout[node.id];
+        if (!position) return;
+        node.x = drawWidth / 2 + (position[0] - (minX + maxX) / 2) * scale;
+        node.y = height / 2 + (position[1] - (minY + maxY) / 2) * scale;
+      });
+    }
     
     const links = getEdgesFromGraph(currentState.content).map(link => ({
       ...link,
@@ -665,7 +785,8 @@ function GraphVisualizer() {
     });
     
     // Improve initial stabilization 
-    simulation.alpha(0.6).restart();
+    // (server-side positions only need a nudge to resolve collisions)
+    simulation.alpha(serverLayout ? 0.05 : 0.6).restart();
     
     // Gradually slow down to a stable state
     const stabilizeSimulation = () => {
@@ -696,41 +817,48 @@ function GraphVisualizer() {
     const width = adjacencyMatrixRef.current.clientWidth;
     const height = 500;
     
-    // Extract all unique nodes
-    const allNodes = extractGraphNodes(currentState.content);
-    
-    // Sort nodes alphabetically for consistent ordering
-    allNodes.sort();
-    
-    // Create a matrix of connections
-    const matrix = [];
-    
-    // Initialize matrix with zeros
-    for (let i = 0; i < allNodes.length; i++) {
-      matrix[i] = [];
-      for (let j = 0; j < allNodes.length; j++) {
-        matrix[i][j] = 0;
+    // Packed matrices give the cells directly; adjacency lists are turned into a matrix here
+    let allNodes;
+    let matrix;
+    if (currentState.matrix) {
+      ({ allNodes, matrix } = matrixViewCells(currentState));
+    } else {
+      // Extract all unique nodes
+      allNodes = extractGraphNodes(currentState.content);
+    
+      // Sort nodes alphabetically for consistent ordering
+      allNodes.sort();
+    
+      // Create a matrix of connections
+      matrix = [];
+    
+      // Initialize matrix with zeros
+      for (let i = 0; i < allNodes.length; i++) {
+        matrix[i] = [];
+        for (let j = 0; j < allNodes.length; j++) {
+          matrix[i][j] = 0;
+        }
       }
-    }
     
-    // Fill in the matrix with connection values
-    Object.entries(currentState.content).forEach(([source, targets]) => {
-      if (Array.isArray(targets)) {
-        const sourceIndex = allNodes.indexOf(source);
-        targets.forEach(target => {
-          const targetIndex = allNodes.indexOf(target);
-          if (sourceIndex >= 0 && targetIndex >= 0) {
-            // Check if this is a newly added edge
-            const isAdded = currentState.changes.addedEdges.some(
-              edge => edge.source === source && edge.target === target
-            );
+      // Fill in the matrix with connection values
+      Object.entries(currentState.content).forEach(([source, targets]) => {
+        if (Array.isArray(targets)) {
+          const sourceIndex = allNodes.indexOf(source);
+          targets.forEach(target => {
+            const targetIndex = allNodes.indexOf(target);
+            if (sourceIndex >= 0 && targetIndex >= 0) {
+              // Check if this is a newly added edge
+              const isAdded = currentState.changes.addedEdges.some(
+                edge => edge.source === source && edge.target === target
+              );
             
-            // Use 2 for added edges, 1 for regular edges
-            matrix[sourceIndex][targetIndex] = isAdded ? 2 : 1;
-          }
-        });
-      }
-    });
+              // Use 2 for added edges, 1 for regular edges
+              matrix[sourceIndex][targetIndex] = isAdded ? 2 : 1;
+            }
+          });
+        }
+      });
+    }
     
     // Set up dimensions with more balanced spacing
     const margin = { top: 80, right: 150, bottom: 20, left: 80 };
@@ -1208,6 +1336,16 @@ function GraphVisualizer() {
                   const currentGraph = graphStates[currentStep].content;
                   const nodes = extractGraphNodes(currentGraph);
                   const edges = getEdgesFromGraph(currentGraph);
+                  // Node/edge counts maintained by the backend while tracing, when present
+                  const graphMetrics = graphStates[currentStep].graph_metrics;
+                  const nodeCount = graphMetrics ? graphMetrics.nodes : nodes.length;
+                  const edgeCount = graphMetrics ? graphMetrics.edges : edges.length;
+                  
+                  // In-degree: number of edges coming into each node, counted in one pass
+                  const inDegrees = {};
+                  edges.forEach(edge => {
+                    inDegrees[edge.target] = (inDegrees[edge.target] || 0) + 1;
+                  });
                   
                   // Calculate node degrees
                   const nodeDegrees = {};
@@ -1215,8 +1353,7 @@ function GraphVisualizer() {
                     // Out-degree: number of edges going out from this node
                     const outDegree = currentGraph[node]?.length || 0;
                     
-                    // In-degree: number of edges coming into this node
-                    const inDegree = edges.filter(edge => edge.target === node).length;
+                    const inDegree = inDegrees[node] || 0;
                     
                     nodeDegrees[node] = {
                       out: outDegree,
@@ -1240,21 +1377,21 @@ function GraphVisualizer() {
                     <div className="row">
                       <div className="col-md-3">
                         <div className="stat-item">
-                          <div className="stat-value">{nodes.length}</div>
+                          <div className="stat-value">{nodeCount}</div>
                           <div className="stat-label">Nodes</div>
                         </div>
                       </div>
                       
                       <div className="col-md-3">
                         <div className="stat-item">
-                          <div className="stat-value">{edges.length}</div>
+                          <div className="stat-value">{edgeCount}</div>
                           <div className="stat-label">Edges</div>
                         </div>
                       </div>
                       
                       <div className="col-md-3">
                         <div className="stat-item">
-                          <div className="stat-value">{(edges.length / (nodes.length > 0 ? nodes.length : 1)).toFixed(2)}</div>
+                          <div className="stat-value">{(edgeCount / (nodeCount > 0 ? nodeCount : 1)).toFixed(2)}</div>
                           <div className="stat-label">Avg. Degree</div>
                         </div>
                       </div>
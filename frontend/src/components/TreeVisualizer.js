@@ -4,6 +4,60 @@ import axios from 'axios';
 import * as d3 from 'd3';
 import './TreeVisualizer.css';
 
+// Server-side tree layout (see app/tree_layout.py): the coordinates of an event come as
+// lists in pre-order over its content (node, left, right, children), which maps each
+// entry to the same node path getNodePath produces.
+const serverLayoutIndexByPath = (content) => {
+  const indexByPath = new Map();
+  let index = 0;
+  const walk = (node, path) => {
+    indexByPath.set(path, index++);
+    if (node.left) walk(node.left, `${path}.left`);
+    if (node.right) walk(node.right, `${path}.right`);
+    if (Array.isArray(node.children)) {
+      node.children.forEach((child, i) => { if (child) walk(child, `${path}.children[${i}]`); });
+    }
+  };
+  walk(content, 'root');
+  return indexByPath;
+};
+
+// Overrides the d3.tree() positions with the server layout when the state carries one.
+// toPoint(x, depth, angle, layout) returns the [x, y] pair the view uses.
+const applyServerLayout = (root, state, getNodePath, toPoint) => {
+  const layout = state && state.layout;
+  if (!layout || !state.content) return;
+  const indexByPath = serverLayoutIndexByPath(state.content);
+  root.each(d => {
+    const index = indexByPath.get(getNodePath(d));
+    if (index === undefined) return;
+    [d.x, d.y] = toPoint(layout.x[index], layout.depth[index], layout.angle[index], layout);
+  });
+};
+
+// Large trees are fetched cut to about this many nodes; cut-off subtrees come as
+// placeholder leaves ({value: "+<size>", collapsed: {path, size, hash}}, see
+// app/tree_view.py) that are fetched from /api/data/trees/subtree when clicked.
+const TREE_MAX_NODES = 500;
+
+// Copy of `content` with the node at `path` ("root.left.children[2]") replaced by `subtree`.
+const replaceSubtree = (content, path, subtree) => {
+  const parts = path.match(/\.(left|right)|\.children\[\d+\]/g) || [];
+  if (parts.length === 0) return subtree;
+  const copy = { ...content };
+  const [first, ...rest] = parts;
+  const restPath = 'root' + rest.join('');
+  if (first === '.left' || first === '.right') {
+    const slot = first.slice(1);
+    copy[slot] = replaceSubtree(content[slot], restPath, subtree);
+  } else {
+    const index = parseInt(first.match(/\d+/)[0], 10);
+    copy.children = [...content.children];
+    copy.children[index] = replaceSubtree(content.children[index], restPath, subtree);
+  }
+  return copy;
+};
+
 function TreeVisualizer() {
   const [data, setData] = useState(null);
   const [visualizationType, setVisualizationType] = useState(null);
@@ -26,7 +80,9 @@ function TreeVisualizer() {
     setLoading(true);
     try {
       // Fetch tree data
-      const dataResponse = await axios.get('http://localhost:8000/api/data/trees');
+      const dataResponse = await axios.get('http://localhost:8000/api/data/trees', {
+        params: { max_nodes: TREE_MAX_NODES }
+      });
       
       // Fetch visualization selection
       const visualizationResponse = await axios.get('http://localhost:8000/api/visualization/trees');
@@ -47,6 +103,24 @@ function TreeVisualizer() {
     }
   };
 
+  // Fetches the subtree behind a collapsed placeholder and splices it into that step
+  const expandCollapsedNode = async (state, node) => {
+    if (!node || !node.collapsed || state.step === undefined) return;
+    try {
+      const response = await axios.get('http://localhost:8000/api/data/trees/subtree', {
+        params: { step: state.step, path: node.collapsed.path, max_nodes: TREE_MAX_NODES }
+      });
+      setData(previousData => previousData.map(event => {
+        if (event.step !== state.step) return event;
+        // The server layout no longer matches the expanded tree; d3.tree() lays it out instead
+        const { layout, ...expandedEvent } = event;
+        return { ...expandedEvent, content: replaceSubtree(event.content, node.collapsed.path, response.data.content) };
+      }));
+    } catch (error) {
+      console.error('Error fetching subtree:', error);
+    }
+  };
+
   // Helper function to calculate changes between tree states
   const calculateChanges = (current, previous, enableDetailedLogging = false) => { // Keep logging flag for testing
     if (!previous || !current) { return { added: [], modified: [] }; }
@@ -625,6 +699,13 @@ function TreeVisualizer() {
     
     // Apply layout to get node positions
     treeLayout(root);
+    applyServerLayout(root, currentState, getNodePath, (x, depth, angle, layout) => {
+      const { min_x, max_x } = layout.extent;
+      return [
+        max_x > min_x ? (x - min_x) / (max_x - min_x) * constrainedWidth : constrainedWidth / 2,
+        layout.extent.depth ? depth / layout.extent.depth * (calculatedHeight - 80) : 0,
+      ];
+    });
     
     // Track nodes that first appear in this step
     /*const getFirstAppearanceStep = (path) => {
@@ -801,7 +882,9 @@ function TreeVisualizer() {
           .duration(200)
           .style("opacity", 0)
           .remove();
-      });
+      })
+      .style("cursor", d => (d.data.originalNode.collapsed ? "pointer" : null))
+      .on("click", (event, d) => expandCollapsedNode(currentState, d.data.originalNode));
     
     // Add node circles with appropriate classes
     nodes.append("circle")
@@ -1005,6 +1088,10 @@ function TreeVisualizer() {
     
     // Apply layout to hierarchy
     treeLayout(root);
+    applyServerLayout(root, currentState, getNodePath, (x, depth, angle, layout) => [
+      angle,
+      layout.extent.depth ? depth / layout.extent.depth * radius : 0,
+    ]);
 
     // Helper function for radial coordinates
     const radialPoint = (x, y) => [(y = +y) * Math.cos(x -= Math.PI / 2), y * Math.sin(x)];
@@ -1193,7 +1280,9 @@ function TreeVisualizer() {
           .duration(200)
           .style("opacity", 0)
           .remove();
-      });
+      })
+      .style("cursor", d => (d.data.originalNode.collapsed ? "pointer" : null))
+      .on("click", (event, d) => expandCollapsedNode(currentState, d.data.originalNode));
     
     // Check if this state has a changes object
     const hasChanges = currentState.changes && 
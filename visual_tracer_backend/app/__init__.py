@@ -1,12 +1,29 @@
 import os
+import time
+
+# Measured from here (before Flask is imported) to the end of the first create_app()
+_IMPORT_START = time.perf_counter()
+
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+# --- Startup time ---
+# Worker processes (gunicorn workers, the batch and ASGI process pools) pay the import cost
+# of the app on every start, so it is kept small: heavy dependencies that are only needed
+# for some requests are imported on first use (mistralai in llm_handler, numpy in
+# graph_layout, asyncio for the ASGI path). The first create_app() of a process logs how
+# long startup took and warns when it is over STARTUP_TARGET_SECONDS.
+STARTUP_TARGET_SECONDS = float(os.environ.get("STARTUP_TARGET_SECONDS", 0.5))
+_startup_measured = False
+
 def create_app(config_name=None):
     """
     Flask application factory.
     """
+    global _startup_measured
+    factory_start = time.perf_counter()
+
     # Load environment variables from .env file
     env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
     if os.path.exists(env_path):
@@ -25,4 +42,15 @@ def create_app(config_name=None):
         from . import routes # Import routes
         
 
-    return app
\ No newline at end of file
+    # The first app of a process includes the imports; later ones only the factory itself
+    startup_seconds = time.perf_counter() - (factory_start if _startup_measured else _IMPORT_START)
+    app.config["STARTUP_SECONDS"] = startup_seconds
+    if not _startup_measured:
+        _startup_measured = True
+        from . import metrics
+        metrics.record_phase("startup", startup_seconds)
+        print(f"App started in {startup_seconds * 1000:.0f} ms (pid {os.getpid()}).")
+        if startup_seconds > STARTUP_TARGET_SECONDS:
+            print(f"Warning: startup took longer than the {STARTUP_TARGET_SECONDS * 1000:.0f} ms target (STARTUP_TARGET_SECONDS).")
+
+    return app
@@ -0,0 +1,90 @@
+import base64
+
+# --- Packed adjacency-matrix encoding of graph events ---
+# GET /api/data/graphs?format=matrix returns the graph steps as one node-index table and
+# bit-packed adjacency matrices instead of string-keyed adjacency lists:
+#
+#   {
+#     "format": "adjacency_matrix",
+#     "nodes": ["A", "B", ...],   node table, in order of first appearance (so it only grows)
+#     "size": N,                  len(nodes); every matrix is N x N
+#     "steps": [
+#       {"ref", "name", "operation", "location", "timestamp",            event metadata
+#        "graph_metrics",                                                (see graph_metrics.py)
+#        "matrix": "<base64>", "present": "<base64>"},                  keyframe
+#       {..., "flip": [cell, ...], "flip_present": [node, ...]},        XOR delta
+#     ]
+#   }
+#
+# A matrix is N*N bits, row-major (cell = source * N + target), most significant bit
+# first in every byte (the numpy.packbits order); "present" has one bit per node table
+# entry, set for the nodes that have their own adjacency list in that step. A delta step
+# lists the cells (and node entries) whose bit flipped since the previous step of the
+# same graph (same ref), i.e. the set bits of the XOR of the two matrices. The frontend's
+# adjacency matrix view (GraphVisualizer.js, decodeAdjacencyMatrixSteps) requests this
+# format and gets each step from the previous one by flipping those cells. A keyframe is
+# sent for the first step of each graph, every KEYFRAME_INTERVAL steps, and whenever the
+# delta would be larger than the packed matrix.
+
+KEYFRAME_INTERVAL = 64
+_METADATA_FIELDS = ("ref", "name", "operation", "location", "timestamp", "graph_metrics")
+
+
+def _targets(targets):
+    return targets if isinstance(targets, list) else [targets]
+
+
+def node_table(graph_events):
+    """Node ids of all steps, in order of first appearance."""
+    index = {}
+    for event in graph_events:
+        content = event.get("content")
+        if not isinstance(content, dict):
+            continue
+        for source, targets in content.items():
+            index.setdefault(source, len(index))
+            for target in _targets(targets):
+                index.setdefault(target, len(index))
+    return index
+
+
+def _pack(bit_positions, bit_count):
+    packed = bytearray((bit_count + 7) // 8)
+    for position in bit_positions:
+        packed[position >> 3] |= 0x80 >> (position & 7)
+    return base64.b64encode(bytes(packed)).decode("ascii")
+
+
+def encode(graph_events):
+    """The packed document for a list of filtered graph events (see above)."""
+    index = node_table(graph_events)
+    size = len(index)
+    matrix_bytes = (size * size + 7) // 8
+    previous = {} # graph ref -> (cells, present, steps since keyframe)
+    steps = []
+    for event in graph_events:
+        content = event.get("content")
+        if not isinstance(content, dict):
+            continue
+        cells, present = set(), set()
+        for source, targets in content.items():
+            present.add(index[source])
+            for target in _targets(targets):
+                cells.add(index[source] * size + index[target])
+
+        step = {field: event[field] for field in _METADATA_FIELDS if field in event}
+        graph_key = event.get("ref") or event.get("name")
+        last = previous.get(graph_key)
+        flipped = cells ^ last[0] if last is not None else None
+        # A flipped cell index costs a few bytes of JSON, a packed cell 1/8 byte
+        if flipped is None or last[2] + 1 >= KEYFRAME_INTERVAL or len(flipped) * 4 > matrix_bytes:
+            step["matrix"] = _pack(cells, size * size)
+            step["present"] = _pack(present, size)
+            since_keyframe = 0
+        else:
+            step["flip"] = sorted(flipped)
+            step["flip_present"] = sorted(present ^ last[1])
+            since_keyframe = last[2] + 1
+        previous[graph_key] = (cells, present, since_keyframe)
+        steps.append(step)
+    return {"format": "adjacency_matrix", "nodes": list(index), "size": size, "steps": steps}
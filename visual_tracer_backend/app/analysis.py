@@ -0,0 +1,192 @@
+import json
+import re
+
+from . import tracer
+from . import data_processor
+from . import graph_layout
+from . import llm_handler
+from . import metrics
+from . import tree_layout
+
+# --- The /api/analyze pipeline ---
+# Shared by the Flask route (routes.py, everything runs in the request thread) and the
+# ASGI app (asgi.py, tracing runs in a worker process and the LLM calls are awaited).
+# Tracing + filtering is the CPU-bound part; selecting visualizations is I/O-bound.
+
+STRUCTURE_TYPES = ("arrays", "trees", "graphs")
+
+# Used for structure types without an LLM selection in /api/execution_data
+_DEFAULT_VISUALIZATION_TYPES = {"arrays": "TIMELINE_ARRAY", "trees": "HIERARCHICAL_TREE", "graphs": "FORCE_DIRECTED"}
+
+_VISUALIZATION_SELECTORS = {
+    "arrays": (llm_handler.get_visualization_for_arrays, llm_handler.get_visualization_for_arrays_async),
+    "trees": (llm_handler.get_visualization_for_trees, llm_handler.get_visualization_for_trees_async),
+    "graphs": (llm_handler.get_visualization_for_graphs, llm_handler.get_visualization_for_graphs_async),
+}
+
+
+def read_analyze_request(data):
+    """
+    Validates an /api/analyze JSON body.
+    Returns (code_snippet, trace_mode, watch, error_message); error_message is None when valid.
+    `watch` is the list of variable names to trace (None: everything, see tracer.WATCH_PRAGMA).
+    """
+    if not data or 'code' not in data:
+        return None, None, None, "No code provided"
+    # "trace" (default) uses sys.settrace; "intercept" records mutations of tracked containers
+    trace_mode = data.get('mode', 'trace')
+    if trace_mode not in tracer.TRACE_MODES:
+        return None, None, None, f"Unknown mode '{trace_mode}', expected one of {list(tracer.TRACE_MODES)}"
+    # "watch": ["arr", "root"] or "arr, root"
+    watch = data.get('watch')
+    if isinstance(watch, str):
+        watch = [name for name in re.split(r"[\s,]+", watch) if name]
+    if watch is not None and not (isinstance(watch, list) and all(isinstance(name, str) and name.isidentifier() for name in watch)):
+        return None, None, None, "watch must be a list of variable names"
+    return data['code'], trace_mode, watch or None, None
+
+
+def filter_events(raw_events, structure_type):
+    """Runs filter_data_structure_events for one structure type, recording timing and counters."""
+    metrics.increment("raw_events_total", len(raw_events), {"structure": structure_type})
+    with metrics.phase(f"filter_{structure_type}"):
+        filtered_events = data_processor.filter_data_structure_events(raw_events, structure_type)
+    metrics.increment("filtered_events_total", len(filtered_events), {"structure": structure_type})
+    return filtered_events
+
+
+def trace_and_filter(code_snippet, trace_mode="trace", watch=None):
+    """
+    Traces the snippet (only the `watch`ed names, if given) and filters the events of each structure type.
+    Returns {"code", "error", "arrays", "trees", "graphs"}; "error" is set if the tracer failed.
+    """
+    print("Starting code tracing...")
+    raw_trace_json_str = tracer.perform_code_analysis(code_snippet, mode=trace_mode, watch=watch)
+    with metrics.phase("trace_decode"):
+        raw_trace_data = json.loads(raw_trace_json_str)
+    print("Code tracing complete.")
+
+    result = {"code": raw_trace_data.get("code"), "error": None}
+    if "error" in raw_trace_data and raw_trace_data["error"]:
+        print(f"Error during tracing: {raw_trace_data['error']}")
+        result["error"] = f"Tracer error: {raw_trace_data['error'].get('message', 'Unknown tracer error')}"
+        # Still keep what we have, like the code itself
+        result["code"] = raw_trace_data.get("code", {"source": code_snippet, "lines": code_snippet.split('\n')})
+        return result
+
+    all_ds_events = raw_trace_data.get("data_structures", {})
+    for structure_type in STRUCTURE_TYPES:
+        raw_events = all_ds_events.get(structure_type, [])
+        if raw_events:
+            print(f"Filtering {len(raw_events)} raw {structure_type[:-1]} events...")
+            result[structure_type] = filter_events(raw_events, structure_type)
+            if structure_type == "trees" and tree_layout.TREE_LAYOUT:
+                with metrics.phase("layout_trees"):
+                    tree_layout.add_layouts(result["trees"])
+            elif structure_type == "graphs" and graph_layout.is_available():
+                with metrics.phase("layout_graphs"):
+                    graph_layout.add_layouts(result["graphs"])
+            print(f"Filtered to {len(result[structure_type])} {structure_type[:-1]} events.")
+        else:
+            print(f"No raw {structure_type[:-1]} events found.")
+            result[structure_type] = []
+    return result
+
+
+def trace_and_filter_job(code_snippet, trace_mode="trace", isolated_metrics=False, watch=None, profile=False):
+    """
+    Executor entry point for trace_and_filter. Adds the phase spans recorded while running
+    under "spans". With `isolated_metrics` (worker processes) the process-local registry is
+    reset first and its snapshot is returned under "metrics" for the parent to merge.
+    With `profile`, the job runs under metrics.RequestProfiler and its report is added
+    under "profile" (the LLM requests that follow are awaited, not profiled).
+    """
+    if isolated_metrics:
+        metrics.reset()
+    metrics.start_request()
+    try:
+        with metrics.RequestProfiler(profile) as profiler:
+            result = trace_and_filter(code_snippet, trace_mode, watch)
+    finally:
+        spans = metrics.finish_request()
+    result["spans"] = spans
+    if profiler.report is not None:
+        result["profile"] = profiler.report
+    if isolated_metrics:
+        result["metrics"] = metrics.snapshot()
+    return result
+
+
+def _combined_selection_events(result):
+    """{structure type: events} when one combined LLM request should select them all, else None."""
+    events_by_type = {structure_type: result[structure_type] for structure_type in STRUCTURE_TYPES if result.get(structure_type)}
+    if llm_handler.LLM_COMBINED and len(events_by_type) > 1: # A single type keeps its own prompt
+        return events_by_type
+    return None
+
+
+def select_visualizations(result, selection_cache=None):
+    """
+    Asks the LLM for a visualization for every structure type with events: in one request
+    (llm_handler.LLM_COMBINED) or one after another. `selection_cache` is passed on to
+    llm_handler (see batch.py).
+    """
+    events_by_type = _combined_selection_events(result)
+    if events_by_type:
+        print(f"Getting one LLM suggestion for {', '.join(events_by_type)}...")
+        visualizations = llm_handler.get_visualizations_combined(events_by_type, selection_cache)
+        for structure_type, visualization in visualizations.items():
+            print(f"{structure_type[:-1].capitalize()} viz suggestion: {visualization.get('visualization_type')}")
+        return visualizations
+
+    visualizations = {}
+    for structure_type in STRUCTURE_TYPES:
+        if result.get(structure_type):
+            print(f"Getting LLM suggestion for {structure_type}...")
+            select, _ = _VISUALIZATION_SELECTORS[structure_type]
+            visualizations[structure_type] = select(result[structure_type], selection_cache)
+            print(f"{structure_type[:-1].capitalize()} viz suggestion: {visualizations[structure_type].get('visualization_type')}")
+    return visualizations
+
+
+async def select_visualizations_async(result):
+    """Same as select_visualizations, but the LLM requests (if not combined) run concurrently."""
+    events_by_type = _combined_selection_events(result)
+    if events_by_type:
+        print(f"Getting one LLM suggestion for {', '.join(events_by_type)}...")
+        return await llm_handler.get_visualizations_combined_async(events_by_type)
+
+    import asyncio # Only the ASGI app needs it; kept off the startup path of the Flask server
+    pending = {}
+    for structure_type in STRUCTURE_TYPES:
+        if result.get(structure_type):
+            print(f"Getting LLM suggestion for {structure_type}...")
+            _, select_async = _VISUALIZATION_SELECTORS[structure_type]
+            pending[structure_type] = select_async(result[structure_type])
+    selections = await asyncio.gather(*pending.values())
+    return dict(zip(pending.keys(), selections))
+
+
+def execution_data(code, events, visualizations):
+    """
+    The /api/execution_data document: {"arrays"|"trees"|"graphs": {"data", "visualization"}, "code"}.
+    `events` and `visualizations` map structure types to filtered events and LLM selections
+    (missing selections get the defaults). Also written by trace_cli.py.
+    """
+    # Construct the response to match the frontend's expectation
+    # based on the original simple_server.py's output for this route.
+    response_data = {}
+    for structure_type in STRUCTURE_TYPES:
+        visualization = dict(visualizations.get(structure_type) or {
+            "selection": "1", "type": _DEFAULT_VISUALIZATION_TYPES[structure_type], "rationale": "Default or N/A"
+        })
+        # Ensure visualization sub-objects have the expected keys even if null from LLM
+        if not visualization.get("selection"):
+            visualization["selection"] = "1" # Default
+        if not visualization.get("type"): # 'type' was used in original, map from 'visualization_type'
+            visualization["type"] = visualization.get("visualization_type", "DefaultVizType")
+        if not visualization.get("rationale"):
+            visualization["rationale"] = "N/A"
+        response_data[structure_type] = {"data": events.get(structure_type) or [], "visualization": visualization}
+    response_data["code"] = code or {}
+    return response_data
@@ -0,0 +1,150 @@
+import os
+
+# --- Array step diffs ---
+# The array filter and the array views both need to know what a step changed compared
+# with the previous step of the same array. This module computes it once, per variable,
+# over its whole sequence of steps, and every kept array event ships the result:
+#
+#   "diff": {
+#       "changed": [i, ...],              indices whose value was replaced (same position before and after)
+#       "added": [i, ...],                indices of the new content that did not exist before
+#       "removed": [i, ...],              indices of the previous content that are gone
+#       "swaps": [[i, j], ...],           pairs of changed indices that exchanged their values
+#       "shift": {"index": i, "count": k} or null
+#   }
+#
+# A length change that is one contiguous insert (count > 0) or removal (count < 0) at
+# "index" is reported as a shift: the elements after it moved but are not "changed", and
+# "added"/"removed" hold the inserted/removed positions. Any other length change is
+# reported element by element. "diff" is null for the first step of a variable.
+#
+# Runs of consecutive steps that are flat numeric arrays of the same length are compared
+# with NumPy: the snapshots are stacked into a (steps, length) array and one vectorized
+# comparison of every step with the one before gives all changed index sets. Everything
+# else (strings, nested lists, length changes, NumPy not installed) is compared in Python,
+# like == compares (True equals 1 and 1.0).
+
+ARRAY_DIFF_NUMPY = os.environ.get("ARRAY_DIFF_NUMPY", "1") == "1" # Set to 0 to always compare in Python
+NUMPY_MIN_LENGTH = 128 # Shorter arrays are compared in Python, stacking them saves nothing
+MAX_STACK_CELLS = 1 << 22 # Snapshots stacked at once (steps * length), bounds the memory of one comparison
+MAX_SWAP_CANDIDATES = 16 # More changed indices than this (a sort, a reverse): no swap detection
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _empty_diff():
+    return {"changed": [], "added": [], "removed": [], "swaps": [], "shift": None}
+
+
+def is_unchanged(diff) -> bool:
+    return not (diff["changed"] or diff["added"] or diff["removed"])
+
+
+def _swaps(previous, content, changed):
+    """Pairs of changed indices i < j with content[i] == previous[j] and content[j] == previous[i]."""
+    if len(changed) > MAX_SWAP_CANDIDATES:
+        return []
+    swaps, paired = [], set()
+    for position, i in enumerate(changed):
+        if i in paired:
+            continue
+        for j in changed[position + 1:]:
+            if j not in paired and content[i] == previous[j] and content[j] == previous[i]:
+                swaps.append([i, j])
+                paired.update((i, j))
+                break
+    return swaps
+
+
+def _changed_indices(previous, content):
+    return [index for index, (old, new) in enumerate(zip(previous, content)) if old != new]
+
+
+def diff(previous, content):
+    """The diff (see above) of one step against the previous step of the same array, None for a first step."""
+    if previous is None:
+        return None
+    result = _empty_diff()
+    if previous == content: # One comparison in C for the common unchanged case
+        return result
+    old_length, new_length = len(previous), len(content)
+    if old_length == new_length:
+        result["changed"] = _changed_indices(previous, content)
+        result["swaps"] = _swaps(previous, content, result["changed"])
+        return result
+
+    count = new_length - old_length
+    prefix = 0 # Length of the common prefix
+    for old, new in zip(previous, content):
+        if old != new:
+            break
+        prefix += 1
+    if count > 0 and content[prefix + count:] == previous[prefix:]:
+        result["added"] = list(range(prefix, prefix + count))
+        result["shift"] = {"index": prefix, "count": count}
+    elif count < 0 and content[prefix:] == previous[prefix - count:]:
+        result["removed"] = list(range(prefix, prefix - count))
+        result["shift"] = {"index": prefix, "count": count}
+    else:
+        result["changed"] = _changed_indices(previous, content)
+        result["added"] = list(range(old_length, new_length))
+        result["removed"] = list(range(new_length, old_length))
+    return result
+
+
+def _stacked_diffs(np, contents):
+    """Diffs of contents[1:] against their predecessors, or None unless they stack into a numeric 2-D array."""
+    try:
+        stacked = np.array(contents)
+    except (OverflowError, ValueError): # Ints beyond int64, nested lists of different lengths
+        return None
+    # Strings, None or mixed values give an object or string array (where 1 and "1" could
+    # compare equal), same-shape nested lists a 3-D one: those are compared in Python
+    if stacked.ndim != 2 or stacked.dtype.kind not in "biuf":
+        return None
+    # One comparison for the whole run; the (step, index) pairs come out sorted by step
+    steps, indices = np.nonzero(stacked[1:] != stacked[:-1])
+    bounds = np.searchsorted(steps, np.arange(len(contents))).tolist()
+    indices = indices.tolist()
+    diffs = []
+    for step in range(1, len(contents)):
+        result = _empty_diff()
+        changed = indices[bounds[step - 1]:bounds[step]]
+        if changed:
+            result["changed"] = changed
+            result["swaps"] = _swaps(contents[step - 1], contents[step], changed)
+        diffs.append(result)
+    return diffs
+
+
+def diff_sequence(contents):
+    """The diff of every step of one array variable against the step before it (None for the first)."""
+    diffs = [None] * len(contents)
+    step = 1
+    while step < len(contents):
+        previous = contents[step - 1]
+        length = len(previous)
+        # numpy is only imported for an array long enough to be stacked (importing it is slow)
+        np = _numpy() if ARRAY_DIFF_NUMPY and length >= NUMPY_MIN_LENGTH else None
+        if np is not None:
+            # The run of following steps of the same length, stacked with this one
+            end = step
+            rows = max(2, MAX_STACK_CELLS // length)
+            while end < len(contents) and end - step + 2 <= rows and len(contents[end]) == length:
+                end += 1
+            if end > step:
+                run_diffs = _stacked_diffs(np, contents[step - 1:end])
+                if run_diffs is None:
+                    run_diffs = [diff(contents[index - 1], contents[index]) for index in range(step, end)]
+                diffs[step:end] = run_diffs
+                step = end
+                continue
+        diffs[step] = diff(previous, contents[step])
+        step += 1
+    return diffs
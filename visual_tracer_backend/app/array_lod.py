@@ -0,0 +1,94 @@
+# --- Level-of-detail summaries for large arrays ---
+# GET /api/data/arrays?width=<n> returns every array step with more than n elements as a
+# bucketed summary instead of all of its values:
+#
+#   "content": [...],                 mean of every bucket, so views that only know
+#                                     "content" still draw the overall shape
+#   "lod": {
+#       "level": 6, "bucket_size": 64,  bucket_size = 2 ** level
+#       "length": 50000,                length of the real array
+#       "min": [...], "max": [...],     per bucket, aligned with "content"
+#       "touched": [i, ...],            indices the step changed (from its "diff", see array_diff.py)
+#       "exact": [{"start": i, "values": [...]}, ...]   real values around the touched indices
+#   }
+#
+# The levels form a pyramid of power-of-two bucket sizes starting at index 0, and the
+# smallest one with at most `width` buckets is returned; an array keeps the same buckets
+# across steps as long as its length stays in the same range, so bucket i of two steps
+# covers the same elements and can be compared. Only flat numeric arrays are summarized;
+# other arrays (strings, nested lists) and arrays that fit are returned unchanged.
+
+DETAIL_RADIUS = 8 # Exact values this many indices to each side of a touched index
+MAX_TOUCHED = 16 # More changed indices than this (a sort, an insert shifting the tail): keep the first and last
+MEAN_DIGITS = 4
+
+
+def level_for(length, width):
+    """The smallest pyramid level whose bucket count fits in `width`."""
+    level = 0
+    while -(-length // (1 << level)) > width:
+        level += 1
+    return level
+
+
+def _is_numeric(content):
+    return isinstance(content, list) and all(isinstance(value, (int, float)) for value in content)
+
+
+def _touched_from_diff(diff, length):
+    """The touched indices of a step from its array_diff diff (indices of the new content)."""
+    touched = diff["changed"] + diff["added"]
+    if diff["removed"]:
+        touched.append(min(diff["removed"][0], length - 1)) # Where the removal happened (the end, after a pop)
+    touched = sorted(set(touched))
+    if len(touched) > MAX_TOUCHED:
+        touched = [touched[0], touched[-1]]
+    return touched
+
+
+def summarize(content, level, touched=()):
+    """The "lod" document (see above) and the bucket means of one numeric array."""
+    bucket_size = 1 << level
+    buckets = [content[start:start + bucket_size] for start in range(0, len(content), bucket_size)]
+    means = [round(sum(bucket) / len(bucket), MEAN_DIGITS) for bucket in buckets]
+
+    exact = []
+    for index in sorted(touched):
+        start, stop = max(0, index - DETAIL_RADIUS), min(len(content), index + DETAIL_RADIUS + 1)
+        if exact and start <= exact[-1][1]:
+            exact[-1][1] = max(exact[-1][1], stop) # Overlapping windows are merged
+        else:
+            exact.append([start, stop])
+
+    lod = {
+        "level": level,
+        "bucket_size": bucket_size,
+        "length": len(content),
+        "min": [min(bucket) for bucket in buckets],
+        "max": [max(bucket) for bucket in buckets],
+        "touched": sorted(touched),
+        "exact": [{"start": start, "values": content[start:stop]} for start, stop in exact],
+    }
+    return lod, means
+
+
+def downsample(array_events, width):
+    """
+    Copies of the filtered array events with a "lod" summary for every array longer than
+    `width`. The touched indices come from each event's own diff, so a page of steps
+    needs nothing from the steps before it.
+    """
+    summarized_events = []
+    for event in array_events:
+        content = event.get("content")
+        if not _is_numeric(content) or len(content) <= width:
+            summarized_events.append(event)
+            continue
+        diff = event.get("diff")
+        touched = _touched_from_diff(diff, len(content)) if diff is not None else [] # None: first step of the array
+        lod, means = summarize(content, level_for(len(content), width), touched)
+        event = dict(event, content=means, lod=lod)
+        event.pop("delta", None) # ndarray deltas index the full array
+        event.pop("diff", None) # And so does the diff, "touched" replaces it
+        summarized_events.append(event)
+    return summarized_events
@@ -0,0 +1,294 @@
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import create_app
+from . import analysis
+from . import llm_handler
+from . import metrics
+
+# --- ASGI serving mode ---
+# With the Flask app, a worker thread is held for the whole /api/analyze request:
+# tracing, then up to three blocking LLM calls. Here POST /api/analyze is handled on
+# the event loop instead: tracing and filtering (CPU-bound) run in a process pool and
+# the LLM requests are awaited concurrently, so a single process can keep hundreds of
+# analyses in flight while they wait on the LLM.
+#
+# Every other request is passed to the unchanged Flask app through a small WSGI bridge
+# running in a thread pool, so all /api/* routes keep their contract and share the
+# same in-memory results store (routes._last_analysis_results). The bridge sends each
+# chunk of a response as it is produced, so streamed responses stay streamed.
+#
+# This module only implements the ASGI interface; run it with any ASGI server, e.g.
+#   uvicorn asgi:application --host 127.0.0.1 --port 8000
+# from the visual_tracer_backend directory (see asgi.py there).
+
+# "process" (default) runs each trace in a worker process, so several analyses can use
+# several cores; "thread" runs them in threads of this process, one at a time (the
+# tracer holds a lock) but without process start-up or pickling costs.
+ANALYSIS_EXECUTOR = os.environ.get("ANALYSIS_EXECUTOR", "process")
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", os.cpu_count() or 1))
+WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 8))
+
+
+class AsyncTracerApp:
+    """ASGI application: native async /api/analyze, Flask for everything else."""
+
+    def __init__(self, flask_app, executor_kind=ANALYSIS_EXECUTOR, workers=ANALYSIS_WORKERS):
+        if executor_kind not in ("process", "thread"):
+            raise ValueError(f"ANALYSIS_EXECUTOR must be 'process' or 'thread', got {executor_kind!r}")
+        self.flask_app = flask_app
+        self.executor_kind = executor_kind
+        self.workers = workers
+        self._analysis_executor = None
+        self._wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+        # routes is imported by create_app inside the app context; reuse that module.
+        from . import routes
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            if scope["path"] == "/api/analyze" and scope["method"] == "POST":
+                await self._analyze(scope, receive, send)
+            else:
+                await self._call_flask(scope, receive, send)
+        # Other scope types (websocket) are not served.
+
+    # --- Lifecycle ---
+
+    def _get_analysis_executor(self):
+        if self._analysis_executor is None:
+            if self.executor_kind == "process":
+                # "spawn" so workers do not inherit the event loop and server threads of this process
+                self._analysis_executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._analysis_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis")
+            print(f"ASGI: {self.executor_kind} analysis executor with {self.workers} workers started.")
+        return self._analysis_executor
+
+    def _drop_broken_executor(self, executor):
+        # A process pool whose worker died (os._exit() in a snippet, an OOM kill) refuses every
+        # later job; the next analysis starts a new one. Concurrent analyses that failed on the
+        # same pool only drop it once.
+        if self._analysis_executor is executor:
+            print("ASGI: an analysis worker died; the executor will be restarted.")
+            self._analysis_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._get_analysis_executor()
+                llm_handler.get_provider()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def shutdown(self):
+        if self._analysis_executor is not None:
+            self._analysis_executor.shutdown(wait=False, cancel_futures=True)
+            self._analysis_executor = None
+        self._wsgi_executor.shutdown(wait=False)
+        await llm_handler.close_provider()
+
+    # --- /api/analyze ---
+
+    async def _analyze(self, scope, receive, send):
+        start_time = time.perf_counter()
+        body = await _read_body(receive)
+        routes = self.routes
+        routes._reset_last_analysis() # Clear previous results on a new analysis
+
+        print("Received analyze request (async)")
+        metrics.increment("analyze_requests_total")
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+
+        code_snippet, trace_mode, watch, request_error = analysis.read_analyze_request(data)
+        if request_error:
+            print(f"Invalid analyze request: {request_error}")
+            routes._last_analysis_results["error"] = request_error
+            await self._send_json(send, {"error": request_error}, 400, [], start_time)
+            return
+        print(f"Received code snippet of length: {len(code_snippet)}")
+
+        spans = []
+        profile_report = None
+        try:
+            loop = asyncio.get_running_loop()
+            isolated_metrics = self.executor_kind == "process"
+            executor = self._get_analysis_executor()
+            result = await loop.run_in_executor(
+                executor, analysis.trace_and_filter_job, code_snippet, trace_mode, isolated_metrics, watch,
+                _is_profiling_requested(scope, data))
+            spans.extend(result.pop("spans"))
+            profile_report = result.pop("profile", None)
+            if isolated_metrics:
+                metrics.merge(result.pop("metrics"))
+
+            if result["error"]:
+                routes._store_analysis_results(result)
+                payload, status_code = {"error": result["error"]}, 500
+            else:
+                llm_start = time.perf_counter()
+                visualizations = await analysis.select_visualizations_async(result)
+                spans.append(("llm", time.perf_counter() - llm_start))
+                # Stored in one step (no await in between), so concurrent analyses never interleave
+                routes._store_analysis_results(result, visualizations)
+                print("Code analysis and LLM processing complete.")
+                payload, status_code = routes._success_payload(), 200
+
+        except BrokenProcessPool as e:
+            print(f"Error during analysis route: the analysis worker exited ({str(e)})")
+            self._drop_broken_executor(executor)
+            routes._last_analysis_results["error"] = "Error analyzing code: the analysis worker exited while running it"
+            payload, status_code = {"error": routes._last_analysis_results["error"]}, 500
+
+        except Exception as e:
+            print(f"Error during analysis route: {str(e)}")
+            traceback.print_exc()
+            routes._last_analysis_results["error"] = f"Error analyzing code: {str(e)}"
+            payload, status_code = {"error": routes._last_analysis_results["error"]}, 500
+
+        if profile_report is not None:
+            payload["profile"] = profile_report
+        await self._send_json(send, payload, status_code, spans, start_time)
+
+    async def _send_json(self, send, payload, status_code, spans, start_time):
+        body = json.dumps(payload).encode("utf-8")
+        total_seconds = time.perf_counter() - start_time
+        metrics.record_phase("total", total_seconds)
+        metrics.increment("serialized_bytes_total", len(body), {"stage": "response"})
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"access-control-allow-origin", b"*"), # Same CORS policy as the Flask app for /api/*
+            (b"server-timing", metrics.server_timing_header(spans + [("total", total_seconds)]).encode("latin-1")),
+            (b"timing-allow-origin", b"*"),
+        ]
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    # --- Everything else: the Flask app through WSGI ---
+
+    async def _call_flask(self, scope, receive, send):
+        body = await _read_body(receive)
+        environ = _build_wsgi_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._wsgi_executor, self._run_wsgi, environ, send, loop)
+
+    def _run_wsgi(self, environ, send, loop):
+        """
+        Runs the Flask app on a bridge thread and sends every chunk of its response as soon
+        as it is produced, so streamed responses (the ndjson of /api/analyze/batch) arrive
+        progressively. Each send is awaited on the loop before the next chunk is taken,
+        which also holds the app back while the client is slow to read.
+        """
+        response_started = {}
+
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            response_started["status"] = status
+            response_started["headers"] = headers
+
+        def send_start():
+            # WSGI apps may call start_response as late as their first chunk
+            status, headers = response_started.pop("status"), response_started.pop("headers")
+            send_now({
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            })
+            response_started["sent"] = True
+
+        iterable = self.flask_app.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if not chunk:
+                    continue
+                if "sent" not in response_started:
+                    send_start()
+                send_now({"type": "http.response.body", "body": chunk, "more_body": True})
+            if "sent" not in response_started:
+                send_start()
+            send_now({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+def _is_profiling_requested(scope, data):
+    """routes._is_profiling_requested for an ASGI scope: `?profile=1` or `"profile": true` in the body."""
+    query = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    query_flag = query.get("profile", [""])[-1].lower() in ("1", "true", "yes")
+    body_flag = bool(data.get("profile")) if isinstance(data, dict) else False
+    return query_flag or body_flag
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def _build_wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI http scope."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name, value = raw_name.decode("latin-1"), raw_value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    if "CONTENT_LENGTH" not in environ:
+        environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def create_asgi_app(executor_kind=ANALYSIS_EXECUTOR, workers=ANALYSIS_WORKERS):
+    """ASGI counterpart of create_app()."""
+    return AsyncTracerApp(create_app(), executor_kind=executor_kind, workers=workers)
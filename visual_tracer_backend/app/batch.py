@@ -0,0 +1,201 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from . import analysis
+from . import metrics
+
+# --- Batch analysis ---
+# Runs many snippets at once (POST /api/analyze/batch, see routes.py). Tracing and
+# filtering run in a pool of worker processes, so a batch uses every core; as soon as a
+# snippet's trace is back, its LLM selections run in a thread pool (they only wait on
+# the network) while the remaining snippets are still being traced.
+#
+# Work is shared within a batch:
+#   - identical snippets (same code, mode and watch list, e.g. unchanged starter code) are traced once
+#     and every copy gets the same result id;
+#   - LLM replies are cached by prompt, and the prompts only contain summary features of
+#     the events (counts, sizes, graph metrics), so most snippets of an assignment are
+#     answered from the cache instead of a new request.
+#
+# run_batch() yields one progress record per snippet as it completes and a summary record
+# with the aggregate throughput at the end.
+
+BATCH_EXECUTOR = os.environ.get("BATCH_EXECUTOR", "process") # "process" or "thread"
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+BATCH_LLM_THREADS = int(os.environ.get("BATCH_LLM_THREADS", 8))
+BATCH_MAX_SNIPPETS = int(os.environ.get("BATCH_MAX_SNIPPETS", 1000))
+
+# The pools live as long as the server, so worker processes are only started once.
+_trace_executor = None
+_llm_executor = None
+_executors_lock = threading.Lock()
+
+
+def _get_executors():
+    global _trace_executor, _llm_executor
+    with _executors_lock:
+        if _trace_executor is None:
+            if BATCH_EXECUTOR == "process":
+                # "spawn" so workers do not inherit the server's threads and open sockets
+                _trace_executor = ProcessPoolExecutor(
+                    max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _trace_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-trace")
+            print(f"Batch: {BATCH_EXECUTOR} trace executor with {BATCH_WORKERS} workers started.")
+        if _llm_executor is None:
+            _llm_executor = ThreadPoolExecutor(max_workers=BATCH_LLM_THREADS, thread_name_prefix="batch-llm")
+        return _trace_executor, _llm_executor
+
+
+def _drop_broken_trace_executor(executor):
+    """
+    Forgets a process pool whose worker died (os._exit() in a snippet, an OOM kill): it fails
+    every later job with BrokenProcessPool, so the next _get_executors() starts a new one.
+    """
+    global _trace_executor
+    with _executors_lock:
+        if _trace_executor is executor:
+            print("Batch: a trace worker died; the trace executor will be restarted.")
+            _trace_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def read_batch_request(data):
+    """
+    Validates an /api/analyze/batch JSON body: {"snippets": [...], "mode"/"watch": optional defaults}.
+    Each snippet is a code string or {"code", "id" (optional, echoed back), "mode", "watch" (optional)}.
+    Returns (snippets, error_message); snippets are {"index", "id", "code", "mode", "watch"} dicts.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("snippets"), list) or not data["snippets"]:
+        return None, "No snippets provided"
+    if len(data["snippets"]) > BATCH_MAX_SNIPPETS:
+        return None, f"Too many snippets ({len(data['snippets'])}), the limit is {BATCH_MAX_SNIPPETS}"
+    default_mode = data.get("mode", "trace")
+    default_watch = data.get("watch")
+    snippets = []
+    for index, entry in enumerate(data["snippets"]):
+        if isinstance(entry, str):
+            entry = {"code": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("code"), str):
+            return None, f"Snippet {index} has no code"
+        code_snippet, trace_mode, watch, request_error = analysis.read_analyze_request(
+            {"code": entry["code"], "mode": entry.get("mode", default_mode), "watch": entry.get("watch", default_watch)})
+        if request_error:
+            return None, f"Snippet {index}: {request_error}"
+        snippets.append({"index": index, "id": entry.get("id", index), "code": code_snippet, "mode": trace_mode, "watch": watch})
+    return snippets, None
+
+
+def _snippet_key(snippet):
+    return (hashlib.sha256(snippet["code"].encode("utf-8")).hexdigest(), snippet["mode"], tuple(sorted(snippet["watch"] or ())))
+
+
+def _select_and_store(result, store_result, with_llm, selection_cache):
+    """LLM selections and storage for one traced snippet (runs in the LLM thread pool)."""
+    visualizations = None
+    if not result["error"] and with_llm:
+        visualizations = analysis.select_visualizations(result, selection_cache)
+    return store_result(result, visualizations)
+
+
+def run_batch(snippets, store_result, with_llm=True):
+    """
+    Analyzes `snippets` (from read_batch_request). `store_result(result, visualizations)`
+    saves one analysis and returns its result id. Yields progress records as snippets
+    finish, then a summary record.
+    """
+    trace_executor, llm_executor = _get_executors()
+    isolated_metrics = BATCH_EXECUTOR == "process"
+    selection_cache = {} # prompt -> raw LLM reply, for this batch only
+    batch_start = time.perf_counter()
+
+    groups = {} # (code hash, mode, watch list) -> snippets with that code
+    for snippet in snippets:
+        groups.setdefault(_snippet_key(snippet), []).append(snippet)
+    metrics.increment("batch_snippets_total", len(snippets))
+    print(f"Batch: {len(snippets)} snippets, {len(groups)} distinct.")
+
+    pending = {} # future -> ("trace" | "store", group key)
+    for key, group in groups.items():
+        try:
+            future = trace_executor.submit(
+                analysis.trace_and_filter_job, group[0]["code"], group[0]["mode"], isolated_metrics, group[0]["watch"])
+        except BrokenProcessPool as e:
+            # A worker died since _get_executors(): the snippet's progress record reports it
+            future = Future()
+            future.set_exception(e)
+        pending[future] = ("trace", key)
+
+    errors = {} # group key -> error message
+    completed = succeeded = total_events = llm_selections = 0
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = pending.pop(future)
+                group = groups[key]
+                if stage == "trace":
+                    try:
+                        result = future.result()
+                    except (Exception, SystemExit) as e: # A job's own exit() must not end the stream
+                        if isinstance(e, BrokenProcessPool):
+                            _drop_broken_trace_executor(trace_executor)
+                        print(f"Batch: error tracing snippet {group[0]['index']}: {e!r}")
+                        result = {"code": {"source": group[0]["code"], "lines": group[0]["code"].split("\n")},
+                                  "error": f"Error analyzing code: {str(e)}", "spans": []}
+                    result.pop("spans", None)
+                    if isolated_metrics and "metrics" in result:
+                        metrics.merge(result.pop("metrics"))
+                    if result["error"]:
+                        errors[key] = result["error"]
+                    elif with_llm:
+                        llm_selections += sum(1 for structure_type in analysis.STRUCTURE_TYPES if result.get(structure_type))
+                    total_events += sum(len(result.get(structure_type) or []) for structure_type in analysis.STRUCTURE_TYPES)
+                    pending[llm_executor.submit(_select_and_store, result, store_result, with_llm, selection_cache)] = ("store", key)
+                    continue
+
+                try:
+                    result_id = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    result_id = None
+                    errors[key] = f"Error storing results: {str(e)}"
+                elapsed_seconds = round(time.perf_counter() - batch_start, 4)
+                for snippet in group:
+                    completed += 1
+                    record = {"type": "progress", "index": snippet["index"], "id": snippet["id"],
+                              "result_id": result_id, "completed": completed, "total": len(snippets),
+                              "elapsed_seconds": elapsed_seconds}
+                    if key in errors:
+                        record.update(status="error", error=errors[key])
+                    else:
+                        record["status"] = "success"
+                        succeeded += 1
+                    yield record
+    finally:
+        # The client went away (generator closed early): drop the work that has not started.
+        for future in pending:
+            future.cancel()
+
+    seconds = time.perf_counter() - batch_start
+    metrics.record_phase("batch", seconds)
+    summary = {
+        "type": "summary",
+        "snippets": len(snippets),
+        "distinct_snippets": len(groups),
+        "succeeded": succeeded,
+        "failed": len(snippets) - succeeded,
+        "seconds": round(seconds, 4),
+        "snippets_per_second": round(len(snippets) / seconds, 2) if seconds else None,
+        "events_per_second": round(total_events / seconds, 2) if seconds else None,
+        "llm_selections": llm_selections,
+        "llm_distinct_prompts": len(selection_cache), # LLM requests actually sent
+    }
+    print(f"Batch complete: {summary}")
+    yield summary
@@ -1,6 +1,7 @@
-import json
 import copy
 
+from . import array_diff
+
 
 def _is_identical_tree_state(tree1, tree2):
     """
@@ -80,6 +81,102 @@ def _is_identical_tree_state(tree1, tree2):
     return True
 
 
+def _apply_array_delta(content, delta, shape):
+    """
+    Return a copy of `content` (a possibly nested list) with the delta applied.
+    `delta["indices"]` are flat (row-major) indices into an array of the given `shape`;
+    `delta["cells"]` are [row, column, value] updates of a 2-D list (see matrix_tracking.py),
+    for which only the changed rows are copied.
+    """
+    if "cells" in delta:
+        updated = list(content)
+        copied_rows = set()
+        for row, column, value in delta["cells"]:
+            if row not in copied_rows:
+                updated[row] = list(updated[row])
+                copied_rows.add(row)
+            updated[row][column] = value
+        return updated
+
+    if not shape or len(shape) == 1:
+        updated = list(content)
+        for index, value in zip(delta["indices"], delta["values"]):
+            updated[index] = value
+        return updated
+
+    updated = copy.deepcopy(content)
+    for index, value in zip(delta["indices"], delta["values"]):
+        position = []
+        for dimension in reversed(shape):
+            index, offset = divmod(index, dimension)
+            position.append(offset)
+        position.reverse()
+        row = updated
+        for offset in position[:-1]:
+            row = row[offset]
+        row[position[-1]] = value
+    return updated
+
+
+def expand_array_deltas(events: list) -> list:
+    """
+    Fill in `content` for delta events (ndarray and 2-D list changes recorded by the tracer
+    as changed indices or cells only), replaying them on top of the last state of the same object (`ref`).
+    Events that carry content are returned unchanged; expanded events are copies.
+    """
+    latest_content_by_ref = {}
+    expanded_events = []
+    for event in events:
+        ref = event.get("ref")
+        delta = event.get("delta")
+        if delta is not None and event.get("content") is None:
+            base_content = latest_content_by_ref.get(ref)
+            if base_content is None:
+                continue # No keyframe to rebuild from
+            event = dict(event, content=_apply_array_delta(base_content, delta, event.get("shape")))
+        if ref is not None and event.get("content") is not None:
+            latest_content_by_ref[ref] = event["content"]
+        expanded_events.append(event)
+    return expanded_events
+
+
+def _is_skipped(event):
+    """Events the filter never keeps, whatever the structure type."""
+    # The tracer records each distinct object once per change; events for other
+    # names bound to the same object carry no content and are skipped here.
+    if event.get("alias_of"):
+        return True
+    # --- Initial Skip Logic (from original client) ---
+    op_details = event.get("operation_details")
+    if op_details and isinstance(op_details, dict):
+        code_detail = op_details.get("code", "")
+        if event.get("operation", "") in ["call", "exit"] and "@staticmethod" in code_detail:
+            return True
+    return False
+
+
+def _diff_array_steps(events, important_variables):
+    """
+    id(event) -> its array_diff diff, for the events the array filter looks at (non-empty
+    lists of important variables), diffed per variable name in one pass over its steps.
+    """
+    contents_by_var = {}
+    events_by_var = {}
+    for event in events:
+        content = event.get("content")
+        name = event.get("name", "")
+        if _is_skipped(event) or name not in important_variables or not content or not isinstance(content, list):
+            continue
+        contents_by_var.setdefault(name, []).append(content)
+        events_by_var.setdefault(name, []).append(event)
+
+    diffs = {}
+    for name, contents in contents_by_var.items():
+        for event, diff in zip(events_by_var[name], array_diff.diff_sequence(contents)):
+            diffs[id(event)] = diff
+    return diffs
+
+
 def filter_data_structure_events(events: list, structure_type: str) -> list:
     """
     Filter data structure events to retain only meaningful visualization-ready data.
@@ -95,12 +192,17 @@ def filter_data_structure_events(events: list, structure_type: str) -> list:
     if not events:
         return []
 
+    if structure_type == "arrays":
+        events = expand_array_deltas(events) # ndarray and 2-D list events may only carry changed indices/cells
+
     # --- Pass 1: Identify Important Variables ---
     important_variables = set()
     # Define names often used locally in recursion/loops that we *might* want to keep for trees
     potentially_recursive_local_names = {"node", "current", "temp_node", "child"}
 
     for event in events:
+        if event.get("alias_of"):
+            continue # Alias events only point at an already recorded object (see tracer)
         name = event.get("name", "")
         operation = event.get("operation", "")
 
@@ -136,9 +238,9 @@ def filter_data_structure_events(events: list, structure_type: str) -> list:
     
     # These dictionaries will store state per variable name for arrays and graphs
     # They are reset for each call to filter_data_structure_events
-    previous_content_json_by_var = {} 
-    array_length_history_by_var = {}
     last_operation_by_var = {}
+    # What every array step changed against the previous step of the same variable (see array_diff.py)
+    array_diffs = _diff_array_steps(events, important_variables) if structure_type == "arrays" else {}
     
     # For graph state hashing, reset per call
     # In the original client, this was self._seen_states, an instance variable.
@@ -146,17 +248,12 @@ def filter_data_structure_events(events: list, structure_type: str) -> list:
     seen_graph_state_hashes = set()
 
     for event in events:
+        if _is_skipped(event):
+            continue
         name = event.get("name", "")
         operation = event.get("operation", "")
         content = event.get("content") # This is the serialized data structure
 
-        # --- Initial Skip Logic (from original client) ---
-        op_details = event.get("operation_details")
-        if op_details and isinstance(op_details, dict):
-            code_detail = op_details.get("code", "")
-            if operation in ["call", "exit"] and "@staticmethod" in code_detail:
-                continue
-        
         is_important_var = name in important_variables
         is_potentially_tree_local = False
         if structure_type == "trees" and name in potentially_recursive_local_names:
@@ -196,33 +293,26 @@ def filter_data_structure_events(events: list, structure_type: str) -> list:
                 continue
 
             is_meaningful_change = False # Default to false, prove it's meaningful
-            current_length = len(content)
-
-            if name not in array_length_history_by_var:
-                array_length_history_by_var[name] = []
+            diff = array_diffs.get(id(event))
 
             # Define critical array operations that always signify a meaningful step
             critical_array_ops = {"create_array", "list_comprehension", "final_state", "append", "insert", "pop", "remove", "extend", "sort", "reverse"}
             
             if operation in critical_array_ops:
                 is_meaningful_change = True
-            elif array_length_history_by_var[name] and current_length != array_length_history_by_var[name][-1]:
-                is_meaningful_change = True # Length changed
+            elif diff is None: # First time seeing this variable's content
+                is_meaningful_change = True
+            elif not array_diff.is_unchanged(diff):
+                is_meaningful_change = True # Content or length changed
             elif name in last_operation_by_var and last_operation_by_var[name] != operation:
                 is_meaningful_change = True # Operation type changed for this var
-            elif name in previous_content_json_by_var:
-                current_content_json = json.dumps(content, sort_keys=True)
-                if current_content_json != previous_content_json_by_var[name]:
-                    is_meaningful_change = True # Content changed
-            else: # First time seeing this variable's content
-                is_meaningful_change = True
-
 
             if is_meaningful_change:
-                previous_content_json_by_var[name] = json.dumps(content, sort_keys=True)
-                array_length_history_by_var[name].append(current_length)
+                # Skipped steps repeat the last kept content, so the diff against the previous
+                # step is also the diff against the previous kept step. The diff goes on a copy:
+                # the caller's raw events stay as the tracer produced them.
                 last_operation_by_var[name] = operation
-                filtered_events.append(event)
+                filtered_events.append(dict(event, diff=diff))
 
         # --- Graph Handling ---
         elif structure_type == "graphs" and content and isinstance(content, dict):
@@ -231,8 +321,10 @@ def filter_data_structure_events(events: list, structure_type: str) -> list:
 
             is_meaningful_change = True
             try:
-                # Hash the full content for more accurate duplicate detection
-                state_hash = hash(json.dumps(content, sort_keys=True))
+                # Hash the full content for more accurate duplicate detection. The sorted
+                # (node, targets) tuples compare like json.dumps(sort_keys=True) without encoding.
+                state_hash = hash(tuple(sorted(
+                    (node, tuple(targets) if isinstance(targets, list) else targets) for node, targets in content.items())))
 
                 if state_hash in seen_graph_state_hashes:
                     critical_graph_ops = {"create_graph", "final_state", "add_edge", "update_node_edges"}
@@ -0,0 +1,65 @@
+import queue
+import threading
+
+# --- Trace event queue ---
+# The trace callback runs inside the user's program: everything it does is added to the
+# program's runtime and shifts the timestamps of the events after it. So the tracer only
+# captures a snapshot of a changed structure on the traced thread (a copy of the list, the
+# adjacency lists, the serialized tree) and submits the rest of the work, building the event
+# (graph metrics, string conversion of graph nodes) and appending it in order, to an
+# EventQueue, whose consumer thread runs it while the program goes on.
+#
+# The queue is bounded: when QUEUE_SIZE calls are pending, submit() blocks until the
+# consumer has caught up (backpressure), so a fast-mutating program cannot pile up
+# snapshots without limit. close() waits until every submitted call has run, so the
+# events are complete before the tracer compiles its result.
+
+class EventQueue:
+    """Runs submitted calls in submission order on one consumer thread."""
+
+    def __init__(self, max_items, name="trace-events"):
+        self._queue = queue.Queue(max_items)
+        self.submitted = 0
+        self.waits = 0 # submit() calls that found the queue full and blocked
+        self.errors = 0
+        self._thread = threading.Thread(target=self._consume, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args):
+        self.submitted += 1
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            self.waits += 1
+            self._queue.put((function, args))
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            function, args = item
+            try:
+                function(*args)
+            except Exception as e:
+                # Same policy as the trace callback: a failed event must not end the trace
+                self.errors += 1
+                print(f"Tracer: Error in event consumer ({getattr(function, '__name__', function)}): {e}")
+
+    def close(self):
+        """Waits until every submitted call has run and stops the consumer."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+class SynchronousEvents:
+    """EventQueue stand-in that runs every call right away, on the traced thread."""
+
+    submitted = waits = errors = 0
+
+    def submit(self, function, *args):
+        self.submitted += 1
+        function(*args)
+
+    def close(self):
+        pass
@@ -0,0 +1,189 @@
+import os
+
+# --- Server-side force-directed graph layout ---
+# Every kept graph event gets a "layout" next to its "content":
+#
+#   "layout": {"positions": {"<node>": [x, y], ...}}
+#
+# in units of the ideal edge length, centered around the origin (the frontend scales
+# them to its drawing area). The simulation is Fruchterman-Reingold, vectorized with
+# NumPy: the repulsion between all pairs of nodes is a few (n, n) array operations per
+# iteration; above EXACT_REPULSION_LIMIT nodes, nodes are instead repelled by the
+# centroids of a GRID_CELLS x GRID_CELLS grid, which is O(n * cells).
+#
+# Steps warm-start from the previous step of the same graph: nodes that already had a
+# position keep it and barely move (WARM_MOBILITY), new nodes start next to their placed
+# neighbours and settle in fewer iterations. When only edges changed, all nodes relax
+# briefly at a low temperature. So the picture stays stable between steps
+# and only what was added moves. Layouts are cached per graph state (node and edge set),
+# so a state that occurs again in the trace gets exactly the same picture.
+#
+# NumPy is optional: without it, graph events are shipped without a layout and the
+# frontend falls back to its own simulation.
+
+GRAPH_LAYOUT = os.environ.get("GRAPH_LAYOUT", "1") == "1" # Set to 0 to ship graphs without coordinates
+COLD_ITERATIONS = 100
+WARM_ITERATIONS = 40
+WARM_MOBILITY = 0.01 # Fraction of its displacement a previously placed node may move while new nodes settle
+EDGES_ONLY_TEMPERATURE = 0.3 # Step limit when only edges changed: every node relaxes a little
+GRAVITY = 0.05 # Pull towards the origin, keeps disconnected components together
+EXACT_REPULSION_LIMIT = 300
+GRID_CELLS = 16
+RANDOM_SEED = 0
+COORDINATE_DIGITS = 3
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def is_available() -> bool:
+    return GRAPH_LAYOUT and _numpy() is not None
+
+
+def graph_state(content):
+    """(nodes, undirected edges) of a serialized graph (see serialize_graph), sorted so equal states compare equal."""
+    nodes = set(content)
+    edges = set()
+    for source, targets in content.items():
+        for target in targets if isinstance(targets, list) else [targets]:
+            nodes.add(target)
+            if target != source: # Self-loops exert no force
+                edges.add((source, target) if source < target else (target, source))
+    return tuple(sorted(nodes)), tuple(sorted(edges))
+
+
+class GraphLayoutCache:
+    """Layouts of the graph states of one trace, keyed by graph_state()."""
+
+    def __init__(self):
+        self.np = _numpy()
+        self.layouts = {} # graph state -> {node: [x, y]}
+
+    def layout(self, content, previous_positions=None):
+        """Positions for one graph state, warm-started from `previous_positions` ({node: [x, y]})."""
+        state = graph_state(content)
+        positions = self.layouts.get(state)
+        if positions is None:
+            positions = self._simulate(state, previous_positions or {})
+            self.layouts[state] = positions
+        return positions
+
+    def _simulate(self, state, previous_positions):
+        np = self.np
+        nodes, edges = state
+        if not nodes:
+            return {}
+        index = {node: i for i, node in enumerate(nodes)}
+        rng = np.random.default_rng(RANDOM_SEED)
+        edge_array = np.array([(index[a], index[b]) for a, b in edges], dtype=np.intp).reshape(-1, 2)
+
+        positions = np.zeros((len(nodes), 2))
+        placed = np.array([node in previous_positions for node in nodes])
+        for i in np.flatnonzero(placed):
+            positions[i] = previous_positions[nodes[i]]
+        warm = bool(placed.any())
+        if warm:
+            # New nodes start at the mean of their placed neighbours (plus jitter), or near the center
+            neighbour_sum = np.zeros_like(positions)
+            neighbour_count = np.zeros(len(nodes))
+            for a, b in ((edge_array[:, 0], edge_array[:, 1]), (edge_array[:, 1], edge_array[:, 0])):
+                from_placed = placed[b]
+                np.add.at(neighbour_sum, a[from_placed], positions[b[from_placed]])
+                np.add.at(neighbour_count, a[from_placed], 1)
+            new = ~placed
+            has_neighbours = new & (neighbour_count > 0)
+            positions[has_neighbours] = neighbour_sum[has_neighbours] / neighbour_count[has_neighbours, None]
+            centroid = positions[placed].mean(axis=0)
+            positions[new & ~has_neighbours] = centroid
+            positions[new] += rng.normal(scale=0.3, size=(int(new.sum()), 2))
+        else:
+            positions = rng.uniform(-1, 1, size=(len(nodes), 2)) * np.sqrt(len(nodes))
+
+        iterations = WARM_ITERATIONS if warm else COLD_ITERATIONS
+        if warm and placed.all():
+            # Same nodes, different edges: nothing new to settle, let the whole graph adjust gently
+            mobility, temperature = 1.0, EDGES_ONLY_TEMPERATURE
+        else:
+            mobility = np.where(placed, WARM_MOBILITY, 1.0)[:, None]
+            temperature = 1.0 if warm else max(1.0, np.sqrt(len(nodes)) / 2)
+        for step in range(iterations):
+            displacement = self._repulsion(positions)
+            if len(edge_array):
+                # Attraction along edges: d^2 / k with k = 1, along the edge
+                delta = positions[edge_array[:, 0]] - positions[edge_array[:, 1]]
+                pull = delta * np.linalg.norm(delta, axis=1)[:, None]
+                for axis in (0, 1):
+                    displacement[:, axis] += (np.bincount(edge_array[:, 1], pull[:, axis], len(nodes))
+                                              - np.bincount(edge_array[:, 0], pull[:, axis], len(nodes)))
+            displacement -= GRAVITY * positions
+            # Move each node by at most the current temperature, which cools linearly
+            length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)[:, None]
+            limit = temperature * (1 - step / iterations)
+            positions += mobility * displacement / length * np.minimum(length, limit)
+
+        if not warm:
+            positions -= positions.mean(axis=0)
+        rounded = np.round(positions, COORDINATE_DIGITS).tolist()
+        return {node: rounded[i] for i, node in enumerate(nodes)}
+
+    def _repulsion(self, positions):
+        """Fruchterman-Reingold repulsion k^2 / d (k = 1) on every node, summed over the others."""
+        np = self.np
+        x, y = positions[:, 0], positions[:, 1]
+        if len(positions) <= EXACT_REPULSION_LIMIT:
+            # x and y as separate contiguous (n, n) arrays: much faster to reduce than one (n, n, 2) array
+            dx = x[:, None] - x[None, :]
+            dy = y[:, None] - y[None, :]
+            inverse_distance_squared = 1.0 / np.maximum(dx * dx + dy * dy, 1e-4)
+            return np.column_stack(((dx * inverse_distance_squared).sum(axis=1),
+                                    (dy * inverse_distance_squared).sum(axis=1)))
+
+        # Grid approximation: every node is repelled by the centroid of each occupied grid
+        # cell, weighted by the number of nodes in it; its own cell counts without itself.
+        low, high = positions.min(axis=0), positions.max(axis=0)
+        cell_size = np.maximum((high - low) / GRID_CELLS, 1e-9)
+        cell_xy = np.minimum(((positions - low) / cell_size).astype(np.intp), GRID_CELLS - 1)
+        cell = cell_xy[:, 0] * GRID_CELLS + cell_xy[:, 1]
+        mass = np.bincount(cell, minlength=GRID_CELLS * GRID_CELLS).astype(float)
+        sum_x = np.bincount(cell, weights=x, minlength=GRID_CELLS * GRID_CELLS)
+        sum_y = np.bincount(cell, weights=y, minlength=GRID_CELLS * GRID_CELLS)
+        # Own cell without the node itself (an empty centroid when the node is alone in it)
+        own_mass = mass[cell] - 1
+        own_x = np.where(own_mass > 0, (sum_x[cell] - x) / np.maximum(own_mass, 1), x)
+        own_y = np.where(own_mass > 0, (sum_y[cell] - y) / np.maximum(own_mass, 1), y)
+
+        occupied = np.flatnonzero(mass)
+        cell_mass = np.broadcast_to(mass[occupied], (len(positions), len(occupied))).copy()
+        cell_x = np.broadcast_to(sum_x[occupied] / mass[occupied], cell_mass.shape).copy()
+        cell_y = np.broadcast_to(sum_y[occupied] / mass[occupied], cell_mass.shape).copy()
+        rows, own_column = np.arange(len(positions)), np.searchsorted(occupied, cell)
+        cell_mass[rows, own_column] = own_mass
+        cell_x[rows, own_column] = own_x
+        cell_y[rows, own_column] = own_y
+
+        dx = x[:, None] - cell_x
+        dy = y[:, None] - cell_y
+        weight = cell_mass / np.maximum(dx * dx + dy * dy, 1e-4)
+        return np.column_stack(((dx * weight).sum(axis=1), (dy * weight).sum(axis=1)))
+
+
+def add_layouts(graph_events):
+    """Attaches a "layout" to every filtered graph event with dict content (in place); warm-starts per graph."""
+    if not is_available():
+        return graph_events
+    cache = GraphLayoutCache()
+    last_positions = {} # graph ref (or name) -> positions of its previous step
+    for event in graph_events:
+        content = event.get("content")
+        if not isinstance(content, dict):
+            continue
+        graph_key = event.get("ref") or event.get("name")
+        positions = cache.layout(content, last_positions.get(graph_key))
+        last_positions[graph_key] = positions
+        event["layout"] = {"positions": positions}
+    return graph_events
@@ -0,0 +1,101 @@
+# --- Incremental graph metrics ---
+# Every graph event recorded by the tracer carries the metrics of its state:
+#
+#   "graph_metrics": {
+#       "nodes": 5,                 keys plus every node that only appears as a target
+#       "edges": 7,                 directed connections (entries of all adjacency lists)
+#       "self_loops": 1,            entries that point back at their own node
+#       "max_out_degree": 3,
+#       "density": 0.35,            edges / (nodes * (nodes - 1)); 1.0 for a single node with edges
+#       "degree_histogram": [1, 2, 1, 1]   number of nodes with out-degree 0, 1, 2, ...
+#   }
+#
+# The metrics are kept per graph object (one GraphMetrics on its tracer record) and updated
+# from the difference between two consecutive states: an add_edge or update_node_edges
+# step only touches the adjacency lists that changed, instead of recounting the whole graph.
+# The filtered events therefore already hold the per-step metric series, which the
+# visualization selection (llm_handler) and the frontend read instead of rescanning content.
+
+
+class GraphMetrics:
+    """Running metrics of one graph; update() with each new serialized state (see serialize_graph)."""
+
+    def __init__(self):
+        self.adjacency = {}        # node -> tuple of targets, as of the last update
+        self.references = {}       # node -> 1 if it is a key, plus 1 per adjacency list entry naming it
+        self.out_degree_counts = {} # out-degree -> number of nodes with it (nodes that are no key have 0)
+        self.edges = 0
+        self.self_loops = 0
+
+    def update(self, content):
+        """Applies the changed adjacency lists of `content` and returns the snapshot."""
+        adjacency = self.adjacency
+        for node in [node for node in adjacency if node not in content]:
+            self._replace(node, None)
+        for node, targets in content.items():
+            targets = tuple(targets) if isinstance(targets, list) else (targets,)
+            if adjacency.get(node) != targets:
+                self._replace(node, targets)
+        return self.snapshot()
+
+    def _replace(self, node, targets):
+        """Swaps the adjacency list of `node` (None: the key was removed) and adjusts the counters."""
+        # `node` leaves the histogram at its old out-degree and comes back at its new one;
+        # other nodes only enter or leave it (at out-degree 0) as their references come and go.
+        if node in self.references:
+            self._add_to_histogram(len(self.adjacency.get(node, ())), -1)
+        old_targets = self.adjacency.pop(node, None)
+        if old_targets is not None:
+            self.edges -= len(old_targets)
+            self.self_loops -= old_targets.count(node)
+            for referenced in (node,) + old_targets:
+                self._release(referenced, node)
+        if targets is not None:
+            self.adjacency[node] = targets
+            self.edges += len(targets)
+            self.self_loops += targets.count(node)
+            for referenced in (node,) + targets:
+                self._reference(referenced, node)
+        if node in self.references:
+            self._add_to_histogram(len(self.adjacency.get(node, ())), 1)
+
+    def _reference(self, node, replaced_node):
+        count = self.references.get(node, 0)
+        self.references[node] = count + 1
+        if count == 0 and node != replaced_node:
+            self._add_to_histogram(0, 1) # A node that is only a target has out-degree 0
+
+    def _release(self, node, replaced_node):
+        count = self.references[node] - 1
+        if count:
+            self.references[node] = count
+        else:
+            del self.references[node]
+            if node != replaced_node:
+                self._add_to_histogram(0, -1)
+
+    def _add_to_histogram(self, degree, delta):
+        count = self.out_degree_counts.get(degree, 0) + delta
+        if count:
+            self.out_degree_counts[degree] = count
+        else:
+            del self.out_degree_counts[degree]
+
+    def snapshot(self):
+        nodes = len(self.references)
+        if nodes > 1:
+            density = self.edges / (nodes * (nodes - 1))
+        else:
+            density = 1.0 if self.edges else 0.0 # A single node with a self-loop
+        max_out_degree = max(self.out_degree_counts, default=0)
+        histogram = [0] * (max_out_degree + 1) if nodes else []
+        for degree, count in self.out_degree_counts.items():
+            histogram[degree] = count
+        return {
+            "nodes": nodes,
+            "edges": self.edges,
+            "self_loops": self.self_loops,
+            "max_out_degree": max_out_degree,
+            "density": density,
+            "degree_histogram": histogram,
+        }
@@ -1,24 +1,36 @@
 import os
 import json
 import re
+import threading
 import traceback
-from mistralai.client import MistralClient
-from mistralai.models.chat_completion import ChatMessage
-
-# Initialize the Mistral Client
-# The API key is loaded from .env by the app factory in __init__.py
-# We can access it here via os.getenv
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
-if not MISTRAL_API_KEY:
-    print("CRITICAL ERROR: Mistral API key is not set in environment for llm_handler.py. Ensure .env is loaded.")
-    mistral_client = None
-else:
-    try:
-        mistral_client = MistralClient(api_key=MISTRAL_API_KEY)
-        print(f"LLM Handler: MistralClient initialized successfully. Key: {MISTRAL_API_KEY[:5]}...")
-    except Exception as e:
-        print(f"LLM Handler: Error initializing MistralClient: {e}")
-        mistral_client = None
+
+from . import llm_providers
+from . import metrics
+
+# --- LLM provider ---
+# Prompts are sent through a provider (see llm_providers.py, LLM_PROVIDER), created when
+# the first LLM request is made, once per process: its connection pool must not be shared
+# by processes forked after it was created (gunicorn --preload, see gunicorn.conf.py), so a
+# process that finds a provider created by another pid makes its own. The API key is
+# loaded from .env by the app factory in __init__.py and read at first use.
+# A provider set with set_provider() (e.g. the benchmark stub) is used as is.
+llm_provider = None
+_llm_provider_pid = None # pid that created llm_provider; None for a provider set from outside
+_llm_provider_lock = threading.Lock()
+
+LLM_MODEL = "mistral-small" # Or your preferred model
+# Ask for the selections of all structure types of an analysis in one request (see
+# "Combined selection" below); set to 0 for one request per structure type
+LLM_COMBINED = os.environ.get("LLM_COMBINED", "1") == "1"
+# Another base URL for the chat API, e.g. the stub server of benchmarks/loadtest.py
+MISTRAL_ENDPOINT = os.environ.get("MISTRAL_ENDPOINT")
+
+# Fallback selections when the LLM is unavailable or fails, per structure type.
+_DEFAULT_SELECTIONS = {
+    "arrays": {"selection": "1", "visualization_type": "TIMELINE_ARRAY"},
+    "trees": {"selection": "1", "visualization_type": "HIERARCHICAL_TREE"},
+    "graphs": {"selection": "1", "visualization_type": "FORCE_DIRECTED"},
+}
 
 
 def _parse_llm_json_response(raw_response: str) -> dict:
@@ -78,320 +90,543 @@ def _parse_llm_json_response(raw_response: str) -> dict:
                 raise ValueError(f"Failed to parse LLM JSON response after multiple attempts: {raw_response}") from e_regex
 
 
-def get_visualization_for_arrays(array_data: list) -> dict:
-    """
-    Selects the best visualization for array data using Mistral AI.
-    Uses the exact prompt and logic from the original client.py.
-    """
-    if not mistral_client:
-        print("LLM Handler: Mistral client not initialized. Returning default array visualization.")
-        return {
-            "selection": "1", "visualization_type": "TIMELINE_ARRAY",
-            "rationale": "Default: Mistral client not available."
-        }
+def get_provider():
+    """The LLM provider of this process (None without an API key), created on first use."""
+    global llm_provider, _llm_provider_pid
+    with _llm_provider_lock:
+        if llm_provider is not None and _llm_provider_pid in (None, os.getpid()):
+            return llm_provider
+        llm_provider = _llm_provider_pid = None
+        api_key = os.getenv("MISTRAL_API_KEY")
+        if not api_key and llm_providers.LLM_PROVIDER != "stub":
+            print("CRITICAL ERROR: Mistral API key is not set in environment for llm_handler.py. Ensure .env is loaded.")
+            return None
+        try:
+            llm_provider = llm_providers.create_provider(api_key, MISTRAL_ENDPOINT)
+            _llm_provider_pid = os.getpid()
+            print(f"LLM Handler: {type(llm_provider).__name__} initialized successfully in process {_llm_provider_pid}.")
+        except Exception as e:
+            print(f"LLM Handler: Error initializing the {llm_providers.LLM_PROVIDER} LLM provider: {e}")
+        return llm_provider
+
+
+def set_provider(provider):
+    """Sends all LLM requests of this process through `provider` (tests, benchmarks)."""
+    global llm_provider, _llm_provider_pid
+    with _llm_provider_lock:
+        llm_provider, _llm_provider_pid = provider, None
+
+
+def reset_provider():
+    """Drops the provider of this process (after a fork); the next request creates a new one."""
+    global llm_provider, _llm_provider_pid
+    with _llm_provider_lock:
+        llm_provider = _llm_provider_pid = None
+
+
+async def close_provider():
+    """Closes the provider's connections (on ASGI shutdown)."""
+    global llm_provider, _llm_provider_pid
+    with _llm_provider_lock:
+        provider, llm_provider, _llm_provider_pid = llm_provider, None, None
+    if provider is not None:
+        await provider.aclose()
+
+
+def _chat_message(role: str, content: str):
+    return llm_providers.ChatMessage(role=role, content=content)
+
+
+# --- Running a selection ---
+# Each _<type>_selection generator builds its prompt, yields the chat messages, receives
+# the raw reply text via send() and returns the parsed selection. The sync functions below
+# drive them with the provider's chat(), the *_async ones with its chat_async(), so both
+# paths share exactly the same prompts and parsing.
+
+def _default_selection(kind: str, rationale: str) -> dict:
+    return dict(_DEFAULT_SELECTIONS[kind], rationale=rationale)
 
+
+def _finish_selection(kind: str, selection_steps, raw_response_content: str) -> dict:
     try:
-        # --- Prompt logic from original client.py ---
-        unique_array_names = set()
-        for event in array_data:
-            name = event.get("name", "")
-            content = event.get("content")
-            if (isinstance(content, list) and
-                "serialized" not in name.lower() and
-                not name.startswith("obj") and
-                name not in ["node", "result", "return_value", "event_data"]): # Filter from original
-                unique_array_names.add(name)
-
-        unique_name_count = len(unique_array_names)
-        array_lengths = []
-        if unique_name_count == 1:
-            array_name = list(unique_array_names)[0]
-            for event in array_data:
-                if event.get("name") == array_name and isinstance(event.get("content"), list):
-                    array_lengths.append(len(event.get("content", [])))
-        length_changes = len(set(array_lengths)) > 1 if array_lengths else False
+        selection_steps.send(raw_response_content)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError(f"{kind} selection did not finish after the LLM reply")
 
-        
-        prompt = (
-            f"EXACT NUMBER OF ARRAYS: {unique_name_count}\n"
-            f"LENGTHS CHANGE: {'Yes' if length_changes else 'No'}\n\n"
-            "MANDATORY DECISION LOGIC:\n\n"
-            f"IF NUMBER OF ARRAYS = {unique_name_count} > 1:\n"
-            "  RETURN: ARRAY_COMPARISON (selection \"3\")\n\n"
-            f"IF NUMBER OF ARRAYS = {unique_name_count} = 1 AND LENGTHS CHANGE = {'Yes' if length_changes else 'No'} = Yes:\n"
-            "  RETURN: TIMELINE_ARRAY (selection \"1\")\n\n"
-            f"IF NUMBER OF ARRAYS = {unique_name_count} = 1 AND LENGTHS CHANGE = {'Yes' if length_changes else 'No'} = No:\n"
-            "  RETURN: ELEMENT_FOCUSED (selection \"2\")\n\n"
-            f"FOR THIS DATA WITH {unique_name_count} ARRAY(S), YOU MUST RETURN:\n"
-            f"{{\n"
-            f"  \"selection\": \"{3 if unique_name_count > 1 else 1 if length_changes else 2}\",\n"
-            f"  \"visualization_type\": \"{('ARRAY_COMPARISON' if unique_name_count > 1 else 'TIMELINE_ARRAY' if length_changes else 'ELEMENT_FOCUSED')}\",\n"
-            f"  \"rationale\": \"{'Multiple arrays detected - using array comparison' if unique_name_count > 1 else 'Single array with changing length - using timeline view' if length_changes else 'Single array with constant length - using element focused view'}\"\n"
-            f"}}\n"
-        )
-        # --- End of prompt logic ---
-
-        print(f"LLM Handler (Arrays): Sending prompt to Mistral:\n{prompt[:500]}...") # Log snippet
-        
-        response = mistral_client.chat(
-            model="mistral-small", # Or your preferred model
-            messages=[
-                ChatMessage(role="system", content="You are an expert in data structure visualization. Return only valid JSON with no escape sequences."),
-                ChatMessage(role="user", content=prompt)
-            ]
-        )
-        
-        raw_response_content = response.choices[0].message.content.strip()
-        print(f"LLM Handler (Arrays): Raw Mistral AI Response:\n{raw_response_content}")
-        
-        selection_data = _parse_llm_json_response(raw_response_content)
-        print(f"LLM Handler (Arrays): Parsed selection: {selection_data}")
-        return selection_data
 
-    except Exception as e:
-        print(f"LLM Handler (Arrays): Error selecting visualization: {e}")
-        traceback.print_exc()
-        return {
-            "selection": "1", "visualization_type": "TIMELINE_ARRAY",
-            "rationale": f"Default selection due to error: {str(e)}"
-        }
+def _selection_failed(kind: str, e: Exception) -> dict:
+    metrics.increment("llm_errors_total", labels={"structure": kind})
+    print(f"LLM Handler ({kind.capitalize()}): Error selecting visualization: {e}")
+    traceback.print_exc()
+    return _default_selection(kind, f"Default selection due to error: {str(e)}")
 
 
-def get_visualization_for_trees(tree_data: list) -> dict:
+def _selection_cache_key(kind: str, messages) -> tuple:
+    return (kind,) + tuple((message.role, message.content) for message in messages)
+
+
+def _run_selection(kind: str, selection_steps, selection_cache=None) -> dict:
     """
-    Selects the best visualization for tree data using Mistral AI.
-    Uses the exact prompt and logic from the original client.py.
+    Sync driver. `selection_cache` (a dict, e.g. one per batch) maps prompts to raw LLM
+    replies: a prompt that was already answered is not sent again. The prompts only
+    contain summary features of the events, so many snippets share them.
     """
-    if not mistral_client:
-        print("LLM Handler: Mistral client not initialized. Returning default tree visualization.")
-        return {
-            "selection": "1", "visualization_type": "HIERARCHICAL_TREE",
-            "rationale": "Default: Mistral client not available."
-        }
+    provider = get_provider()
+    if not provider:
+        print(f"LLM Handler: LLM provider not initialized. Returning default {kind[:-1]} visualization.")
+        return _default_selection(kind, "Default: Mistral client not available.")
+    try:
+        messages = next(selection_steps)
+        cache_key = _selection_cache_key(kind, messages) if selection_cache is not None else None
+        if cache_key is not None and cache_key in selection_cache:
+            metrics.increment("llm_cache_hits_total", labels={"structure": kind})
+            return _finish_selection(kind, selection_steps, selection_cache[cache_key])
+        metrics.increment("llm_requests_total", labels={"structure": kind})
+        with metrics.phase(f"llm_{kind}"):
+            raw_response_content = provider.chat(LLM_MODEL, messages).strip()
+        if cache_key is not None:
+            selection_cache[cache_key] = raw_response_content
+        return _finish_selection(kind, selection_steps, raw_response_content)
+    except Exception as e:
+        return _selection_failed(kind, e)
+
 
+async def _run_selection_async(kind: str, selection_steps) -> dict:
+    provider = get_provider()
+    if not provider:
+        print(f"LLM Handler: LLM provider not initialized. Returning default {kind[:-1]} visualization.")
+        return _default_selection(kind, "Default: Mistral client not available.")
+    try:
+        messages = next(selection_steps)
+        metrics.increment("llm_requests_total", labels={"structure": kind})
+        with metrics.phase(f"llm_{kind}"):
+            raw_response_content = (await provider.chat_async(LLM_MODEL, messages)).strip()
+        return _finish_selection(kind, selection_steps, raw_response_content)
+    except Exception as e:
+        return _selection_failed(kind, e)
+
+
+# --- Combined selection ---
+# With several structure types in one analysis, the user prompts of their selections are
+# sent as sections of one prompt, and the LLM answers with one JSON object holding the
+# reply of every section:
+#
+#   {"arrays": {"selection": ..., "visualization_type": ..., "rationale": ...}, "trees": {...}}
+#
+# Each section's reply is then handed to its own selection steps, so it is parsed, checked
+# and defaulted exactly like the reply to a separate request: a missing or malformed
+# section only falls back for its own structure type.
+
+_COMBINED_SYSTEM_PROMPT = (
+    "You are an expert in data structure visualization. Return only valid JSON with no escape sequences, "
+    "exactly as instructed."
+)
+
+
+def _combined_messages(messages_by_kind: dict):
+    sections = "".join(
+        f"=== SECTION: {kind} ===\n{messages[-1].content}\n\n" for kind, messages in messages_by_kind.items())
+    keys = ", ".join(f'"{kind}": {{...}}' for kind in messages_by_kind)
+    prompt = (
+        "Select a visualization for each of the following data structure types. Each section has its own "
+        "data, rules and the JSON object it asks for; follow every section's rules on their own.\n\n"
+        f"{sections}"
+        "Respond with ONE JSON object that has one key per section, holding the JSON object that section asks for:\n"
+        f"{{{keys}}}\n"
+    )
+    return [
+        _chat_message(role="system", content=_COMBINED_SYSTEM_PROMPT),
+        _chat_message(role="user", content=prompt)
+    ]
+
+
+def _split_combined_reply(raw_response_content: str, kinds) -> dict:
+    """The reply text of every section ("" for a section that is missing or not an object)."""
     try:
+        reply = _parse_llm_json_response(raw_response_content)
+    except ValueError:
+        reply = {}
+    if not isinstance(reply, dict):
+        reply = {}
+    return {kind: json.dumps(reply[kind]) if isinstance(reply.get(kind), dict) else "" for kind in kinds}
+
+
+def _finish_combined_selection(steps_by_kind: dict, raw_response_content: str) -> dict:
+    print(f"LLM Handler (Combined): Raw Mistral AI Response:\n{raw_response_content}")
+    section_replies = _split_combined_reply(raw_response_content, steps_by_kind)
+    selections = {}
+    for kind, selection_steps in steps_by_kind.items():
+        try:
+            selections[kind] = _finish_selection(kind, selection_steps, section_replies[kind])
+        except Exception as e:
+            selections[kind] = _selection_failed(kind, e)
+    return selections
 
-        prompt = (
-            "You are an expert in data structure visualization. Your task is to select the most appropriate "
-            "visualization technique for the given tree operations data.\n\n"
-            f"Tree Data:\n{json.dumps(tree_data, indent=2)}\n\n" # Ensure tree_data is serializable
-            "MANDATORY SELECTION RULES - YOU MUST FOLLOW THESE EXACTLY:\n"
-            "1. EXAMINE THE STRUCTURE FIELDS IN THE JSON - Look at how children are represented\n"
-            "2. IF ANY node has 'left' or 'right' properties → HIERARCHICAL_TREE (selection \"1\")\n"
-            "3. IF ANY node has a 'children' array → RADIAL_TREE (selection \"2\")\n"
-            "4. In case of conflict (some nodes have left/right, others have children), prioritize the ROOT node's structure\n\n"
-            "STRICT DETECTION INSTRUCTIONS:\n"
-            "- Look for the pattern {\"value\": X, \"left\": {...}, \"right\": {...}} → HIERARCHICAL_TREE\n"
-            "- Look for the pattern {\"value\": X, \"children\": [...]} → RADIAL_TREE\n"
-            "- DO NOT consider the number of nodes, tree depth, or node values in your decision\n"
-            "- DO NOT use any other criteria to make your selection\n\n"
-            "CORRECT VISUALIZATION CHOICES:\n"
-            "1. HIERARCHICAL_TREE: Use for ALL trees with 'left' and 'right' properties.\n"
-            "   - Example: {\"value\": 10, \"left\": {\"value\": 5}, \"right\": {\"value\": 15}}\n"
-            "   - Binary trees MUST use hierarchical visualization\n\n"
-            "2. RADIAL_TREE: Use for ALL trees with 'children' arrays.\n"
-            "   - Example: {\"value\": 1, \"children\": [{\"value\": 2}, {\"value\": 3}]}\n"
-            "   - Non-binary trees with children arrays MUST use radial visualization\n\n"
-            "3. TREEMAP: Not applicable for this exercise\n\n"
-            "VERIFICATION PROCESS:\n"
-            "1. Search the entire JSON structure for \"left\" and \"right\" properties\n"
-            "2. Search the entire JSON structure for \"children\" arrays\n"
-            "3. Make selection based SOLELY on the structural pattern found\n\n"
-            "Respond with a JSON object in this exact format:\n"
-            "{\n"
-            "  \"selection\": \"1\",  // Use \"1\" for HIERARCHICAL_TREE, \"2\" for RADIAL_TREE, \"3\" for TREEMAP\n"
-            "  \"visualization_type\": \"HIERARCHICAL_TREE\",  // The name in CAPS matching your selection\n"
-            "  \"rationale\": \"Brief explanation for why this visualization is best\"\n"
-            "}\n"
-        )
-        # --- End of prompt ---
-        
-        print(f"LLM Handler (Trees): Sending prompt to Mistral:\n{prompt[:500]}...") # Log snippet
-
-        response = mistral_client.chat(
-            model="mistral-small", # Or your preferred model
-            messages=[
-                ChatMessage(role="system", content="You are an expert in data structure visualization. Return only valid JSON with no escape sequences."),
-                ChatMessage(role="user", content=prompt)
-            ]
-        )
-        
-        raw_response_content = response.choices[0].message.content.strip()
-        print(f"LLM Handler (Trees): Raw Mistral AI Response:\n{raw_response_content}")
-        
-        selection_data = _parse_llm_json_response(raw_response_content)
-        print(f"LLM Handler (Trees): Parsed selection: {selection_data}")
-        return selection_data
 
+def _start_selections(events_by_kind: dict):
+    """(selection steps, first messages) per structure type; a type whose prompt fails gets its default."""
+    steps_by_kind, messages_by_kind, selections = {}, {}, {}
+    for kind, events in events_by_kind.items():
+        selection_steps = _SELECTION_STEPS[kind](events)
+        try:
+            messages_by_kind[kind] = next(selection_steps)
+            steps_by_kind[kind] = selection_steps
+        except Exception as e:
+            selections[kind] = _selection_failed(kind, e)
+    return steps_by_kind, messages_by_kind, selections
+
+
+def _provider_unavailable(events_by_kind: dict) -> dict:
+    print("LLM Handler: LLM provider not initialized. Returning default visualizations.")
+    return {kind: _default_selection(kind, "Default: Mistral client not available.") for kind in events_by_kind}
+
+
+def get_visualizations_combined(events_by_kind: dict, selection_cache=None) -> dict:
+    """
+    Selects the visualizations of all structure types in `events_by_kind` ({"arrays": [...], ...})
+    with one LLM request. Returns {structure type: selection}; `selection_cache` as in _run_selection.
+    """
+    provider = get_provider()
+    if not provider:
+        return _provider_unavailable(events_by_kind)
+    steps_by_kind, messages_by_kind, selections = _start_selections(events_by_kind)
+    if not steps_by_kind:
+        return selections
+    messages = _combined_messages(messages_by_kind)
+    cache_key = _selection_cache_key("combined", messages) if selection_cache is not None else None
+    if cache_key is not None and cache_key in selection_cache:
+        metrics.increment("llm_cache_hits_total", labels={"structure": "combined"})
+        raw_response_content = selection_cache[cache_key]
+    else:
+        metrics.increment("llm_requests_total", labels={"structure": "combined"})
+        try:
+            with metrics.phase("llm_combined"):
+                raw_response_content = provider.chat(LLM_MODEL, messages).strip()
+        except Exception as e:
+            selections.update((kind, _selection_failed(kind, e)) for kind in steps_by_kind)
+            return selections
+        if cache_key is not None:
+            selection_cache[cache_key] = raw_response_content
+    selections.update(_finish_combined_selection(steps_by_kind, raw_response_content))
+    return selections
+
+
+async def get_visualizations_combined_async(events_by_kind: dict) -> dict:
+    """Same as get_visualizations_combined, but awaits the LLM instead of blocking the thread."""
+    provider = get_provider()
+    if not provider:
+        return _provider_unavailable(events_by_kind)
+    steps_by_kind, messages_by_kind, selections = _start_selections(events_by_kind)
+    if not steps_by_kind:
+        return selections
+    metrics.increment("llm_requests_total", labels={"structure": "combined"})
+    try:
+        with metrics.phase("llm_combined"):
+            raw_response_content = (await provider.chat_async(LLM_MODEL, _combined_messages(messages_by_kind))).strip()
     except Exception as e:
-        print(f"LLM Handler (Trees): Error selecting visualization: {e}")
-        traceback.print_exc()
-        return {
-            "selection": "1", "visualization_type": "HIERARCHICAL_TREE",
-            "rationale": f"Default selection due to error: {str(e)}"
-        }
+        selections.update((kind, _selection_failed(kind, e)) for kind in steps_by_kind)
+        return selections
+    selections.update(_finish_combined_selection(steps_by_kind, raw_response_content))
+    return selections
 
 
-def get_visualization_for_graphs(graph_data: list) -> dict:
+def get_visualization_for_arrays(array_data: list, selection_cache=None) -> dict:
+    """
+    Selects the best visualization for array data using Mistral AI.
+    Uses the exact prompt and logic from the original client.py.
+    """
+    return _run_selection("arrays", _arrays_selection(array_data), selection_cache)
+
+
+async def get_visualization_for_arrays_async(array_data: list) -> dict:
+    """Same as get_visualization_for_arrays, but awaits the LLM instead of blocking the thread."""
+    return await _run_selection_async("arrays", _arrays_selection(array_data))
+
+
+def _arrays_selection(array_data: list):
+    """Selection steps for arrays (see "Running a selection" above)."""
+    # --- Prompt logic from original client.py ---
+    unique_array_names = set()
+    for event in array_data:
+        name = event.get("name", "")
+        content = event.get("content")
+        if (isinstance(content, list) and
+            "serialized" not in name.lower() and
+            not name.startswith("obj") and
+            name not in ["node", "result", "return_value", "event_data"]): # Filter from original
+            unique_array_names.add(name)
+
+    unique_name_count = len(unique_array_names)
+    array_lengths = []
+    if unique_name_count == 1:
+        array_name = list(unique_array_names)[0]
+        for event in array_data:
+            if event.get("name") == array_name and isinstance(event.get("content"), list):
+                array_lengths.append(len(event.get("content", [])))
+    length_changes = len(set(array_lengths)) > 1 if array_lengths else False
+
+    
+    prompt = (
+        f"EXACT NUMBER OF ARRAYS: {unique_name_count}\n"
+        f"LENGTHS CHANGE: {'Yes' if length_changes else 'No'}\n\n"
+        "MANDATORY DECISION LOGIC:\n\n"
+        f"IF NUMBER OF ARRAYS = {unique_name_count} > 1:\n"
+        "  RETURN: ARRAY_COMPARISON (selection \"3\")\n\n"
+        f"IF NUMBER OF ARRAYS = {unique_name_count} = 1 AND LENGTHS CHANGE = {'Yes' if length_changes else 'No'} = Yes:\n"
+        "  RETURN: TIMELINE_ARRAY (selection \"1\")\n\n"
+        f"IF NUMBER OF ARRAYS = {unique_name_count} = 1 AND LENGTHS CHANGE = {'Yes' if length_changes else 'No'} = No:\n"
+        "  RETURN: ELEMENT_FOCUSED (selection \"2\")\n\n"
+        f"FOR THIS DATA WITH {unique_name_count} ARRAY(S), YOU MUST RETURN:\n"
+        f"{{\n"
+        f"  \"selection\": \"{3 if unique_name_count > 1 else 1 if length_changes else 2}\",\n"
+        f"  \"visualization_type\": \"{('ARRAY_COMPARISON' if unique_name_count > 1 else 'TIMELINE_ARRAY' if length_changes else 'ELEMENT_FOCUSED')}\",\n"
+        f"  \"rationale\": \"{'Multiple arrays detected - using array comparison' if unique_name_count > 1 else 'Single array with changing length - using timeline view' if length_changes else 'Single array with constant length - using element focused view'}\"\n"
+        f"}}\n"
+    )
+    # --- End of prompt logic ---
+
+    print(f"LLM Handler (Arrays): Sending prompt to Mistral:\n{prompt[:500]}...") # Log snippet
+
+    raw_response_content = yield [
+        _chat_message(role="system", content="You are an expert in data structure visualization. Return only valid JSON with no escape sequences."),
+        _chat_message(role="user", content=prompt)
+    ]
+    print(f"LLM Handler (Arrays): Raw Mistral AI Response:\n{raw_response_content}")
+    
+    selection_data = _parse_llm_json_response(raw_response_content)
+    print(f"LLM Handler (Arrays): Parsed selection: {selection_data}")
+    return selection_data
+
+
+def get_visualization_for_trees(tree_data: list, selection_cache=None) -> dict:
+    """
+    Selects the best visualization for tree data using Mistral AI.
+    Uses the exact prompt and logic from the original client.py.
+    """
+    return _run_selection("trees", _trees_selection(tree_data), selection_cache)
+
+
+async def get_visualization_for_trees_async(tree_data: list) -> dict:
+    """Same as get_visualization_for_trees, but awaits the LLM instead of blocking the thread."""
+    return await _run_selection_async("trees", _trees_selection(tree_data))
+
+
+def _trees_selection(tree_data: list):
+    """Selection steps for trees (see "Running a selection" above)."""
+    # The server-side "layout" of every event (tree_layout.py) is for the frontend: the rules
+    # below only look at the tree fields, and the coordinates would multiply the prompt size
+    tree_data = [{key: value for key, value in event.items() if key != "layout"} for event in tree_data]
+    prompt = (
+        "You are an expert in data structure visualization. Your task is to select the most appropriate "
+        "visualization technique for the given tree operations data.\n\n"
+        f"Tree Data:\n{json.dumps(tree_data, indent=2)}\n\n" # Ensure tree_data is serializable
+        "MANDATORY SELECTION RULES - YOU MUST FOLLOW THESE EXACTLY:\n"
+        "1. EXAMINE THE STRUCTURE FIELDS IN THE JSON - Look at how children are represented\n"
+        "2. IF ANY node has 'left' or 'right' properties → HIERARCHICAL_TREE (selection \"1\")\n"
+        "3. IF ANY node has a 'children' array → RADIAL_TREE (selection \"2\")\n"
+        "4. In case of conflict (some nodes have left/right, others have children), prioritize the ROOT node's structure\n\n"
+        "STRICT DETECTION INSTRUCTIONS:\n"
+        "- Look for the pattern {\"value\": X, \"left\": {...}, \"right\": {...}} → HIERARCHICAL_TREE\n"
+        "- Look for the pattern {\"value\": X, \"children\": [...]} → RADIAL_TREE\n"
+        "- DO NOT consider the number of nodes, tree depth, or node values in your decision\n"
+        "- DO NOT use any other criteria to make your selection\n\n"
+        "CORRECT VISUALIZATION CHOICES:\n"
+        "1. HIERARCHICAL_TREE: Use for ALL trees with 'left' and 'right' properties.\n"
+        "   - Example: {\"value\": 10, \"left\": {\"value\": 5}, \"right\": {\"value\": 15}}\n"
+        "   - Binary trees MUST use hierarchical visualization\n\n"
+        "2. RADIAL_TREE: Use for ALL trees with 'children' arrays.\n"
+        "   - Example: {\"value\": 1, \"children\": [{\"value\": 2}, {\"value\": 3}]}\n"
+        "   - Non-binary trees with children arrays MUST use radial visualization\n\n"
+        "3. TREEMAP: Not applicable for this exercise\n\n"
+        "VERIFICATION PROCESS:\n"
+        "1. Search the entire JSON structure for \"left\" and \"right\" properties\n"
+        "2. Search the entire JSON structure for \"children\" arrays\n"
+        "3. Make selection based SOLELY on the structural pattern found\n\n"
+        "Respond with a JSON object in this exact format:\n"
+        "{\n"
+        "  \"selection\": \"1\",  // Use \"1\" for HIERARCHICAL_TREE, \"2\" for RADIAL_TREE, \"3\" for TREEMAP\n"
+        "  \"visualization_type\": \"HIERARCHICAL_TREE\",  // The name in CAPS matching your selection\n"
+        "  \"rationale\": \"Brief explanation for why this visualization is best\"\n"
+        "}\n"
+    )
+    # --- End of prompt ---
+    
+    print(f"LLM Handler (Trees): Sending prompt to Mistral:\n{prompt[:500]}...") # Log snippet
+
+    raw_response_content = yield [
+        _chat_message(role="system", content="You are an expert in data structure visualization. Return only valid JSON with no escape sequences."),
+        _chat_message(role="user", content=prompt)
+    ]
+    print(f"LLM Handler (Trees): Raw Mistral AI Response:\n{raw_response_content}")
+    
+    selection_data = _parse_llm_json_response(raw_response_content)
+    print(f"LLM Handler (Trees): Parsed selection: {selection_data}")
+    return selection_data
+
+
+def get_visualization_for_graphs(graph_data: list, selection_cache=None) -> dict:
     """
     Selects the best visualization for graph data.
     Calculates metrics in Python and provides them to Mistral AI for a deterministic decision.
     """
-    if not mistral_client:
-        print("LLM Handler: Mistral client not initialized. Returning default graph visualization.")
-        return {
-            "selection": "1", "visualization_type": "FORCE_DIRECTED",
-            "rationale": "Default: Mistral client not available."
-        }
-
-    try:
-        # --- Calculate graph metrics from the LATEST graph state ---
-        num_nodes = 0
-        total_directed_connections = 0
-        max_outgoing_connections = 0
-        connection_density = 0.0
-
-        # Use the content of the last event in graph_data, assuming it's the most complete/recent state
-        # If graph_data is empty, or last event has no content, metrics will remain 0.
-        latest_graph_content = None
-        if graph_data and len(graph_data) > 0:
-            # Iterate backwards to find the last event with graph content
-            for event in reversed(graph_data):
-                if event.get("content") and isinstance(event.get("content"), dict):
-                    latest_graph_content = event.get("content")
-                    break
-        
-        if latest_graph_content:
-            # 1. Count nodes
-            # A node exists if it's a key or if it appears in any adjacency list.
-            nodes_set = set(latest_graph_content.keys())
-            for adj_list in latest_graph_content.values():
-                if isinstance(adj_list, list):
-                    for target_node in adj_list:
-                        nodes_set.add(str(target_node)) # Ensure nodes are strings for consistency
-            num_nodes = len(nodes_set)
-
-            # 2. Count total directed connections & max outgoing connections
-            current_max_outgoing = 0
-            for source_node, adj_list in latest_graph_content.items():
-                if isinstance(adj_list, list):
-                    num_outgoing = len(adj_list)
-                    total_directed_connections += num_outgoing
-                    if num_outgoing > current_max_outgoing:
-                        current_max_outgoing = num_outgoing
-            max_outgoing_connections = current_max_outgoing
-            
-            # 3. Calculate connection density
-            if num_nodes > 1: # Density is undefined for 0 or 1 node.
-                # For directed graph, max possible edges = N * (N-1)
-                max_possible_connections = num_nodes * (num_nodes - 1)
-                if max_possible_connections > 0:
-                    connection_density = total_directed_connections / max_possible_connections
-                else: # Handles num_nodes = 1 case specifically where denominator is 0
-                    connection_density = 0.0 # Or 1.0 if self-loops considered and present
-            elif num_nodes == 1 and total_directed_connections > 0 : # Single node with self-loop
-                connection_density = 1.0 
-            else: # 0 nodes, or 1 node with no self-loop
-                connection_density = 0.0
-
-        # --- Determine visualization type and rationale based on calculated metrics ---
-        viz_type = "FORCE_DIRECTED"
-        selection = "1"
+    return _run_selection("graphs", _graphs_selection(graph_data), selection_cache)
+
+
+async def get_visualization_for_graphs_async(graph_data: list) -> dict:
+    """Same as get_visualization_for_graphs, but awaits the LLM instead of blocking the thread."""
+    return await _run_selection_async("graphs", _graphs_selection(graph_data))
+
+
+def _graphs_selection(graph_data: list):
+    """Selection steps for graphs; the decision itself is computed here, the LLM only confirms it."""
+    # --- Calculate graph metrics from the LATEST graph state ---
+    num_nodes = 0
+    total_directed_connections = 0
+    max_outgoing_connections = 0
+    connection_density = 0.0
+
+    # Use the content of the last event in graph_data, assuming it's the most complete/recent state
+    # If graph_data is empty, or last event has no content, metrics will remain 0.
+    latest_graph_content = None
+    latest_graph_metrics = None
+    if graph_data and len(graph_data) > 0:
+        # Iterate backwards to find the last event with graph content
+        for event in reversed(graph_data):
+            if event.get("content") and isinstance(event.get("content"), dict):
+                latest_graph_content = event.get("content")
+                latest_graph_metrics = event.get("graph_metrics")
+                break
+
+    if latest_graph_metrics:
+        # Maintained by the tracer while recording (see graph_metrics.py), no rescan needed
+        num_nodes = latest_graph_metrics["nodes"]
+        total_directed_connections = latest_graph_metrics["edges"]
+        max_outgoing_connections = latest_graph_metrics["max_out_degree"]
+        connection_density = latest_graph_metrics["density"]
+    elif latest_graph_content:
+        # 1. Count nodes
+        # A node exists if it's a key or if it appears in any adjacency list.
+        nodes_set = set(latest_graph_content.keys())
+        for adj_list in latest_graph_content.values():
+            if isinstance(adj_list, list):
+                for target_node in adj_list:
+                    nodes_set.add(str(target_node)) # Ensure nodes are strings for consistency
+        num_nodes = len(nodes_set)
+
+        # 2. Count total directed connections & max outgoing connections
+        current_max_outgoing = 0
+        for source_node, adj_list in latest_graph_content.items():
+            if isinstance(adj_list, list):
+                num_outgoing = len(adj_list)
+                total_directed_connections += num_outgoing
+                if num_outgoing > current_max_outgoing:
+                    current_max_outgoing = num_outgoing
+        max_outgoing_connections = current_max_outgoing
         
-        # Rule 4: IF CONNECTION DENSITY > 0.25 → ADJACENCY_MATRIX
-        if connection_density > 0.25:
-            viz_type = "ADJACENCY_MATRIX"
-            selection = "2"
-        # Rule 5: IF ANY NODE HAS MORE THAN 3 OUTGOING CONNECTIONS → ADJACENCY_MATRIX
-        # This rule overrides the previous one if it leads to Adjacency Matrix
-        if max_outgoing_connections > 3:
-            viz_type = "ADJACENCY_MATRIX"
-            selection = "2"
-            
-        rationale = (
-            f"Calculated metrics: Nodes: {num_nodes}, Total Directed Connections: {total_directed_connections}, "
-            f"Connection Density: {connection_density:.3f}, Max Outgoing Connections: {max_outgoing_connections}. "
-            f"Based on these metrics, {viz_type} was selected."
-        )
-        if viz_type == "ADJACENCY_MATRIX":
-            if connection_density > 0.25 and max_outgoing_connections > 3:
-                 rationale = (f"Connection density ({connection_density:.3f}) is > 0.25 AND "
-                              f"max outgoing connections ({max_outgoing_connections}) is > 3. ADJACENCY_MATRIX selected.")
-            elif connection_density > 0.25:
-                rationale = f"Connection density ({connection_density:.3f}) is > 0.25. ADJACENCY_MATRIX selected."
-            elif max_outgoing_connections > 3:
-                 rationale = f"Max outgoing connections ({max_outgoing_connections}) is > 3. ADJACENCY_MATRIX selected."
-        else: # FORCE_DIRECTED
-            rationale = (f"Connection density ({connection_density:.3f}) is not > 0.25 AND "
-                         f"max outgoing connections ({max_outgoing_connections}) is not > 3. FORCE_DIRECTED selected.")
-
-
-        # --- Construct the prompt for LLM, providing calculated values ---
-        # The LLM is now just confirming the decision based on given numbers and outputting the JSON.
-        # We also tell the LLM the decision we made in Python code.
-        prompt = (
-            f"CALCULATED NUMBER OF NODES: {num_nodes}\n"
-            f"CALCULATED TOTAL DIRECTED CONNECTIONS: {total_directed_connections}\n"
-            f"CALCULATED CONNECTION DENSITY: {connection_density:.3f}\n" # Use a reasonable precision
-            f"CALCULATED MAXIMUM OUTGOING CONNECTIONS FOR ANY NODE: {max_outgoing_connections}\n\n"
-            "MANDATORY SELECTION RULES - YOU MUST FOLLOW THESE EXACTLY:\n"
-            "1. IF CALCULATED CONNECTION DENSITY > 0.25 → ADJACENCY_MATRIX (selection \"2\")\n"
-            "2. IF CALCULATED MAXIMUM OUTGOING CONNECTIONS FOR ANY NODE > 3 → ADJACENCY_MATRIX (selection \"2\")\n"
-            "3. OTHERWISE → FORCE_DIRECTED (selection \"1\")\n\n"
-            "Based on the above CALCULATED values and the MANDATORY SELECTION RULES, the chosen visualization is "
-            f"{viz_type} (selection \"{selection}\").\n\n"
-            "YOU MUST RETURN THE FOLLOWING JSON OBJECT EXACTLY AS SPECIFIED, REFLECTING THIS DECISION:\n"
-            "{\n"
-            f"  \"selection\": \"{selection}\",\n"
-            f"  \"visualization_type\": \"{viz_type}\",\n"
-            f"  \"rationale\": \"{rationale}\"\n"
-            "}\n"
-        )
-
-        print(f"LLM Handler (Graphs): Sending prompt to Mistral:\n{prompt[:600]}...")
-
-        response = mistral_client.chat(
-            model="mistral-small", 
-            messages=[
-                ChatMessage(role="system", content="You are an expert in data structure visualization. Return only valid JSON with no escape sequences, exactly as instructed."),
-                ChatMessage(role="user", content=prompt)
-            ]
-        )
-        
-        raw_response_content = response.choices[0].message.content.strip()
-        print(f"LLM Handler (Graphs): Raw Mistral AI Response:\n{raw_response_content}")
+        # 3. Calculate connection density
+        if num_nodes > 1: # Density is undefined for 0 or 1 node.
+            # For directed graph, max possible edges = N * (N-1)
+            max_possible_connections = num_nodes * (num_nodes - 1)
+            if max_possible_connections > 0:
+                connection_density = total_directed_connections / max_possible_connections
+            else: # Handles num_nodes = 1 case specifically where denominator is 0
+                connection_density = 0.0 # Or 1.0 if self-loops considered and present
+        elif num_nodes == 1 and total_directed_connections > 0 : # Single node with self-loop
+            connection_density = 1.0 
+        else: # 0 nodes, or 1 node with no self-loop
+            connection_density = 0.0
+
+    # --- Determine visualization type and rationale based on calculated metrics ---
+    viz_type = "FORCE_DIRECTED"
+    selection = "1"
+    
+    # Rule 4: IF CONNECTION DENSITY > 0.25 → ADJACENCY_MATRIX
+    if connection_density > 0.25:
+        viz_type = "ADJACENCY_MATRIX"
+        selection = "2"
+    # Rule 5: IF ANY NODE HAS MORE THAN 3 OUTGOING CONNECTIONS → ADJACENCY_MATRIX
+    # This rule overrides the previous one if it leads to Adjacency Matrix
+    if max_outgoing_connections > 3:
+        viz_type = "ADJACENCY_MATRIX"
+        selection = "2"
         
-        # Attempt to parse the response. If it's malformed but the Python logic is sound,
-        # we can potentially fall back to the Python-determined values.
-        try:
-            selection_data = _parse_llm_json_response(raw_response_content)
-            # Verify LLM output against Python calculation for safety, though it should match.
-            if selection_data.get("visualization_type") != viz_type or \
-               selection_data.get("selection") != selection:
-                print(f"LLM Handler (Graphs): Warning - LLM output differs from Python pre-calculation. LLM: {selection_data}, Python: {{'selection': '{selection}', 'visualization_type': '{viz_type}'}}. Using Python's determination.")
-                selection_data = {
-                    "selection": selection,
-                    "visualization_type": viz_type,
-                    "rationale": rationale + " (Decision confirmed by Python pre-calculation due to LLM output discrepancy)."
-                }
-        except ValueError:
-             print(f"LLM Handler (Graphs): LLM response parsing failed. Falling back to Python pre-calculated decision.")
-             selection_data = {
+    rationale = (
+        f"Calculated metrics: Nodes: {num_nodes}, Total Directed Connections: {total_directed_connections}, "
+        f"Connection Density: {connection_density:.3f}, Max Outgoing Connections: {max_outgoing_connections}. "
+        f"Based on these metrics, {viz_type} was selected."
+    )
+    if viz_type == "ADJACENCY_MATRIX":
+        if connection_density > 0.25 and max_outgoing_connections > 3:
+             rationale = (f"Connection density ({connection_density:.3f}) is > 0.25 AND "
+                          f"max outgoing connections ({max_outgoing_connections}) is > 3. ADJACENCY_MATRIX selected.")
+        elif connection_density > 0.25:
+            rationale = f"Connection density ({connection_density:.3f}) is > 0.25. ADJACENCY_MATRIX selected."
+        elif max_outgoing_connections > 3:
+             rationale = f"Max outgoing connections ({max_outgoing_connections}) is > 3. ADJACENCY_MATRIX selected."
+    else: # FORCE_DIRECTED
+        rationale = (f"Connection density ({connection_density:.3f}) is not > 0.25 AND "
+                     f"max outgoing connections ({max_outgoing_connections}) is not > 3. FORCE_DIRECTED selected.")
+
+
+    # --- Construct the prompt for LLM, providing calculated values ---
+    # The LLM is now just confirming the decision based on given numbers and outputting the JSON.
+    # We also tell the LLM the decision we made in Python code.
+    prompt = (
+        f"CALCULATED NUMBER OF NODES: {num_nodes}\n"
+        f"CALCULATED TOTAL DIRECTED CONNECTIONS: {total_directed_connections}\n"
+        f"CALCULATED CONNECTION DENSITY: {connection_density:.3f}\n" # Use a reasonable precision
+        f"CALCULATED MAXIMUM OUTGOING CONNECTIONS FOR ANY NODE: {max_outgoing_connections}\n\n"
+        "MANDATORY SELECTION RULES - YOU MUST FOLLOW THESE EXACTLY:\n"
+        "1. IF CALCULATED CONNECTION DENSITY > 0.25 → ADJACENCY_MATRIX (selection \"2\")\n"
+        "2. IF CALCULATED MAXIMUM OUTGOING CONNECTIONS FOR ANY NODE > 3 → ADJACENCY_MATRIX (selection \"2\")\n"
+        "3. OTHERWISE → FORCE_DIRECTED (selection \"1\")\n\n"
+        "Based on the above CALCULATED values and the MANDATORY SELECTION RULES, the chosen visualization is "
+        f"{viz_type} (selection \"{selection}\").\n\n"
+        "YOU MUST RETURN THE FOLLOWING JSON OBJECT EXACTLY AS SPECIFIED, REFLECTING THIS DECISION:\n"
+        "{\n"
+        f"  \"selection\": \"{selection}\",\n"
+        f"  \"visualization_type\": \"{viz_type}\",\n"
+        f"  \"rationale\": \"{rationale}\"\n"
+        "}\n"
+    )
+
+    print(f"LLM Handler (Graphs): Sending prompt to Mistral:\n{prompt[:600]}...")
+
+    raw_response_content = yield [
+        _chat_message(role="system", content="You are an expert in data structure visualization. Return only valid JSON with no escape sequences, exactly as instructed."),
+        _chat_message(role="user", content=prompt)
+    ]
+    print(f"LLM Handler (Graphs): Raw Mistral AI Response:\n{raw_response_content}")
+    
+    # Attempt to parse the response. If it's malformed but the Python logic is sound,
+    # we can potentially fall back to the Python-determined values.
+    try:
+        selection_data = _parse_llm_json_response(raw_response_content)
+        # Verify LLM output against Python calculation for safety, though it should match.
+        if selection_data.get("visualization_type") != viz_type or \
+           selection_data.get("selection") != selection:
+            print(f"LLM Handler (Graphs): Warning - LLM output differs from Python pre-calculation. LLM: {selection_data}, Python: {{'selection': '{selection}', 'visualization_type': '{viz_type}'}}. Using Python's determination.")
+            selection_data = {
                 "selection": selection,
                 "visualization_type": viz_type,
-                "rationale": rationale + " (Decision made by Python pre-calculation due to LLM response parsing failure)."
+                "rationale": rationale + " (Decision confirmed by Python pre-calculation due to LLM output discrepancy)."
             }
-
-        print(f"LLM Handler (Graphs): Final selection: {selection_data}")
-        return selection_data
-
-    except Exception as e:
-        print(f"LLM Handler (Graphs): Error selecting visualization: {e}")
-        traceback.print_exc()
-        return {
-            "selection": "1", "visualization_type": "FORCE_DIRECTED", # Fallback default
-            "rationale": f"Default selection due to error: {str(e)}"
+    except ValueError:
+         print(f"LLM Handler (Graphs): LLM response parsing failed. Falling back to Python pre-calculated decision.")
+         selection_data = {
+            "selection": selection,
+            "visualization_type": viz_type,
+            "rationale": rationale + " (Decision made by Python pre-calculation due to LLM response parsing failure)."
         }
 
+    print(f"LLM Handler (Graphs): Final selection: {selection_data}")
+    return selection_data
 
 
+# Selection steps per structure type, for the combined selection
+_SELECTION_STEPS = {
+    "arrays": _arrays_selection,
+    "trees": _trees_selection,
+    "graphs": _graphs_selection,
+}
@@ -0,0 +1,277 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from . import metrics
+
+# --- LLM providers ---
+# llm_handler sends its prompts through a provider, any object with
+#
+#   chat(model, messages) -> str                the reply text, blocking
+#   async chat_async(model, messages) -> str    the same from an event loop (ASGI app)
+#   async aclose()                              releases its connections
+#
+# where `messages` is a list of ChatMessage(role, content). LLM_PROVIDER picks one:
+#
+#   http         (default) POST <endpoint>/v1/chat/completions, the OpenAI/Mistral chat
+#                format, over one requests.Session per process for chat() and one
+#                aiohttp.ClientSession per event loop for chat_async(). Each pool keeps up
+#                to LLM_MAX_CONCURRENCY keep-alive connections, so the TCP and TLS setup is
+#                paid once per connection instead of once per request (mistralai 0.0.8's
+#                MistralClient opens a new session for every chat call). At most
+#                LLM_MAX_CONCURRENCY requests per path are in flight: threads wait on a
+#                threading semaphore, coroutines on an asyncio one, so an awaited request
+#                holds no thread. Connection errors, 429 and 5xx are retried with
+#                exponential backoff, at most LLM_MAX_RETRIES times, and all attempts of one
+#                call share LLM_TIMEOUT: a call gives up after about LLM_TIMEOUT seconds
+#                however many retries are left.
+#   mistral-sdk  mistralai's MistralClient / MistralAsyncClient.
+#   stub         no network and no API key: answers every prompt locally with the selection
+#                it spells out, after LLM_STUB_LATENCY seconds (tests, benchmarks).
+#
+# `requests` and `mistralai` are imported when the provider is created, with the first
+# LLM request (see llm_handler); `aiohttp` with the first chat_async().
+
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "http")
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_STUB_LATENCY = float(os.environ.get("LLM_STUB_LATENCY", 0))
+
+DEFAULT_ENDPOINT = "https://api.mistral.ai"
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF = 0.5 # seconds before the first retry, doubled for every further one
+
+ChatMessage = namedtuple("ChatMessage", "role content")
+
+
+class LLMProviderError(Exception):
+    """The endpoint answered, but not with a chat completion."""
+
+
+def _reply_text(status_code, body):
+    """The assistant message of a chat completion response body."""
+    try:
+        reply = json.loads(body)
+    except ValueError:
+        raise LLMProviderError(f"LLM endpoint answered {status_code} with a non-JSON body: {body[:200]}")
+    if status_code >= 400 or not isinstance(reply, dict) or not reply.get("choices"):
+        raise LLMProviderError(f"LLM endpoint answered {status_code}: {str(reply)[:200]}")
+    return reply["choices"][0]["message"]["content"]
+
+
+def _retry_delay(attempt, max_retries, deadline):
+    """Seconds to wait before retrying after failed attempt `attempt` (0-based), or None
+    when no retry is left or the wait would pass the call's deadline."""
+    delay = RETRY_BACKOFF * 2 ** attempt
+    if attempt >= max_retries or time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+class HTTPProvider:
+    """Chat completions over a pooled keep-alive session (see above)."""
+
+    def __init__(self, api_key, endpoint=None, max_concurrency=LLM_MAX_CONCURRENCY,
+                 timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = (endpoint or DEFAULT_ENDPOINT).rstrip("/") + "/v1/chat/completions"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # One host: one pool, with a connection for every request that may be in flight.
+        # Retries are ours (below), so that they stay within the call's deadline.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update(self._headers)
+        # The aiohttp session and its semaphore belong to the event loop they were created
+        # in; both are created by the first chat_async() on a loop
+        self._async_loop = None
+        self._async_session = None
+        self._async_slots = None
+
+    @staticmethod
+    def _body(model, messages):
+        return {"model": model, "messages": [{"role": message.role, "content": message.content} for message in messages]}
+
+    def chat(self, model, messages):
+        body = self._body(model, messages)
+        if not self._slots.acquire(blocking=False):
+            metrics.increment("llm_slot_waits_total")
+            self._slots.acquire()
+        try:
+            return self._post(body)
+        finally:
+            self._slots.release()
+
+    def _post(self, body):
+        import requests
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            response = error = None
+            try:
+                response = self._session.post(self.url, json=body, timeout=max(deadline - time.monotonic(), 0.01))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                return _reply_text(response.status_code, response.text)
+            delay = _retry_delay(attempt, self.max_retries, deadline)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return _reply_text(response.status_code, response.text)
+            time.sleep(delay)
+            attempt += 1
+
+    def _async_state(self):
+        import asyncio
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_loop = loop
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+            self._async_session = aiohttp.ClientSession(
+                headers=self._headers, connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+        return self._async_session, self._async_slots
+
+    async def chat_async(self, model, messages):
+        import asyncio
+        import aiohttp
+        body = self._body(model, messages)
+        session, slots = self._async_state()
+        if slots.locked():
+            metrics.increment("llm_slot_waits_total")
+        async with slots:
+            deadline = time.monotonic() + self.timeout
+            attempt = 0
+            while True:
+                status = error = None
+                try:
+                    timeout = aiohttp.ClientTimeout(total=max(deadline - time.monotonic(), 0.01))
+                    async with session.post(self.url, json=body, timeout=timeout) as response:
+                        status, text = response.status, await response.text()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = e
+                if status is not None and status not in RETRY_STATUS_CODES:
+                    return _reply_text(status, text)
+                delay = _retry_delay(attempt, self.max_retries, deadline)
+                if delay is None:
+                    if error is not None:
+                        raise error
+                    return _reply_text(status, text)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def aclose(self):
+        import asyncio
+        session, loop = self._async_session, self._async_loop
+        self._async_session = self._async_loop = self._async_slots = None
+        # A session left on another (finished) loop cannot be closed from this one
+        if session is not None and loop is asyncio.get_running_loop():
+            await session.close()
+        self._session.close()
+
+
+class MistralSDKProvider:
+    """Chat completions through the mistralai client."""
+
+    def __init__(self, api_key, endpoint=None):
+        from mistralai.client import MistralClient
+        self._options = {"api_key": api_key, **({"endpoint": endpoint} if endpoint else {})}
+        self._client = MistralClient(**self._options)
+        # Created on first use, because its HTTP session belongs to the event loop running then
+        self._async_client = None
+
+    @staticmethod
+    def _messages(messages):
+        from mistralai.models.chat_completion import ChatMessage as SDKChatMessage
+        return [SDKChatMessage(role=message.role, content=message.content) for message in messages]
+
+    def chat(self, model, messages):
+        response = self._client.chat(model=model, messages=self._messages(messages))
+        return response.choices[0].message.content
+
+    async def chat_async(self, model, messages):
+        if self._async_client is None:
+            from mistralai.async_client import MistralAsyncClient
+            self._async_client = MistralAsyncClient(**self._options)
+        response = await self._async_client.chat(model=model, messages=self._messages(messages))
+        return response.choices[0].message.content
+
+    async def aclose(self):
+        client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.close()
+
+
+# --- Stub replies ---
+# The prompts of llm_handler spell out the JSON they expect (arrays, graphs) or an example
+# of it (trees, decided here by the child fields of the tree data). A combined prompt has
+# one "=== SECTION: <type> ===" part per structure type and gets one object per part.
+
+_COMBINED_SECTION = re.compile(r"=== SECTION: (\w+) ===\n")
+
+
+def stub_selection(prompt) -> dict:
+    """The selection one prompt asks for."""
+    selection = re.search(r'"selection":\s*"(\d)"', prompt)
+    visualization_type = re.search(r'"visualization_type":\s*"([A-Z_]+)"', prompt)
+    result = {
+        "selection": selection.group(1) if selection else "1",
+        "visualization_type": visualization_type.group(1) if visualization_type else "TIMELINE_ARRAY",
+        "rationale": "Stub response.",
+    }
+    tree_data = prompt.partition("Tree Data:")[2].partition("MANDATORY SELECTION RULES")[0]
+    if '"children"' in tree_data and '"left"' not in tree_data:
+        result.update(selection="2", visualization_type="RADIAL_TREE")
+    return result
+
+
+def stub_reply(prompt) -> str:
+    """The reply text to a prompt, combined or not."""
+    sections = _COMBINED_SECTION.split(prompt)
+    if len(sections) > 1:
+        return json.dumps({kind: stub_selection(section) for kind, section in zip(sections[1::2], sections[2::2])})
+    return json.dumps(stub_selection(prompt))
+
+
+class StubProvider:
+    """Answers locally (see above), after `latency` seconds."""
+
+    def __init__(self, latency=LLM_STUB_LATENCY):
+        self.latency = latency
+
+    def chat(self, model, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        return stub_reply(messages[-1].content)
+
+    async def chat_async(self, model, messages):
+        if self.latency:
+            import asyncio
+            await asyncio.sleep(self.latency)
+        return stub_reply(messages[-1].content)
+
+    async def aclose(self):
+        pass
+
+
+def create_provider(api_key, endpoint=None):
+    """The provider selected by LLM_PROVIDER."""
+    if LLM_PROVIDER == "http":
+        return HTTPProvider(api_key, endpoint)
+    if LLM_PROVIDER == "mistral-sdk":
+        return MistralSDKProvider(api_key, endpoint)
+    if LLM_PROVIDER == "stub":
+        return StubProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER {LLM_PROVIDER!r} (http, mistral-sdk or stub)")
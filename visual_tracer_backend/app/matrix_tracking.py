@@ -0,0 +1,81 @@
+from . import mutation_tracking
+
+# --- 2-D list (matrix) support for the tracer ---
+# A list of lists (a DP table, a grid, an adjacency matrix) is tracked row by row instead
+# of as one value. The tracker keeps the previous state as a list of row copies; when the
+# table changed, only the rows that differ from their copy are scanned for the changed
+# cells, and the event carries those cells instead of the whole table:
+#
+#   "content": null, "delta": {"cells": [[row, column, value], ...]}, "shape": [rows, columns]
+#
+# ("shape" only for rectangular tables). The data processor rebuilds the full content
+# from these deltas before filtering (data_processor.expand_array_deltas), like it does
+# for ndarray deltas. A keyframe (the full content) is sent for the first state, when the
+# number of rows or the length of a row changed, when more than KEYFRAME_CHANGED_FRACTION
+# of the cells changed, and after KEYFRAME_INTERVAL deltas in a row.
+#
+# States are never modified once stored: a new state is a new list that shares the
+# unchanged row copies with the previous one, so an event's content stays valid.
+
+KEYFRAME_CHANGED_FRACTION = 0.5
+KEYFRAME_INTERVAL = 64
+
+_ROW_TYPES = {list, mutation_tracking.TrackedList}
+
+
+def is_matrix(value) -> bool:
+    """A non-empty list whose items are all lists of non-list values (exactly two levels)."""
+    if not value or type(value[0]) not in _ROW_TYPES: # Rejects flat lists without scanning them
+        return False
+    if not _ROW_TYPES.issuperset(map(type, value)):
+        return False
+    return all(_ROW_TYPES.isdisjoint(map(type, row)) for row in value)
+
+
+def snapshot(matrix):
+    """A state: a copy of every row."""
+    return [list(row) for row in matrix]
+
+
+def describe(matrix) -> dict:
+    """The metadata stored on every matrix event."""
+    columns = len(matrix[0])
+    if all(len(row) == columns for row in matrix):
+        return {"shape": [len(matrix), columns]}
+    return {} # Ragged (e.g. a triangular DP table)
+
+
+def changed_cells(previous, matrix):
+    """
+    [[row, column, value], ...] where `matrix` differs from the `previous` state, or None
+    when the two cannot be compared cell by cell (rows added or removed, a row resized).
+    """
+    if previous is None or len(previous) != len(matrix):
+        return None
+    if previous == matrix: # One comparison in C for the common unchanged case
+        return []
+    cells = []
+    for row_index, row in enumerate(matrix):
+        previous_row = previous[row_index]
+        if previous_row == row:
+            continue
+        if type(previous_row) is not list or len(previous_row) != len(row):
+            return None # The previous state was no table of the same shape
+        cells.extend([row_index, column, value]
+                     for column, (old, value) in enumerate(zip(previous_row, row)) if old != value)
+    return cells
+
+
+def updated_state(previous, matrix, cells):
+    """The state after `cells`: the previous state with new copies of the changed rows."""
+    state = list(previous)
+    for row_index in {cell[0] for cell in cells}:
+        state[row_index] = list(matrix[row_index])
+    return state
+
+
+def needs_keyframe(matrix, cells, deltas_since_keyframe) -> bool:
+    if cells is None or deltas_since_keyframe >= KEYFRAME_INTERVAL:
+        return True
+    cell_count = sum(map(len, matrix))
+    return len(cells) > cell_count * KEYFRAME_CHANGED_FRACTION
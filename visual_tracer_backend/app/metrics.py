@@ -0,0 +1,218 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Process-wide metric registry ---
+# Everything here is in-process and stdlib-only so that the tracer, the data
+# processor and the LLM handler can record timings without knowing about Flask.
+# The routes module renders the registry for /api/metrics (Prometheus text format)
+# and turns the per-request spans into a Server-Timing header.
+
+METRIC_PREFIX = "visual_tracer"
+
+# Upper bounds (in seconds) of the phase duration histogram buckets.
+PHASE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Help strings for the counters we know about. Unknown counters are still exported.
+COUNTER_HELP = {
+    "analyze_requests_total": "Number of /api/analyze requests handled.",
+    "raw_events_total": "Raw data structure events produced by the tracer.",
+    "filtered_events_total": "Events kept by filter_data_structure_events.",
+    "serialized_bytes_total": "Bytes of JSON produced while serializing trace results and responses.",
+    "trace_callbacks_total": "Trace function invocations while executing user code.",
+    "trace_callbacks_skipped_total": "Trace function invocations skipped by the frame filter.",
+    "compile_cache_hits_total": "Snippet compilations served from the compiled code LRU.",
+    "compile_cache_misses_total": "Snippets that had to be compiled.",
+    "trace_event_queue_waits_total": "Snapshots the traced program had to wait for because the event queue was full.",
+    "llm_requests_total": "Chat completion requests sent to the LLM.",
+    "llm_errors_total": "LLM requests that failed or returned unparseable responses.",
+    "llm_slot_waits_total": "LLM requests that waited for a free slot (LLM_MAX_CONCURRENCY requests in flight).",
+}
+
+_lock = threading.Lock()
+_counters = {}          # (name, labels_tuple) -> value
+_phase_histograms = {}  # phase name -> {"buckets": [...], "sum": float, "count": int}
+_request_state = threading.local()
+
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def increment(name: str, amount=1, labels: dict = None):
+    """Add `amount` to the counter `name` (optionally qualified by `labels`)."""
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def record_phase(name: str, seconds: float):
+    """Record one duration for the phase `name` in the histogram and the current request."""
+    with _lock:
+        histogram = _phase_histograms.get(name)
+        if histogram is None:
+            histogram = {"buckets": [0] * len(PHASE_BUCKETS), "sum": 0.0, "count": 0}
+            _phase_histograms[name] = histogram
+        for i, upper_bound in enumerate(PHASE_BUCKETS):
+            if seconds <= upper_bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+    spans = getattr(_request_state, "spans", None)
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def phase(name: str):
+    """Time the enclosed block as the phase `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+# --- Per-request spans ---
+
+def start_request():
+    """Begin collecting phase spans for the request handled by the current thread."""
+    _request_state.spans = []
+
+
+def finish_request() -> list:
+    """Stop collecting spans for the current thread and return them as (name, seconds) pairs."""
+    spans = getattr(_request_state, "spans", None) or []
+    _request_state.spans = None
+    return spans
+
+
+def server_timing_header(spans: list) -> str:
+    """
+    Format (name, seconds) spans as a Server-Timing header value.
+    Repeated phase names are summed so each metric appears once, in first-seen order.
+    """
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items())
+
+
+# --- Opt-in profiling ---
+
+class RequestProfiler:
+    """
+    Wraps cProfile for a single request. When disabled it does nothing, so callers
+    can use it unconditionally: `with RequestProfiler(enabled) as profiler: ...`.
+    After the block, `profiler.report` holds the pstats text (or None if disabled).
+    """
+
+    def __init__(self, enabled: bool, sort_by: str = "cumulative", limit: int = 40):
+        self.enabled = enabled
+        self.sort_by = sort_by
+        self.limit = limit
+        self.report = None
+        self._profile = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profile is not None:
+            self._profile.disable()
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            stats.sort_stats(self.sort_by).print_stats(self.limit)
+            self.report = stream.getvalue()
+            self._profile = None
+        return False
+
+
+# --- Prometheus exposition ---
+
+def _format_labels(label_items):
+    if not label_items:
+        return ""
+    escaped = []
+    for key, value in label_items:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus() -> str:
+    """Render all counters and phase histograms in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {name: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                      for name, h in _phase_histograms.items()}
+
+    lines = []
+    counter_names = sorted({name for name, _ in counters})
+    for name in counter_names:
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {metric} {COUNTER_HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} counter")
+        for (counter_name, label_items), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{metric}{_format_labels(label_items)} {value}")
+
+    if histograms:
+        metric = f"{METRIC_PREFIX}_phase_duration_seconds"
+        lines.append(f"# HELP {metric} Time spent in each analysis phase.")
+        lines.append(f"# TYPE {metric} histogram")
+        for phase_name in sorted(histograms):
+            histogram = histograms[phase_name]
+            for upper_bound, bucket_count in zip(PHASE_BUCKETS, histogram["buckets"]):
+                labels = _format_labels((("phase", phase_name), ("le", repr(upper_bound))))
+                lines.append(f"{metric}_bucket{labels} {bucket_count}")
+            labels = _format_labels((("phase", phase_name), ("le", "+Inf")))
+            lines.append(f"{metric}_bucket{labels} {histogram['count']}")
+            labels = _format_labels((("phase", phase_name),))
+            lines.append(f"{metric}_sum{labels} {histogram['sum']}")
+            lines.append(f"{metric}_count{labels} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+# --- Worker processes ---
+# Analyses run in a process pool (see asgi.py) record into that process's registry.
+# The worker resets it, runs one job and ships a snapshot back; the parent merges it.
+
+def snapshot() -> dict:
+    """A picklable copy of all counters and phase histograms."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "phases": {name: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                       for name, h in _phase_histograms.items()},
+        }
+
+
+def merge(recorded: dict):
+    """Add a snapshot() taken in another process to this registry."""
+    with _lock:
+        for key, value in recorded.get("counters", {}).items():
+            _counters[key] = _counters.get(key, 0) + value
+        for name, other in recorded.get("phases", {}).items():
+            histogram = _phase_histograms.setdefault(
+                name, {"buckets": [0] * len(PHASE_BUCKETS), "sum": 0.0, "count": 0})
+            histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], other["buckets"])]
+            histogram["sum"] += other["sum"]
+            histogram["count"] += other["count"]
+
+
+def reset():
+    """Clear all recorded metrics (mainly useful for benchmarks and local experiments)."""
+    with _lock:
+        _counters.clear()
+        _phase_histograms.clear()
@@ -0,0 +1,421 @@
+import ast
+import sys
+
+# --- Mutation-interception tracing mode ---
+# Instead of polling every frame's locals after every line (sys.settrace), the
+# snippet's AST is rewritten before exec so that:
+#   * list/dict literals, comprehensions and list()/dict() calls build TrackedList /
+#     TrackedDict instances, whose mutating methods report themselves (slices of a
+#     TrackedList taken in the snippet are TrackedLists too), and
+#   * every class of the snippet that sets a value attribute (value/val/data) and a
+#     child attribute (left/right/children) gets a __setattr__ hook, so writes to
+#     those attributes on tree-like instances report themselves, and
+#   * assignments of a container or node to a name (arr = [...], root = Node(5),
+#     left = arr[:mid]) report the binding, which records the structure's initial
+#     state (a creation event) the first time it is bound.
+# Each mutation produces exactly one event, named after the method that ran, so the
+# cost is proportional to the number of mutations instead of the number of lines.
+#
+# This module knows nothing about DataStructureTracker: the tracer starts a session
+# with an `emit` callback and does classification/serialization there.
+
+TRACKED_LIST_NAME = "__tracer_tracked_list__"
+TRACKED_DICT_NAME = "__tracer_tracked_dict__"
+TRACKED_SLICE_NAME = "__tracer_tracked_slice__"
+TRACK_CLASS_NAME = "__tracer_track_node_class__"
+BIND_NAME = "__tracer_bind__"
+NODE_CLASS_MARKER = "__tracer_node_class__" # Set on the classes track_node_class patched
+
+# Attribute writes on tree-like objects and the operation they are reported as.
+TREE_ATTRIBUTE_OPERATIONS = {
+    "value": "update_node_value",
+    "val": "update_node_value",
+    "data": "update_node_value",
+    "left": "set_left_child",
+    "right": "set_right_child",
+    "children": "update_children",
+}
+
+VALUE_ATTRIBUTES = {"value", "val", "data"}
+CHILD_ATTRIBUTES = {"left", "right", "children"}
+
+_session = None # The active _InterceptionSession, or None when no snippet is running
+_MISSING = object()
+
+
+class _InterceptionSession:
+    def __init__(self, emit, bound, snippet_filename):
+        self.emit = emit
+        self.bound = bound
+        self.snippet_filename = snippet_filename
+
+    def user_frame(self):
+        """The innermost frame executing snippet code (the line that caused the mutation)."""
+        frame = sys._getframe(2)
+        while frame is not None and frame.f_code.co_filename != self.snippet_filename:
+            frame = frame.f_back
+        return frame
+
+
+def start_session(emit, bound, snippet_filename):
+    """
+    Route mutations of tracked objects to `emit(kind, obj, operation, args, frame)` and
+    name bindings of tracked objects to `bound(kind, name, obj, frame)` until end_session()
+    is called. `kind` is "list", "dict" or "node"; `frame` is the snippet frame that
+    performed the mutation or assignment (None if it happened outside snippet code).
+    """
+    global _session
+    _session = _InterceptionSession(emit, bound, snippet_filename)
+
+
+def end_session():
+    global _session
+    _session = None
+
+
+def _report(kind, obj, operation, args):
+    session = _session
+    if session is None:
+        return
+    session.emit(kind, obj, operation, args, session.user_frame())
+
+
+def _adopt(container, value):
+    """Remember the container a tracked list/dict was stored in (adjacency lists, children lists)."""
+    if isinstance(value, (TrackedList, TrackedDict)):
+        value._tracer_owner = container
+
+
+def _adopt_rows(container):
+    """
+    Rows of a list built in one go ([[0] * n for _ in range(m)], grid.extend(rows)) belong
+    to it, unless they already belong to another list (a slice or copy of a table does not
+    take its rows over).
+    """
+    if TrackedList in map(type, container): # Scans in C; lists of scalars cost nothing more
+        for item in container:
+            if type(item) is TrackedList and item._tracer_owner is None:
+                item._tracer_owner = container
+
+
+class TrackedList(list):
+    """A list that reports each mutating call as a single event."""
+    __slots__ = ("_tracer_owner",)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._tracer_owner = None
+        _adopt_rows(self)
+
+    def _mutated(self, operation, args):
+        _report("list", self, operation, args)
+
+    def append(self, item):
+        super().append(item)
+        _adopt(self, item)
+        self._mutated("append", (item,))
+
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        _adopt_rows(self)
+        self._mutated("extend", (items,))
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        _adopt(self, item)
+        self._mutated("insert", (index, item))
+
+    def remove(self, item):
+        super().remove(item)
+        self._mutated("remove", (item,))
+
+    def pop(self, *args):
+        item = super().pop(*args)
+        self._mutated("pop", args)
+        return item
+
+    def clear(self):
+        super().clear()
+        self._mutated("clear", ())
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._mutated("sort", ())
+
+    def reverse(self):
+        super().reverse()
+        self._mutated("reverse", ())
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        _adopt(self, value)
+        self._mutated("indexed_assignment", (index, value))
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._mutated("delete_item", (index,))
+
+    def __iadd__(self, items):
+        items = list(items)
+        super().extend(items)
+        _adopt_rows(self)
+        self._mutated("extend", (items,))
+        return self
+
+    def __imul__(self, count):
+        size = len(self)
+        super().__imul__(count)
+        # arr *= n appends n - 1 copies of the items (or empties the list for n < 1)
+        if len(self) >= size:
+            self._mutated("extend", (self[size:],))
+        else:
+            self._mutated("clear", ())
+        return self
+
+    # Derived lists stay tracked, so concatenations and [0] * n tables keep reporting
+    # their own mutations. Index reads are not overridden (they would cost a Python call
+    # each): slices are made tracked where the snippet takes them (see track_slice).
+    def __add__(self, other):
+        return TrackedList(list.__add__(self, other))
+
+    def __mul__(self, count):
+        return TrackedList(list.__mul__(self, count))
+
+    __rmul__ = __mul__
+
+    def copy(self):
+        return TrackedList(self)
+
+
+class TrackedDict(dict):
+    """A dict that reports each mutating call as a single event."""
+    __slots__ = ("_tracer_owner",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tracer_owner = None
+        for value in self.values():
+            _adopt(self, value)
+
+    def _mutated(self, operation, args):
+        _report("dict", self, operation, args)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        _adopt(self, value)
+        self._mutated("update_node_edges", (key, value))
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._mutated("remove_node", (key,))
+
+    def pop(self, key, *default):
+        had_key = key in self
+        value = super().pop(key, *default)
+        if had_key:
+            self._mutated("remove_node", (key,))
+        return value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return super().__getitem__(key)
+        value = super().setdefault(key, default)
+        _adopt(self, value)
+        self._mutated("update_node_edges", (key, value))
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        for value in self.values():
+            _adopt(self, value)
+        self._mutated("update_node_edges", ())
+
+    def clear(self):
+        super().clear()
+        self._mutated("clear", ())
+
+    def copy(self):
+        return TrackedDict(self)
+
+
+def track_list(iterable=()):
+    return iterable if isinstance(iterable, TrackedList) else TrackedList(iterable)
+
+
+def track_dict(mapping=None):
+    if isinstance(mapping, TrackedDict):
+        return mapping
+    return TrackedDict(mapping) if mapping is not None else TrackedDict()
+
+
+def track_slice(sequence, lower, upper, step):
+    """`sequence[lower:upper:step]` in the rewritten snippet: slices of tracked lists stay tracked."""
+    items = sequence[lower:upper:step]
+    return TrackedList(items) if type(sequence) is TrackedList else items
+
+
+def bind(name, value):
+    """`name = value` in the rewritten snippet: reports tracked containers and nodes, returns `value`."""
+    session = _session
+    if session is None:
+        return value
+    value_type = type(value)
+    if value_type is TrackedList:
+        session.bound("list", name, value, session.user_frame())
+    elif value_type is TrackedDict:
+        session.bound("dict", name, value, session.user_frame())
+    elif getattr(value_type, NODE_CLASS_MARKER, False):
+        session.bound("node", name, value, session.user_frame())
+    return value
+
+
+def track_node_class(cls):
+    """Class decorator: report attribute writes that change tree structure or node values."""
+    if getattr(cls, NODE_CLASS_MARKER, False):
+        return cls # A subclass of a patched class: its writes are reported already
+    params = getattr(cls, "__dataclass_params__", None)
+    if params is not None and params.frozen:
+        return cls # Its instances cannot change, and dataclasses refuse a replaced __setattr__
+    original_setattr = cls.__setattr__
+
+    def __setattr__(self, attribute, value):
+        if attribute not in TREE_ATTRIBUTE_OPERATIONS or _session is None:
+            original_setattr(self, attribute, value)
+            return
+        # node.left = insert(node.left, v) re-stores the same child on every level of the path
+        unchanged = getattr(self, attribute, _MISSING) is value
+        original_setattr(self, attribute, value)
+        if unchanged:
+            return
+        _adopt(self, value)
+        # Writes made while the node is still being constructed are not mutations of a tree.
+        caller = sys._getframe(1)
+        if caller.f_code.co_name == "__init__" and caller.f_locals.get("self") is self:
+            return
+        _report("node", self, TREE_ATTRIBUTE_OPERATIONS[attribute], (attribute, value))
+
+    try:
+        cls.__setattr__ = __setattr__
+        setattr(cls, NODE_CLASS_MARKER, True)
+    except (AttributeError, TypeError): # A metaclass that does not allow it: the class stays as it is
+        pass
+    return cls
+
+
+def _assigned_attributes(class_node):
+    """
+    Attributes a class definition gives its instances: self.<name> = ... in its methods,
+    annotated class-level names (dataclass fields) and __slots__ entries.
+    """
+    names = set()
+    for node in ast.walk(class_node):
+        if isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Store) \
+                and isinstance(node.value, ast.Name) and node.value.id == "self":
+            names.add(node.attr)
+    for statement in class_node.body:
+        if isinstance(statement, ast.AnnAssign) and isinstance(statement.target, ast.Name):
+            names.add(statement.target.id)
+        elif isinstance(statement, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == "__slots__" for target in statement.targets):
+            names.update(constant.value for constant in ast.walk(statement.value)
+                         if isinstance(constant, ast.Constant) and isinstance(constant.value, str))
+    return names
+
+
+def _may_bind_structure(value):
+    """
+    Whether an assigned expression can produce a tracked container or node: a call (which
+    includes the rewritten displays, comprehensions and slices) or an expression built
+    from a call ([0] * n). Plain names, constants and arithmetic are not reported, so loop
+    counters cost nothing.
+    """
+    if isinstance(value, ast.Call):
+        return True
+    if isinstance(value, ast.BinOp):
+        return isinstance(value.left, ast.Call) or isinstance(value.right, ast.Call)
+    return False
+
+
+class _TrackingTransformer(ast.NodeTransformer):
+    """Rewrites container construction, name bindings and node classes to use the tracked versions."""
+
+    def _wrap(self, node, wrapper_name):
+        call = ast.Call(func=ast.Name(id=wrapper_name, ctx=ast.Load()), args=[node], keywords=[])
+        return ast.copy_location(call, node)
+
+    def _bind(self, name, value):
+        call = ast.Call(func=ast.Name(id=BIND_NAME, ctx=ast.Load()), args=[ast.Constant(name), value], keywords=[])
+        return ast.copy_location(call, value)
+
+    def visit_List(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load): # [a, b] = ... is an unpacking target
+            return node
+        return self._wrap(node, TRACKED_LIST_NAME)
+
+    def visit_ListComp(self, node):
+        self.generic_visit(node)
+        return self._wrap(node, TRACKED_LIST_NAME)
+
+    def visit_Dict(self, node):
+        self.generic_visit(node)
+        return self._wrap(node, TRACKED_DICT_NAME)
+
+    def visit_DictComp(self, node):
+        self.generic_visit(node)
+        return self._wrap(node, TRACKED_DICT_NAME)
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load) or not isinstance(node.slice, ast.Slice):
+            return node # Index reads stay plain subscripts; slice assignments are __setitem__ calls
+        bounds = [part if part is not None else ast.Constant(None)
+                  for part in (node.slice.lower, node.slice.upper, node.slice.step)]
+        call = ast.Call(func=ast.Name(id=TRACKED_SLICE_NAME, ctx=ast.Load()), args=[node.value, *bounds], keywords=[])
+        return ast.copy_location(call, node)
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in ("list", "dict"):
+            return self._wrap(node, TRACKED_LIST_NAME if node.func.id == "list" else TRACKED_DICT_NAME)
+        return node
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        names = [target.id for target in node.targets if isinstance(target, ast.Name)]
+        if names and _may_bind_structure(node.value):
+            node.value = self._bind(names[0], node.value)
+        return node
+
+    def visit_AnnAssign(self, node):
+        self.generic_visit(node)
+        if node.value is not None and isinstance(node.target, ast.Name) and _may_bind_structure(node.value):
+            node.value = self._bind(node.target.id, node.value)
+        return node
+
+    def visit_ClassDef(self, node):
+        self.generic_visit(node)
+        attributes = _assigned_attributes(node)
+        if attributes & VALUE_ATTRIBUTES and attributes & CHILD_ATTRIBUTES:
+            # Outermost, so it patches the final class (@dataclass(slots=True) returns a new one)
+            node.decorator_list.insert(0, ast.Name(id=TRACK_CLASS_NAME, ctx=ast.Load()))
+        return node
+
+
+def compile_with_interception(source: str, filename: str):
+    """Compile `source` with the tracking rewrite applied. Raises SyntaxError like compile()."""
+    tree = _TrackingTransformer().visit(ast.parse(source, filename, "exec"))
+    ast.fix_missing_locations(tree)
+    return compile(tree, filename, "exec")
+
+
+def interception_globals() -> dict:
+    """The helper names the rewritten code refers to; merge them into the exec globals."""
+    return {
+        TRACKED_LIST_NAME: track_list,
+        TRACKED_DICT_NAME: track_dict,
+        TRACKED_SLICE_NAME: track_slice,
+        TRACK_CLASS_NAME: track_node_class,
+        BIND_NAME: bind,
+    }
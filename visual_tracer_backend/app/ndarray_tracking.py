@@ -0,0 +1,65 @@
+import sys
+
+# --- NumPy ndarray support for the tracer ---
+# NumPy is optional: we never import it ourselves. If the user's snippet imported it,
+# it is in sys.modules and ndarrays found in frames are tracked as arrays.
+#
+# Instead of converting an ndarray to a Python list on every line, the tracker keeps a
+# copy of the array's buffer (same dtype, so 8 bytes per float64 element rather than a
+# list of boxed floats) and compares it with the live array in one vectorized operation.
+# Only the flat indices that changed and their new values go into the event; the data
+# processor rebuilds the full content from these deltas before filtering.
+
+# Emit a full keyframe instead of a delta when more than this fraction of elements changed
+# (e.g. arr *= 2), or after this many deltas in a row, so every array can be rebuilt from
+# a recent keyframe.
+KEYFRAME_CHANGED_FRACTION = 0.5
+KEYFRAME_INTERVAL = 64
+
+
+def _numpy():
+    return sys.modules.get("numpy")
+
+
+def is_ndarray(value) -> bool:
+    """True for a non-scalar numpy.ndarray (only possible once the snippet imported numpy)."""
+    # numpy is in sys.modules as soon as its import starts, e.g. while another request's
+    # thread is importing it: until ndarray is defined, nothing can be an ndarray
+    ndarray = getattr(_numpy(), "ndarray", None)
+    return ndarray is not None and isinstance(value, ndarray) and value.ndim > 0
+
+
+def snapshot(array):
+    """A private copy of the array's buffer to diff the next state against."""
+    return array.copy()
+
+
+def describe(array) -> dict:
+    """The dtype/shape metadata stored on every ndarray event."""
+    return {"dtype": str(array.dtype), "shape": list(array.shape)}
+
+
+def changed_indices(previous, current):
+    """
+    Flat indices where `current` differs from the `previous` snapshot, or None when
+    they cannot be compared element-wise (different shape or dtype).
+    NaNs in the same position are not reported as changes.
+    """
+    np = _numpy()
+    if previous.shape != current.shape or previous.dtype != current.dtype:
+        return None
+    different = previous != current
+    if current.dtype.kind in "fc":
+        different &= ~(np.isnan(previous) & np.isnan(current))
+    return np.flatnonzero(different)
+
+
+def delta(current, indices) -> dict:
+    """The {"indices", "values"} payload of a delta event (plain Python types, JSON-ready)."""
+    return {"indices": indices.tolist(), "values": current.ravel()[indices].tolist()}
+
+
+def needs_keyframe(array, indices, deltas_since_keyframe) -> bool:
+    if indices is None or deltas_since_keyframe >= KEYFRAME_INTERVAL:
+        return True
+    return len(indices) > array.size * KEYFRAME_CHANGED_FRACTION
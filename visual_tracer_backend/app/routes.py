@@ -1,7 +1,10 @@
 import os
 import json
+import threading
+import time
 import traceback
-from flask import current_app, jsonify, request, send_from_directory
+from collections import OrderedDict
+from flask import Response, current_app, jsonify, request, send_from_directory, stream_with_context
 
 # Import the application instance created in __init__.py
 # We will register routes on this instance.
@@ -14,9 +17,13 @@ from flask import current_app, jsonify, request, send_from_directory
 # The @current_app.route decorator will work.
 
 # Import our new backend modules
-from . import tracer
-from . import data_processor
-from . import llm_handler
+from . import adjacency_matrix
+from . import analysis
+from . import array_lod
+from . import batch
+from . import metrics
+from . import trace_store
+from . import tree_view
 
 # --- In-memory store for the last analysis result ---
 # This replaces Redis for simplicity in this refactored version.
@@ -26,7 +33,8 @@ _last_analysis_results = {
     "arrays": {"data": [], "visualization": None},
     "trees": {"data": [], "visualization": None},
     "graphs": {"data": [], "visualization": None},
-    "error": None # To store any processing error from /analyze
+    "error": None, # To store any processing error from /analyze
+    "trace_id": None # Set when the events were written to the trace store instead
 }
 
 # Helper to reset the in-memory store
@@ -37,123 +45,278 @@ def _reset_last_analysis():
         "arrays": {"data": [], "visualization": None},
         "trees": {"data": [], "visualization": None},
         "graphs": {"data": [], "visualization": None},
-        "error": None
+        "error": None,
+        "trace_id": None
     }
 
+# --- Request instrumentation ---
+# Every /api/* request collects phase spans (see metrics.py); they are returned
+# to the client as a Server-Timing header so slow requests can be broken down
+# into tracing, filtering and LLM time straight from the browser dev tools.
+
+@current_app.before_request
+def _start_request_metrics():
+    if request.path.startswith('/api/'):
+        metrics.start_request()
+        request.environ['visual_tracer.start_time'] = time.perf_counter()
+
+@current_app.after_request
+def _finish_request_metrics(response):
+    start_time = request.environ.get('visual_tracer.start_time')
+    if start_time is None:
+        return response
+    metrics.record_phase("total", time.perf_counter() - start_time)
+    spans = metrics.finish_request()
+    if spans:
+        response.headers['Server-Timing'] = metrics.server_timing_header(spans)
+        response.headers['Timing-Allow-Origin'] = '*' # Lets the cross-origin frontend read the timings
+    if not response.direct_passthrough and response.content_length:
+        metrics.increment("serialized_bytes_total", response.content_length, {"stage": "response"})
+    return response
+
+def _is_profiling_requested(data):
+    """Profiling is opt-in per request, via `?profile=1` or `"profile": true` in the JSON body."""
+    query_flag = request.args.get('profile', '').lower() in ('1', 'true', 'yes')
+    body_flag = bool(data.get('profile')) if isinstance(data, dict) else False
+    return query_flag or body_flag
+
+@current_app.route('/api/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @current_app.route('/api/analyze', methods=['POST'])
 def analyze_code_route():
     global _last_analysis_results
     _reset_last_analysis() # Clear previous results on a new analysis
 
     print("Received analyze request")
+    metrics.increment("analyze_requests_total")
     
     data = request.json
     print(f"Request data: {str(data)[:200]}") # Log snippet of data
     
-    if not data or 'code' not in data:
-        print("No code provided in request")
-        _last_analysis_results["error"] = "No code provided"
-        return jsonify({"error": "No code provided"}), 400
-    
-    code_snippet = data['code']
+    code_snippet, trace_mode, watch, request_error = analysis.read_analyze_request(data)
+    if request_error:
+        print(f"Invalid analyze request: {request_error}")
+        _last_analysis_results["error"] = request_error
+        return jsonify({"error": request_error}), 400
     print(f"Received code snippet of length: {len(code_snippet)}")
-    
+
+    with metrics.RequestProfiler(_is_profiling_requested(data)) as profiler:
+        payload, status_code = _analyze_snippet(code_snippet, trace_mode, watch)
+    if profiler.report is not None:
+        payload["profile"] = profiler.report
+    return jsonify(payload), status_code
+
+def _store_analysis_results(result, visualizations=None):
+    """Fills _last_analysis_results from an analysis.trace_and_filter result and its LLM selections."""
+    _last_analysis_results["code"] = result.get("code")
+    _last_analysis_results["error"] = result.get("error")
+    if trace_store.is_enabled():
+        # The events go to disk; only the trace id and the small metadata stay in memory
+        with metrics.phase("trace_store_write"):
+            _last_analysis_results["trace_id"] = trace_store.write_trace(result, visualizations)
+    for structure_type in analysis.STRUCTURE_TYPES:
+        stored = _last_analysis_results["trace_id"] is not None
+        _last_analysis_results[structure_type]["data"] = [] if stored else (result.get(structure_type) or [])
+        _last_analysis_results[structure_type]["visualization"] = (visualizations or {}).get(structure_type)
+
+# --- Saved results (batch analyses) ---
+# Batch results must not overwrite _last_analysis_results, so each one is saved under
+# its own result id: in the trace store when it is enabled, otherwise here in memory
+# (the oldest are dropped beyond SAVED_RESULTS_LIMIT). GET routes serve them with
+# ?trace_id=<result id>, exactly like stored traces.
+SAVED_RESULTS_LIMIT = int(os.environ.get("SAVED_RESULTS_LIMIT", 1000))
+_saved_results = OrderedDict() # result id -> results in the _last_analysis_results shape
+_saved_results_lock = threading.Lock()
+
+def _save_result(result, visualizations=None):
+    """Saves one analysis without touching _last_analysis_results; returns its result id."""
+    if trace_store.is_enabled():
+        return trace_store.write_trace(result, visualizations)
+    result_id = trace_store.new_trace_id()
+    saved = {"code": result.get("code"), "error": result.get("error"), "trace_id": result_id}
+    for structure_type in analysis.STRUCTURE_TYPES:
+        saved[structure_type] = {"data": result.get(structure_type) or [],
+                                 "visualization": (visualizations or {}).get(structure_type)}
+    with _saved_results_lock:
+        _saved_results[result_id] = saved
+        while len(_saved_results) > SAVED_RESULTS_LIMIT:
+            _saved_results.popitem(last=False)
+    return result_id
+
+def _success_payload():
+    payload = {"status": "success", "message": "Code analysis complete"}
+    if _last_analysis_results["trace_id"]:
+        payload["trace_id"] = _last_analysis_results["trace_id"]
+    return payload
+
+# --- Reading results back ---
+# GET routes serve the last analysis by default, or any stored trace with ?trace_id=.
+# Stored traces are read through trace_store.TraceReader, which decodes only the steps
+# asked for (see ?start=&count= on /api/data/<type>).
+
+def _selected_results():
+    """
+    Returns (results, reader): results in the _last_analysis_results shape, reader for stored events or None.
+    Raises KeyError, with the message for the 404 response, when the trace is not (or no longer) there.
+    """
+    trace_id = request.args.get('trace_id')
+    if not trace_id:
+        # The last analysis, resolved once: a new analysis may replace it while this request runs
+        results = _last_analysis_results
+        trace_id = results["trace_id"]
+        if not trace_id:
+            return results, None
+        try:
+            return results, trace_store.open_trace(trace_id)
+        except KeyError:
+            raise KeyError(f"No stored trace for the last analysis: {trace_id} was pruned from the trace store, analyze the code again")
+    with _saved_results_lock:
+        saved = _saved_results.get(trace_id)
+    if saved is not None:
+        return saved, None
+    if not trace_store.is_enabled():
+        raise KeyError(f"Unknown trace {trace_id}")
     try:
-        # 1. Perform code tracing
-        print("Starting code tracing...")
-        raw_trace_json_str = tracer.perform_code_analysis(code_snippet)
-        raw_trace_data = json.loads(raw_trace_json_str)
-        print("Code tracing complete.")
-
-        if "error" in raw_trace_data and raw_trace_data["error"]:
-            print(f"Error during tracing: {raw_trace_data['error']}")
-            _last_analysis_results["error"] = f"Tracer error: {raw_trace_data['error'].get('message', 'Unknown tracer error')}"
-            # Still store what we have, like the code itself
-            _last_analysis_results["code"] = raw_trace_data.get("code", {"source": code_snippet, "lines": code_snippet.split('\n')})
-            return jsonify({"error": _last_analysis_results["error"]}), 500
-
-        _last_analysis_results["code"] = raw_trace_data.get("code")
-        all_ds_events = raw_trace_data.get("data_structures", {})
-
-        # 2. Process Arrays
-        raw_array_events = all_ds_events.get("arrays", [])
-        if raw_array_events:
-            print(f"Filtering {len(raw_array_events)} raw array events...")
-            filtered_arrays = data_processor.filter_data_structure_events(raw_array_events, "arrays")
-            _last_analysis_results["arrays"]["data"] = filtered_arrays
-            print(f"Filtered to {len(filtered_arrays)} array events.")
-            if filtered_arrays:
-                print("Getting LLM suggestion for arrays...")
-                array_viz_suggestion = llm_handler.get_visualization_for_arrays(filtered_arrays)
-                _last_analysis_results["arrays"]["visualization"] = array_viz_suggestion
-                print(f"Array viz suggestion: {array_viz_suggestion.get('visualization_type')}")
-        else:
-            print("No raw array events found.")
-            _last_analysis_results["arrays"]["data"] = []
-
-
-        # 3. Process Trees
-        raw_tree_events = all_ds_events.get("trees", [])
-        if raw_tree_events:
-            print(f"Filtering {len(raw_tree_events)} raw tree events...")
-            filtered_trees = data_processor.filter_data_structure_events(raw_tree_events, "trees")
-            _last_analysis_results["trees"]["data"] = filtered_trees
-            print(f"Filtered to {len(filtered_trees)} tree events.")
-            if filtered_trees:
-                print("Getting LLM suggestion for trees...")
-                tree_viz_suggestion = llm_handler.get_visualization_for_trees(filtered_trees)
-                _last_analysis_results["trees"]["visualization"] = tree_viz_suggestion
-                print(f"Tree viz suggestion: {tree_viz_suggestion.get('visualization_type')}")
-        else:
-            print("No raw tree events found.")
-            _last_analysis_results["trees"]["data"] = []
-
-        # 4. Process Graphs
-        raw_graph_events = all_ds_events.get("graphs", [])
-        if raw_graph_events:
-            print(f"Filtering {len(raw_graph_events)} raw graph events...")
-            filtered_graphs = data_processor.filter_data_structure_events(raw_graph_events, "graphs")
-            _last_analysis_results["graphs"]["data"] = filtered_graphs
-            print(f"Filtered to {len(filtered_graphs)} graph events.")
-            if filtered_graphs:
-                print("Getting LLM suggestion for graphs...")
-                graph_viz_suggestion = llm_handler.get_visualization_for_graphs(filtered_graphs)
-                _last_analysis_results["graphs"]["visualization"] = graph_viz_suggestion
-                print(f"Graph viz suggestion: {graph_viz_suggestion.get('visualization_type')}")
-        else:
-            print("No raw graph events found.")
-            _last_analysis_results["graphs"]["data"] = []
-            
+        reader = trace_store.open_trace(trace_id)
+    except KeyError:
+        raise KeyError(f"Unknown trace {trace_id}")
+    results = {"code": reader.meta.get("code"), "error": reader.meta.get("error"), "trace_id": trace_id}
+    for structure_type in analysis.STRUCTURE_TYPES:
+        results[structure_type] = {"data": [], "visualization": reader.meta.get("visualizations", {}).get(structure_type)}
+    return results, reader
+
+def _read_steps(results, reader, data_type, start=0, stop=None):
+    """Events [start, stop) of `data_type` and the total number of steps."""
+    if reader is not None:
+        return reader.read_events(data_type, start, stop), reader.count(data_type)
+    events = results.get(data_type, {}).get("data") or []
+    return events[start:stop], len(events)
+
+def _analyze_snippet(code_snippet, trace_mode="trace", watch=None):
+    """Runs tracing, filtering and LLM selection, filling _last_analysis_results. Returns (payload, status)."""
+    global _last_analysis_results
+    try:
+        # 1. Trace the code and filter the events of each structure type
+        result = analysis.trace_and_filter(code_snippet, trace_mode, watch)
+        if result["error"]:
+            _store_analysis_results(result)
+            return {"error": result["error"]}, 500
+
+        # 2. Ask the LLM for a visualization of each structure type that has events
+        visualizations = analysis.select_visualizations(result)
+        _store_analysis_results(result, visualizations)
+
         print("Code analysis and LLM processing complete.")
-        return jsonify({"status": "success", "message": "Code analysis complete"}), 200
+        return _success_payload(), 200
 
     except Exception as e:
         print(f"Error during analysis route: {str(e)}")
         traceback.print_exc()
         _last_analysis_results["error"] = f"Error analyzing code: {str(e)}"
-        return jsonify({"error": _last_analysis_results["error"]}), 500
+        return {"error": _last_analysis_results["error"]}, 500
+
+@current_app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch_route():
+    """
+    Analyzes many snippets at once (see batch.py). The response is streamed as
+    newline-delimited JSON: one {"type": "progress", "result_id", ...} line per snippet as
+    it completes, then a {"type": "summary", ...} line with the aggregate throughput.
+    Pass "llm": false in the body to skip the visualization selection.
+    """
+    print("Received batch analyze request")
+    data = request.get_json(silent=True)
+    snippets, request_error = batch.read_batch_request(data)
+    if request_error:
+        print(f"Invalid batch request: {request_error}")
+        return jsonify({"error": request_error}), 400
+    with_llm = bool(data.get("llm", True))
+
+    def generate():
+        for record in batch.run_batch(snippets, _save_result, with_llm=with_llm):
+            yield json.dumps(record) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _tree_bounds():
+    """(max_depth, max_nodes) from the query string, None when absent; (False, False) when invalid."""
+    max_depth = request.args.get('max_depth', type=int)
+    max_nodes = request.args.get('max_nodes', type=int)
+    if (max_depth is not None and max_depth < 0) or (max_nodes is not None and max_nodes < 1):
+        return False, False
+    if ('max_depth' in request.args and max_depth is None) or ('max_nodes' in request.args and max_nodes is None):
+        return False, False # Not a number
+    return max_depth, max_nodes
+
+@current_app.route('/api/data/trees/subtree', methods=['GET'])
+def get_tree_subtree_route():
+    """
+    A collapsed region of a bounded tree view: ?step=<event index>&path=<placeholder path>,
+    optionally bounded again with max_depth/max_nodes. Returns {"step", "path", "content"}.
+    """
+    print("Request for /api/data/trees/subtree")
+    try:
+        results, reader = _selected_results()
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    if results["error"]:
+        return jsonify({"error": f"Previous analysis failed: {results['error']}"}), 500
+
+    step = request.args.get('step', type=int)
+    path = request.args.get('path', default='')
+    max_depth, max_nodes = _tree_bounds()
+    if step is None or step < 0 or max_depth is False:
+        return jsonify({"error": "step must be a step index; max_depth and max_nodes must be non-negative numbers"}), 400
+    events, _ = _read_steps(results, reader, "trees", step, step + 1)
+    subtree = tree_view.subtree_at(events[0].get("content"), path) if events and isinstance(events[0].get("content"), dict) else None
+    if subtree is None:
+        return jsonify({"error": f"No subtree at {path} in step {step}"}), 404
+    content = tree_view.bound(subtree, max_depth, max_nodes, root_path=path)
+    return jsonify({"step": step, "path": path, "content": content}), 200
 
 @current_app.route('/api/data/<data_type>', methods=['GET'])
 def get_data_route(data_type):
-    global _last_analysis_results
     print(f"Request for /api/data/{data_type}")
+    try:
+        results, reader = _selected_results()
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
 
-    if _last_analysis_results["error"]:
+    if results["error"]:
          # If there was an error during the last analysis, reflect that.
          # Or, decide if you want to return empty data or a more specific error.
-        return jsonify({"error": f"Previous analysis failed: {_last_analysis_results['error']}"}), 500
+        return jsonify({"error": f"Previous analysis failed: {results['error']}"}), 500
 
     if data_type in ["arrays", "trees", "graphs"]:
-        data_to_return = _last_analysis_results.get(data_type, {}).get("data", [])
-        if data_to_return is not None: # Check for None explicitly, empty list is valid
-            print(f"Returning {len(data_to_return)} items for {data_type}")
-            return jsonify(data_to_return), 200
-        else: # Should not happen if _reset_last_analysis is used correctly
-            print(f"No data found for {data_type}, returning empty list.")
-            return jsonify([]), 200 # Return empty list if data is None
+        # Optional paging for the playback slider: ?start=<step>&count=<n>
+        start = request.args.get('start', default=0, type=int)
+        count = request.args.get('count', type=int)
+        data_to_return, total_steps = _read_steps(results, reader, data_type, start, None if count is None else start + count)
+        print(f"Returning {len(data_to_return)} of {total_steps} items for {data_type}")
+        width = request.args.get('width', type=int)
+        if data_type == "arrays" and width is not None:
+            # Arrays longer than ?width=<n> come back as bucketed summaries (see array_lod.py)
+            if width < 1:
+                return jsonify({"error": "width must be a positive number of elements"}), 400
+            response = jsonify(array_lod.downsample(data_to_return, width))
+        elif data_type == "trees" and ('max_depth' in request.args or 'max_nodes' in request.args):
+            # Trees cut to ?max_depth=<d> levels / ?max_nodes=<n> nodes, with collapsed placeholders (see tree_view.py)
+            max_depth, max_nodes = _tree_bounds()
+            if max_depth is False:
+                return jsonify({"error": "max_depth and max_nodes must be non-negative numbers"}), 400
+            previous_steps = _read_steps(results, reader, data_type, start - 1, start)[0] if start > 0 else []
+            response = jsonify(tree_view.bound_events(data_to_return, max_depth, max_nodes, start, previous_steps))
+        elif data_type == "graphs" and request.args.get('format') == 'matrix':
+            # Node table + bit-packed adjacency matrices with XOR deltas (see adjacency_matrix.py)
+            response = jsonify(adjacency_matrix.encode(data_to_return))
+        else:
+            response = jsonify(data_to_return)
+        response.headers['X-Total-Steps'] = str(total_steps)
+        return response, 200
             
     elif data_type == "code":
-        code_info = _last_analysis_results.get("code")
+        code_info = results.get("code")
         if code_info:
             print("Returning code information.")
             return jsonify(code_info), 200
@@ -166,14 +329,17 @@ def get_data_route(data_type):
 
 @current_app.route('/api/visualization/<data_type>', methods=['GET'])
 def get_visualization_selection_route(data_type):
-    global _last_analysis_results
     print(f"Request for /api/visualization/{data_type}")
+    try:
+        results, _ = _selected_results()
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
 
-    if _last_analysis_results["error"]:
-        return jsonify({"error": f"Previous analysis failed: {_last_analysis_results['error']}"}), 500
+    if results["error"]:
+        return jsonify({"error": f"Previous analysis failed: {results['error']}"}), 500
 
     if data_type in ["arrays", "trees", "graphs"]:
-        viz_info = _last_analysis_results.get(data_type, {}).get("visualization")
+        viz_info = results.get(data_type, {}).get("visualization")
         if viz_info:
             print(f"Returning visualization info for {data_type}: {viz_info.get('visualization_type')}")
             # Ensure the structure matches what the frontend expects
@@ -189,44 +355,19 @@ def get_visualization_selection_route(data_type):
 
 @current_app.route('/api/execution_data', methods=['GET'])
 def get_all_execution_data_route():
-    global _last_analysis_results
     print("Request for /api/execution_data")
+    try:
+        results, reader = _selected_results()
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
 
-    if _last_analysis_results["error"] and not _last_analysis_results["code"]: # If total failure
-        return jsonify({"error": f"Previous analysis failed: {_last_analysis_results['error']}"}), 500
-
-    # Construct the response to match the frontend's expectation
-    # based on the original simple_server.py's output for this route.
-    response_data = {
-        "arrays": {
-            "data": _last_analysis_results["arrays"]["data"],
-            "visualization": _last_analysis_results["arrays"]["visualization"] or {
-                "selection": "1", "type": "TIMELINE_ARRAY", "rationale": "Default or N/A"
-            }
-        },
-        "trees": {
-            "data": _last_analysis_results["trees"]["data"],
-            "visualization": _last_analysis_results["trees"]["visualization"] or {
-                "selection": "1", "type": "HIERARCHICAL_TREE", "rationale": "Default or N/A"
-            }
-        },
-        "graphs": {
-            "data": _last_analysis_results["graphs"]["data"],
-            "visualization": _last_analysis_results["graphs"]["visualization"] or {
-                "selection": "1", "type": "FORCE_DIRECTED", "rationale": "Default or N/A"
-            }
-        },
-        "code": _last_analysis_results["code"] or {}
-    }
-    # Ensure visualization sub-objects have the expected keys even if null from LLM
-    for key in ["arrays", "trees", "graphs"]:
-        if not response_data[key]["visualization"].get("selection"):
-            response_data[key]["visualization"]["selection"] = "1" # Default
-        if not response_data[key]["visualization"].get("type"): # 'type' was used in original, map from 'visualization_type'
-            response_data[key]["visualization"]["type"] = response_data[key]["visualization"].get("visualization_type", "DefaultVizType")
-        if not response_data[key]["visualization"].get("rationale"):
-            response_data[key]["visualization"]["rationale"] = "N/A"
+    if results["error"] and not results["code"]: # If total failure
+        return jsonify({"error": f"Previous analysis failed: {results['error']}"}), 500
 
+    response_data = analysis.execution_data(
+        results["code"],
+        {structure_type: _read_steps(results, reader, structure_type)[0] for structure_type in analysis.STRUCTURE_TYPES},
+        {structure_type: results[structure_type]["visualization"] for structure_type in analysis.STRUCTURE_TYPES})
 
     print("Returning all execution data.")
     return jsonify(response_data), 200
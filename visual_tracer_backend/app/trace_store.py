@@ -0,0 +1,206 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# --- On-disk trace store ---
+# Instead of keeping every analysis result in Python lists, traces can be written to
+# append-only segment files, one stream per structure type:
+#
+#   <TRACE_STORE_DIR>/<trace_id>/
+#       meta.json                 code, visualizations, step counts, error
+#       <type>.<n>.seg            events as JSON, one per line, appended in order
+#       <type>.idx                one fixed-width record per step: (segment n, offset, length)
+#
+# Readers mmap the index and the segments, so step i is found with one index lookup
+# (i * INDEX_RECORD.size) and only the requested steps are decoded. That gives O(1)
+# random access for the playback slider and lets a server keep many past traces on disk.
+#
+# What is stored is the filtered result of an analysis, written once it is complete
+# (write_trace): the tracer itself still builds its events in memory, so the store bounds
+# what a server keeps between requests, not the memory of the analysis that produces it.
+#
+# Readers are shared between request threads and never closed explicitly: a reader
+# dropped from the cache (or of a pruned trace) may still be in use by another request,
+# so its mmaps are released when the last reference to it goes away. A pruned trace's
+# files stay readable through those maps until then.
+#
+# The store is off unless TRACE_STORE_DIR is set (see routes.py).
+
+TRACE_STORE_DIR = os.environ.get("TRACE_STORE_DIR")
+SEGMENT_BYTES = int(os.environ.get("TRACE_STORE_SEGMENT_BYTES", 64 * 1024 * 1024))
+MAX_TRACES = int(os.environ.get("TRACE_STORE_MAX_TRACES", 0)) # 0 keeps every trace
+OPEN_READERS = 32 # Traces kept open (mmapped) at once
+
+INDEX_RECORD = struct.Struct("<IQI") # segment number, byte offset, byte length
+
+_readers = OrderedDict() # trace_id -> TraceReader, most recently used last
+_readers_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return bool(TRACE_STORE_DIR)
+
+
+def new_trace_id() -> str:
+    """Trace ids sort by creation time (used when pruning old traces)."""
+    return f"{int(time.time() * 1000):012x}-{uuid.uuid4().hex[:8]}"
+
+
+def _trace_dir(trace_id, store_dir=None):
+    # Ids come from request parameters: only accept the format new_trace_id() produces.
+    if not trace_id or not all(c in "0123456789abcdef-" for c in trace_id):
+        raise KeyError(trace_id)
+    return os.path.join(store_dir or TRACE_STORE_DIR, trace_id)
+
+
+class TraceWriter:
+    """Appends the events of one trace; the trace becomes visible to readers on close()."""
+
+    def __init__(self, trace_id=None, store_dir=None):
+        self.trace_id = trace_id or new_trace_id()
+        self.store_dir = store_dir or TRACE_STORE_DIR
+        self.final_dir = _trace_dir(self.trace_id, self.store_dir)
+        self.work_dir = self.final_dir + ".tmp" # Renamed on close, so readers never see a partial trace
+        os.makedirs(self.work_dir)
+        self._streams = {} # structure type -> {"segment", "segment_file", "segment_size", "index_file", "count"}
+
+    def _stream(self, structure_type):
+        stream = self._streams.get(structure_type)
+        if stream is None:
+            stream = {
+                "segment": 0,
+                "segment_file": open(os.path.join(self.work_dir, f"{structure_type}.0.seg"), "ab"),
+                "segment_size": 0,
+                "index_file": open(os.path.join(self.work_dir, f"{structure_type}.idx"), "ab"),
+                "count": 0,
+            }
+            self._streams[structure_type] = stream
+        return stream
+
+    def append(self, structure_type, event):
+        """Append one event as the next step of `structure_type`."""
+        data = json.dumps(event, default=str).encode("utf-8") + b"\n"
+        stream = self._stream(structure_type)
+        if stream["segment_size"] and stream["segment_size"] + len(data) > SEGMENT_BYTES:
+            stream["segment_file"].close()
+            stream["segment"] += 1
+            stream["segment_file"] = open(os.path.join(self.work_dir, f"{structure_type}.{stream['segment']}.seg"), "ab")
+            stream["segment_size"] = 0
+        stream["segment_file"].write(data)
+        stream["index_file"].write(INDEX_RECORD.pack(stream["segment"], stream["segment_size"], len(data)))
+        stream["segment_size"] += len(data)
+        stream["count"] += 1
+
+    def close(self, meta=None):
+        """Flush everything, write meta.json and publish the trace under its id."""
+        for stream in self._streams.values():
+            stream["segment_file"].close()
+            stream["index_file"].close()
+        meta = dict(meta or {})
+        meta["trace_id"] = self.trace_id
+        meta["created"] = time.time()
+        meta["counts"] = {structure_type: stream["count"] for structure_type, stream in self._streams.items()}
+        with open(os.path.join(self.work_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, default=str)
+        os.rename(self.work_dir, self.final_dir)
+        return self.trace_id
+
+    def abort(self):
+        for stream in self._streams.values():
+            stream["segment_file"].close()
+            stream["index_file"].close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class TraceReader:
+    """Random access to the steps of a stored trace through mmapped index and segment files."""
+
+    def __init__(self, trace_id, store_dir=None):
+        self.trace_id = trace_id
+        self.trace_dir = _trace_dir(trace_id, store_dir)
+        # Everything is mapped up front: the maps never change afterwards, so request threads
+        # can share the reader without a lock, and a trace pruned later stays readable
+        self._maps = {} # file name -> mmap (None for empty files, which cannot be mapped)
+        try:
+            with open(os.path.join(self.trace_dir, "meta.json")) as f:
+                self.meta = json.load(f)
+            for file_name in os.listdir(self.trace_dir):
+                if file_name.endswith((".idx", ".seg")):
+                    with open(os.path.join(self.trace_dir, file_name), "rb") as f:
+                        size = os.fstat(f.fileno()).st_size
+                        self._maps[file_name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        except FileNotFoundError: # Unknown, or pruned while being opened
+            raise KeyError(trace_id)
+
+    def _map(self, file_name):
+        return self._maps[file_name]
+
+    def count(self, structure_type) -> int:
+        return self.meta.get("counts", {}).get(structure_type, 0)
+
+    def read_events(self, structure_type, start=0, stop=None) -> list:
+        """Decode steps [start, stop) of `structure_type` (only those bytes are read)."""
+        total = self.count(structure_type)
+        start, stop, _ = slice(start, stop).indices(total)
+        if start >= stop:
+            return []
+        index = self._map(f"{structure_type}.idx")
+        events = []
+        for step in range(start, stop):
+            segment, offset, length = INDEX_RECORD.unpack_from(index, step * INDEX_RECORD.size)
+            segment_map = self._map(f"{structure_type}.{segment}.seg")
+            events.append(json.loads(segment_map[offset:offset + length]))
+        return events
+
+
+
+def open_trace(trace_id) -> TraceReader:
+    """A (cached) reader for a stored trace. Raises KeyError for unknown ids."""
+    with _readers_lock:
+        reader = _readers.get(trace_id)
+        if reader is not None:
+            _readers.move_to_end(trace_id)
+            return reader
+    reader = TraceReader(trace_id) # Outside the lock: reads meta.json
+    with _readers_lock:
+        reader = _readers.setdefault(trace_id, reader) # Another thread may have opened it meanwhile
+        _readers.move_to_end(trace_id)
+        while len(_readers) > OPEN_READERS:
+            _readers.popitem(last=False) # Not closed: another request may still be reading it (see above)
+    return reader
+
+
+def write_trace(result, visualizations=None, structure_types=("arrays", "trees", "graphs")) -> str:
+    """Store an analysis.trace_and_filter result and its LLM selections; returns the trace id."""
+    writer = TraceWriter()
+    try:
+        for structure_type in structure_types:
+            for event in result.get(structure_type) or []:
+                writer.append(structure_type, event)
+        trace_id = writer.close({
+            "code": result.get("code"),
+            "error": result.get("error"),
+            "visualizations": visualizations or {},
+        })
+    except Exception:
+        writer.abort()
+        raise
+    if MAX_TRACES:
+        prune(MAX_TRACES)
+    return trace_id
+
+
+def prune(max_traces):
+    """Delete the oldest traces beyond `max_traces`."""
+    trace_ids = sorted(name for name in os.listdir(TRACE_STORE_DIR)
+                       if not name.endswith(".tmp") and os.path.isdir(os.path.join(TRACE_STORE_DIR, name)))
+    for trace_id in trace_ids[:max(0, len(trace_ids) - max_traces)]:
+        with _readers_lock:
+            _readers.pop(trace_id, None)
+        shutil.rmtree(os.path.join(TRACE_STORE_DIR, trace_id), ignore_errors=True)
@@ -1,3 +1,4 @@
+import os
 import sys
 import time
 import json
@@ -5,6 +6,16 @@ import traceback
 import linecache
 import re
 import copy
+import hashlib
+import threading
+from collections import OrderedDict
+
+from . import event_queue
+from . import graph_metrics
+from . import matrix_tracking
+from . import metrics
+from . import mutation_tracking
+from . import ndarray_tracking
 
 IGNORED_VARIABLES = {
     # Special Python variables
@@ -15,6 +26,109 @@ IGNORED_VARIABLES = {
     'args', 'kwargs', 'self', 'cls'
 }
 
+# Operations that are always recorded, even when the structure's content did not change.
+SIGNIFICANT_OPERATIONS = {"create_array", "list_comprehension", "append", "extend", "insert", "remove", "pop", "sort", "reverse",
+                          "create_graph", "add_edge", "update_node_edges",
+                          "assign_node", "set_left_child", "set_right_child", "add_child_to_list", "update_child_in_list",
+                          "update_node_value", "final_state", "call", "return",
+                          # Reported by the mutation-interception mode
+                          "indexed_assignment", "delete_item", "clear", "remove_node", "update_children"}
+
+# "trace" polls frame locals line by line via sys.settrace; "intercept" rewrites the
+# snippet so tracked containers/nodes report their own mutations (see mutation_tracking.py).
+TRACE_MODES = ("trace", "intercept")
+# The operation of the first event of a structure in "intercept" mode, recorded when it is
+# first bound to a name (the names the trace mode infers for a creation line)
+CREATE_OPERATIONS = {"arrays": "create_array", "graphs": "create_graph", "trees": "create"}
+
+# Events are built on a consumer thread, see event_queue.py (0: build them on the traced thread)
+TRACE_EVENT_QUEUE = os.environ.get('TRACE_EVENT_QUEUE', '1') == '1'
+TRACE_EVENT_QUEUE_SIZE = int(os.environ.get('TRACE_EVENT_QUEUE_SIZE', 4096)) # Pending snapshots before the program waits
+_NESTED_LIST_TYPES = {list, mutation_tracking.TrackedList} # Rows copied by DataStructureTracker.copy_array
+
+# --- Watch list ---
+# By default every list, tree node and adjacency dict in every traced frame is classified
+# and recorded. A watch list (the "watch" field of /api/analyze, and/or "# trace: arr, root"
+# comments in the snippet) restricts that to the named variables: only those names are
+# classified, and other names are only recorded when they refer to an object already
+# reached through a watched name (e.g. `arr` passed to sort(a) as `a`, or a `node` inside
+# the watched tree). Everything else costs a dictionary lookup instead of a classification.
+WATCH_PRAGMA = re.compile(r"#\s*trace:\s*([A-Za-z_][\w\s,]*)$")
+
+
+def watch_pragma_names(lines):
+    """Names listed in "# trace: a, b" comments."""
+    names = []
+    for line in lines:
+        match = WATCH_PRAGMA.search(line)
+        if match:
+            names.extend(name for name in re.split(r"[\s,]+", match.group(1)) if name)
+    return names
+
+# --- Compiled snippet cache ---
+# Users typically re-run the same snippet many times while stepping through a
+# visualization, so the compiled code object, the line table and the inferred
+# operation types are kept in a small LRU keyed by the hash of the source.
+COMPILED_SNIPPET_CACHE_SIZE = int(os.environ.get('TRACER_COMPILE_CACHE_SIZE', 128))
+
+class CompiledSnippet:
+    """A compiled user snippet plus the per-snippet metadata the tracer needs."""
+
+    def __init__(self, source, digest):
+        self.source = source
+        self.digest = digest
+        # Each snippet gets its own pseudo-filename, so its linecache entry never
+        # collides with another snippet being traced at the same time.
+        self.filename = f"<snippet-{digest[:16]}>"
+        self.code_object = compile(source, self.filename, 'exec')
+        self.lines = source.strip().split('\n')
+        self.line_contents = [line.strip() for line in self.lines]
+        # (line_content, var_name) -> operation type, filled lazily by the tracker
+        self.operation_cache = {}
+        self.watch_pragma = watch_pragma_names(self.lines)
+        self._intercepted_code_object = None
+
+    @property
+    def intercepted_code_object(self):
+        """The snippet compiled with the mutation-tracking AST rewrite (built on first use)."""
+        if self._intercepted_code_object is None:
+            self._intercepted_code_object = mutation_tracking.compile_with_interception(self.source, self.filename)
+        return self._intercepted_code_object
+
+    def register_in_linecache(self):
+        # mtime=None marks the entry as not backed by a file, so linecache.checkcache() keeps it.
+        linecache.cache[self.filename] = (len(self.source), None, self.source.splitlines(True), self.filename)
+
+    def unregister_from_linecache(self):
+        linecache.cache.pop(self.filename, None)
+
+_compiled_snippets = OrderedDict() # digest -> CompiledSnippet, most recently used last
+_compiled_snippets_lock = threading.Lock()
+
+def get_compiled_snippet(code_snippet: str) -> CompiledSnippet:
+    """
+    Returns the cached CompiledSnippet for this source, compiling it on a miss.
+    Raises SyntaxError (like exec would) if the snippet does not compile.
+    """
+    digest = hashlib.sha256(code_snippet.encode('utf-8')).hexdigest()
+    with _compiled_snippets_lock:
+        compiled = _compiled_snippets.get(digest)
+        if compiled is not None:
+            _compiled_snippets.move_to_end(digest)
+            metrics.increment("compile_cache_hits_total")
+            return compiled
+
+    metrics.increment("compile_cache_misses_total")
+    compiled = CompiledSnippet(code_snippet, digest)
+    compiled.register_in_linecache()
+    with _compiled_snippets_lock:
+        _compiled_snippets[digest] = compiled
+        while len(_compiled_snippets) > COMPILED_SNIPPET_CACHE_SIZE:
+            _, evicted = _compiled_snippets.popitem(last=False)
+            evicted.unregister_from_linecache()
+    return compiled
+
+
 class DataStructureTracker:
     """
     Contains static methods for detecting, serializing, and recording
@@ -23,9 +137,19 @@ class DataStructureTracker:
     """
 
     _data_structure_events = {}
-    _previous_states = {}
     _operation_history = {}
+    # Identity tracking: each distinct object is serialized and recorded once per change,
+    # whatever name (or recursive frame) it is reached through.
+    _object_records = {}    # id(obj) -> {"ref", "object", "name", "placeholder", "state", "indexed_node_ids", "graph_metrics" (graphs)}
+    _tree_node_owners = {}  # id(node) -> (node, owner_record, path, serialized_subtree) for nodes inside recorded trees
+    _name_bindings = {}     # f"{ds_type}_{name}" -> (ref, path) last recorded for that name
+    _last_mutation = None   # ((id(obj), id(frame), lineno), f_lasti) of the last intercepted mutation, see record_mutation
     _code_lines_for_trace = [] # To be set by the main analysis function
+    _operation_cache = {} # Per-snippet memo of inferred operation types, see CompiledSnippet
+    _watch_names = None # Set of watched variable names, None when everything is traced (see WATCH_PRAGMA)
+    # Where the traced thread submits event building. Only the consumer touches
+    # _data_structure_events, _name_bindings and the records' "graph_metrics".
+    _events = event_queue.SynchronousEvents()
 
     @staticmethod
     def initialize_tracker_state():
@@ -35,14 +159,49 @@ class DataStructureTracker:
             "trees": [],
             "graphs": []
         }
-        DataStructureTracker._previous_states = {}
         DataStructureTracker._operation_history = {}
+        DataStructureTracker._object_records = {}
+        DataStructureTracker._tree_node_owners = {}
+        DataStructureTracker._name_bindings = {}
+        DataStructureTracker._last_mutation = None
         DataStructureTracker._code_lines_for_trace = []
+        DataStructureTracker._operation_cache = {}
+        DataStructureTracker._watch_names = None
 
     @staticmethod
     def set_code_lines(code_lines):
         DataStructureTracker._code_lines_for_trace = code_lines
 
+    @staticmethod
+    def set_operation_cache(operation_cache):
+        DataStructureTracker._operation_cache = operation_cache
+
+    @staticmethod
+    def set_watch_names(watch_names):
+        DataStructureTracker._watch_names = watch_names
+
+    @staticmethod
+    def set_event_queue(events):
+        DataStructureTracker._events = events
+
+    @staticmethod
+    def close_event_queue():
+        """Waits for all submitted events (see event_queue.py); returns the queue that was closed."""
+        events, DataStructureTracker._events = DataStructureTracker._events, event_queue.SynchronousEvents()
+        events.close()
+        return events
+
+    @staticmethod
+    def tracked_type(value):
+        """The ds_type of `value` if it was already recorded (itself, or as a node inside a recorded tree), else None."""
+        record = DataStructureTracker._object_records.get(id(value))
+        if record is not None and record["object"] is value:
+            return record["ref"].split("#", 1)[0]
+        owner_entry = DataStructureTracker._tree_node_owners.get(id(value))
+        if owner_entry is not None and owner_entry[0] is value:
+            return "trees"
+        return None
+
     @staticmethod
     def get_tracked_events():
         return DataStructureTracker._data_structure_events
@@ -122,12 +281,18 @@ class DataStructureTracker:
         return "update" # Default for other operations or direct modifications
 
     @staticmethod
-    def serialize_tree(node):
-        """Convert a tree node to a serializable format."""
+    def serialize_tree(node, node_index=None, path=()):
+        """
+        Convert a tree node to a serializable format.
+        If `node_index` is given, it is filled with id(node) -> (node, path, serialized_node)
+        for every node, where `path` is the tuple of child keys leading from the root.
+        """
         if node is None:
             return None
             
         result = {}
+        if node_index is not None:
+            node_index[id(node)] = (node, path, result)
         
         if hasattr(node, "value"): result["value"] = node.value
         elif hasattr(node, "val"): result["value"] = node.val
@@ -137,17 +302,17 @@ class DataStructureTracker:
         # Handle both binary and n-ary children
         children_list = []
         if hasattr(node, "children") and isinstance(node.children, list):
-            children_list.extend([DataStructureTracker.serialize_tree(child) for child in node.children])
+            children_list.extend([DataStructureTracker.serialize_tree(child, node_index, path + (i,)) for i, child in enumerate(node.children)])
         
         # For binary trees, add left/right if they exist, even if children list is also present
         # Some tree implementations might use both (e.g. a general tree node that can also have specific left/right)
         left_child = None
         right_child = None
         if hasattr(node, "left"):
-            left_child = DataStructureTracker.serialize_tree(node.left)
+            left_child = DataStructureTracker.serialize_tree(node.left, node_index, path + ("left",))
             if left_child: result["left"] = left_child
         if hasattr(node, "right"):
-            right_child = DataStructureTracker.serialize_tree(node.right)
+            right_child = DataStructureTracker.serialize_tree(node.right, node_index, path + ("right",))
             if right_child: result["right"] = right_child
 
         # If children_list was populated from a .children attribute, use it.
@@ -176,141 +341,624 @@ class DataStructureTracker:
                 result[key_str] = [str(value)] 
         return result
 
+    @staticmethod
+    def snapshot_graph(graph):
+        """
+        The part of serialize_graph that must happen while the program is paused: a copy of
+        every adjacency list, as (node, targets) pairs. serialize_graph_snapshot finishes it.
+        """
+        if not isinstance(graph, dict):
+            return str(graph)
+        return [(key, list(value) if isinstance(value, list) else [str(value)]) for key, value in graph.items()]
+
+    @staticmethod
+    def serialize_graph_snapshot(snapshot):
+        """serialize_graph of the graph a snapshot_graph was taken of."""
+        if not isinstance(snapshot, list):
+            return snapshot
+        return {str(key): [str(item) for item in targets] for key, targets in snapshot}
+
+    @staticmethod
+    def copy_array(value):
+        """A copy of a list that later mutations cannot reach: nested lists (rows of a matrix) are copied too."""
+        copy = list(value)
+        if not _NESTED_LIST_TYPES.isdisjoint(map(type, copy)): # Scans in C; a flat list costs no per-element Python work
+            return [DataStructureTracker.copy_array(item) if type(item) in _NESTED_LIST_TYPES else item for item in copy]
+        return copy
+
     @staticmethod
     def record_data_structure_event(ds_type, name, value, operation_hint, lineno, line_content):
-        """Record a data structure event if it has changed or is significant."""
+        """
+        Record a data structure event if it has changed or is significant.
+        Objects are tracked by identity: the same list/tree/graph seen through several
+        names is snapshotted once per change, and the other names are recorded as
+        lightweight alias events that reference it.
+        """
         if name in IGNORED_VARIABLES or name.startswith('_'):
-            return
+            watch_names = DataStructureTracker._watch_names
+            if watch_names is None or name not in watch_names: # An explicitly watched name is always recorded
+                return
 
         operation = operation_hint
         if not operation and line_content: # Infer operation if not explicitly provided
-            operation = DataStructureTracker.get_operation_type(line_content, name)
+            operation = DataStructureTracker._operation_cache.get((line_content, name))
+            if operation is None:
+                operation = DataStructureTracker.get_operation_type(line_content, name)
+                DataStructureTracker._operation_cache[(line_content, name)] = operation
         
-        serialized_value = None
         if ds_type == "arrays":
-            if not isinstance(value, list): return
-            serialized_value = list(value) # Shallow copy
+            if not isinstance(value, list) and not ndarray_tracking.is_ndarray(value): return
         elif ds_type == "trees":
             if not DataStructureTracker.is_tree_node(value): return
-            serialized_value = DataStructureTracker.serialize_tree(value)
         elif ds_type == "graphs":
             if not DataStructureTracker.is_graph(value): return
-            serialized_value = DataStructureTracker.serialize_graph(value)
         else:
             return # Unknown data structure type
 
-        if serialized_value is None: return
-
-        state_key = f"{ds_type}_{name}"
         try:
-            current_state_json = json.dumps(serialized_value, sort_keys=True, default=str)
-            
-            # Record if:
-            # 1. State is new
-            # 2. State content has changed
-            # 3. Operation is significant (e.g., 'create', 'append', not just generic 'update' on same content)
-            significant_operations = {"create_array", "list_comprehension", "append", "extend", "insert", "remove", "pop", "sort", "reverse", 
-                                      "create_graph", "add_edge", "update_node_edges",
-                                      "assign_node", "set_left_child", "set_right_child", "add_child_to_list", "update_child_in_list",
-                                      "update_node_value", "final_state", "call", "return"}
-
-            if state_key not in DataStructureTracker._previous_states or \
-               DataStructureTracker._previous_states[state_key] != current_state_json or \
-               operation in significant_operations:
-                
-                DataStructureTracker._previous_states[state_key] = current_state_json
-                
-                operation_details_obj = {"code": line_content.strip()} if line_content else None
-                
-                event_data = {
-                    "name": name,
-                    "operation": operation,
-                    "content": serialized_value,
-                    "timestamp": time.time(), # Using actual time
-                    "location": f"line {lineno}",
-                    "operation_details": operation_details_obj
-                }
-                
-                DataStructureTracker._data_structure_events[ds_type].append(event_data)
-                
-                # Optional: operation_history can be maintained if needed for complex analysis,
-                # but the primary output is data_structure_events.
-                # if state_key not in DataStructureTracker._operation_history:
-                #     DataStructureTracker._operation_history[state_key] = []
-                # DataStructureTracker._operation_history[state_key].append(event_data)
+            is_significant = operation in SIGNIFICANT_OPERATIONS
+
+            # A node that sits inside a tree we already snapshotted (e.g. `node` in each
+            # recursive insert frame) is an alias of that tree, not a new structure.
+            if ds_type == "trees" and not is_significant:
+                owner_entry = DataStructureTracker._tree_node_owners.get(id(value))
+                if owner_entry is not None and owner_entry[0] is value:
+                    _, owner_record, path, recorded_subtree = owner_entry
+                    if DataStructureTracker.serialize_tree(value) != recorded_subtree:
+                        # The subtree changed, so the tree that owns it changed: snapshot the
+                        # owner once (this also re-indexes which nodes belong to it).
+                        DataStructureTracker._record_object_state(
+                            ds_type, owner_record["object"], owner_record["name"], operation, lineno, line_content, reindex=True)
+                        owner_entry = DataStructureTracker._tree_node_owners.get(id(value))
+                    if owner_entry is not None and owner_entry[0] is value:
+                        DataStructureTracker._record_alias(ds_type, name, owner_entry[1], owner_entry[2], operation, lineno, line_content)
+                        return
+
+            DataStructureTracker._record_object_state(
+                ds_type, value, name, operation, lineno, line_content,
+                force=is_significant, placeholder=(operation == "return_value"))
 
         except TypeError as te: # Handles non-serializable content within structures
             print(f"Tracer: TypeError serializing {name} ({ds_type}): {te}. Value: {str(value)[:100]}")
         except Exception as e:
             print(f"Tracer: Error recording event for {name} ({ds_type}): {e}")
 
+    @staticmethod
+    def _record_object_state(ds_type, value, name, operation, lineno, line_content, force=False, placeholder=False, reindex=False,
+                             operation_args=None):
+        """Serialize `value` once and record a full event if the object is new, changed, or `force` is set."""
+        if ds_type == "arrays" and ndarray_tracking.is_ndarray(value):
+            DataStructureTracker._record_ndarray_state(value, name, operation, lineno, line_content, force, placeholder, operation_args)
+            return
+        if ds_type == "arrays" and matrix_tracking.is_matrix(value):
+            DataStructureTracker._record_matrix_state(value, name, operation, lineno, line_content, force, placeholder, operation_args)
+            return
+
+        # The state is a copy the program cannot change any more: the list (with its nested
+        # lists), the serialized tree, or the copied adjacency lists of a graph (turned into
+        # the event content on the consumer, see event_queue.py)
+        node_index = {} if ds_type == "trees" else None
+        if ds_type == "arrays":
+            state = DataStructureTracker.copy_array(value)
+        elif ds_type == "trees":
+            state = DataStructureTracker.serialize_tree(value, node_index)
+        else:
+            state = DataStructureTracker.snapshot_graph(value)
+        if state is None: return
+
+        record = DataStructureTracker._get_object_record(ds_type, value, name, placeholder)
+
+        # Compared with == (in C) rather than as JSON text: this runs for every scan of every frame
+        changed = record["state"] != state
+        if node_index is not None and (changed or force or reindex):
+            DataStructureTracker._index_tree_nodes(record, node_index)
+
+        if not changed and not force:
+            if name != record["name"]:
+                DataStructureTracker._record_alias(ds_type, name, record, (), operation, lineno, line_content)
+            return
+
+        record["state"] = state
+        if ds_type == "graphs":
+            DataStructureTracker._append_state_event(ds_type, record, name, operation, lineno, line_content,
+                                                     {}, operation_args, graph_state=state)
+        else:
+            DataStructureTracker._append_state_event(ds_type, record, name, operation, lineno, line_content,
+                                                     {"content": state}, operation_args)
+
+    @staticmethod
+    def _record_ndarray_state(value, name, operation, lineno, line_content, force=False, placeholder=False, operation_args=None):
+        """
+        ndarray version of _record_object_state: the previous state is a typed buffer copy and
+        changes are found with one vectorized comparison. Events carry dtype/shape and either
+        the full content (keyframe) or only the changed flat indices and their values (delta).
+        """
+        record = DataStructureTracker._get_object_record("arrays", value, name, placeholder)
+        previous = record.get("snapshot")
+
+        indices = ndarray_tracking.changed_indices(previous, value) if previous is not None else None
+        changed = indices is None or len(indices) > 0
+
+        if not changed and not force:
+            if name != record["name"]:
+                DataStructureTracker._record_alias("arrays", name, record, (), operation, lineno, line_content)
+            return
+
+        fields = ndarray_tracking.describe(value)
+        if ndarray_tracking.needs_keyframe(value, indices, record.get("deltas_since_keyframe", 0)):
+            fields["content"] = value.tolist()
+            record["deltas_since_keyframe"] = 0
+        else:
+            fields["content"] = None # Rebuilt from the previous events by the data processor
+            fields["delta"] = ndarray_tracking.delta(value, indices)
+            record["deltas_since_keyframe"] += 1
+
+        if indices is None:
+            record["snapshot"] = ndarray_tracking.snapshot(value)
+        elif len(indices):
+            previous.ravel()[indices] = value.ravel()[indices] # Update the snapshot in place
+
+        DataStructureTracker._append_state_event("arrays", record, name, operation, lineno, line_content, fields, operation_args)
+
+    @staticmethod
+    def _record_matrix_state(value, name, operation, lineno, line_content, force=False, placeholder=False, operation_args=None):
+        """
+        2-D list version of _record_object_state (see matrix_tracking.py): only the rows that
+        changed are scanned, and events carry the changed cells or, every so often, a keyframe.
+        """
+        record = DataStructureTracker._get_object_record("arrays", value, name, placeholder)
+        previous = record["state"]
+        cells = matrix_tracking.changed_cells(previous, value)
+        changed = cells is None or len(cells) > 0
+
+        if not changed and not force:
+            if name != record["name"]:
+                DataStructureTracker._record_alias("arrays", name, record, (), operation, lineno, line_content)
+            return
+
+        fields = matrix_tracking.describe(value)
+        if matrix_tracking.needs_keyframe(value, cells, record.get("deltas_since_keyframe", 0)):
+            state = matrix_tracking.snapshot(value)
+            fields["content"] = state
+            record["deltas_since_keyframe"] = 0
+        else:
+            state = matrix_tracking.updated_state(previous, value, cells)
+            fields["content"] = None # Rebuilt from the previous events by the data processor
+            fields["delta"] = {"cells": cells}
+            record["deltas_since_keyframe"] = record.get("deltas_since_keyframe", 0) + 1
+        record["state_before_event"] = previous # For record_mutation, which may replace this event
+        record["state"] = state
+
+        DataStructureTracker._append_state_event("arrays", record, name, operation, lineno, line_content, fields, operation_args)
+
+    @staticmethod
+    def _get_object_record(ds_type, value, name, placeholder):
+        """The identity record of `value`, created on first sight."""
+        record = DataStructureTracker._object_records.get(id(value))
+        if record is None:
+            record = {
+                "ref": f"{ds_type}#{len(DataStructureTracker._object_records) + 1}",
+                "object": value, # Keeps the object alive so its id() is not reused during the run
+                "name": name,
+                # Return values get a synthetic "<func>_return" name; the first real
+                # variable the object is bound to becomes its canonical name instead.
+                "placeholder": placeholder,
+                "state": None,
+                "indexed_node_ids": [],
+            }
+            DataStructureTracker._object_records[id(value)] = record
+        elif record["placeholder"] and not placeholder:
+            record["name"] = name
+            record["placeholder"] = False
+        return record
+
+    @staticmethod
+    def _append_state_event(ds_type, record, name, operation, lineno, line_content, fields, operation_args=None,
+                            graph_state=None):
+        """
+        Append a full (content-carrying) event for `record`; `fields` holds content and any extra keys
+        (for graphs, `graph_state` is the snapshot_graph the content is made of).
+        The event is built and appended by the event queue's consumer.
+        """
+        DataStructureTracker._events.submit(
+            DataStructureTracker._build_state_event, ds_type, record, record["name"], name, operation, lineno,
+            line_content, time.time(), fields, operation_args, graph_state)
+
+    @staticmethod
+    def _build_state_event(ds_type, record, record_name, name, operation, lineno, line_content, timestamp, fields,
+                           operation_args, graph_state):
+        """Consumer side of _append_state_event."""
+        if graph_state is not None:
+            content = DataStructureTracker.serialize_graph_snapshot(graph_state)
+            fields = dict(fields, content=content)
+            if isinstance(content, dict):
+                # Updated from the adjacency lists that changed since this graph's previous event
+                if "graph_metrics" not in record:
+                    record["graph_metrics"] = graph_metrics.GraphMetrics()
+                fields["graph_metrics"] = record["graph_metrics"].update(content)
+
+        DataStructureTracker._name_bindings[f"{ds_type}_{name}"] = (record["ref"], ())
+
+        event_data = {
+            "name": record_name,
+            "operation": operation,
+            "timestamp": timestamp, # When the state was captured, not when the event was built
+            "location": f"line {lineno}",
+            "operation_details": {"code": line_content.strip()} if line_content else None,
+            "ref": record["ref"],
+        }
+        event_data.update(fields)
+        if name != record_name:
+            event_data["observed_as"] = name
+        if operation_args is not None:
+            event_data["operation_details"] = dict(event_data["operation_details"] or {}, args=operation_args)
+
+        DataStructureTracker._data_structure_events[ds_type].append(event_data)
+
+    @staticmethod
+    def record_mutation(kind, obj, operation, operation_args, frame):
+        """
+        Records one event for a mutation reported by the interception mode.
+        `kind` is "list", "dict" or "node" (see mutation_tracking.start_session).
+        """
+        try:
+            # Adjacency lists and children lists are recorded as a change of the structure holding them
+            owner = getattr(obj, "_tracer_owner", None) if kind == "list" else None
+            if owner is not None and DataStructureTracker.is_graph(owner):
+                kind, obj = "dict", owner
+                operation = "add_edge" if operation in ("append", "insert", "extend") else "update_node_edges"
+            elif owner is not None and DataStructureTracker.is_tree_node(owner):
+                kind, obj = "node", owner
+                operation = "add_child_to_list" if operation in ("append", "insert") else "update_child_in_list"
+            elif owner is not None and matrix_tracking.is_matrix(owner):
+                # A row of a 2-D list: the table changed (recorded as changed cells)
+                obj = owner
+                operation = "update_cell" if operation == "indexed_assignment" else "update_row"
+
+            if kind == "list":
+                ds_type = "arrays"
+            elif kind == "dict":
+                if not DataStructureTracker.is_graph(obj): return
+                ds_type = "graphs"
+            else:
+                if not DataStructureTracker.is_tree_node(obj): return
+                ds_type = "trees"
+                # A write anywhere inside a recorded tree is a change of that whole tree
+                owner_entry = DataStructureTracker._tree_node_owners.get(id(obj))
+                if owner_entry is not None and owner_entry[0] is obj:
+                    obj = owner_entry[1]["object"]
+
+            record = DataStructureTracker._object_records.get(id(obj))
+            name = record["name"] if record is not None else DataStructureTracker._find_variable_name(obj, frame)
+            if name is None:
+                return # Temporary, unnamed structure
+            watch_names = DataStructureTracker._watch_names
+            if record is None and watch_names is not None and name not in watch_names:
+                return # Not watched, and not reached through a watched name
+
+            code_lines = DataStructureTracker._code_lines_for_trace
+            lineno = frame.f_lineno if frame is not None else len(code_lines)
+            line_content = code_lines[lineno - 1] if 0 <= lineno - 1 < len(code_lines) else ""
+
+            # Several mutations from one statement (arr[i], arr[j] = arr[j], arr[i]) become one event:
+            # the previous event is replaced by the state after the whole statement. Within one
+            # execution of a line the bytecode offset only moves forward; a loop jumps back.
+            mutation_key = (id(obj), id(frame), lineno)
+            offset = frame.f_lasti if frame is not None else -1
+            last_mutation = DataStructureTracker._last_mutation
+            if (last_mutation is not None and last_mutation[0] == mutation_key and offset > last_mutation[1]
+                    and record is not None):
+                DataStructureTracker._events.submit(DataStructureTracker._drop_last_event, ds_type, record["ref"])
+                if "state_before_event" in record:
+                    # The replacing matrix delta must also hold the cells of the dropped one
+                    record["state"] = record.pop("state_before_event")
+            DataStructureTracker._last_mutation = (mutation_key, offset)
+
+            DataStructureTracker._record_object_state(
+                ds_type, obj, name, operation, lineno, line_content, force=True, reindex=True,
+                operation_args=[DataStructureTracker._describe_argument(arg) for arg in operation_args])
+
+        except TypeError as te:
+            print(f"Tracer: TypeError serializing mutation {operation} ({kind}): {te}")
+        except Exception as e:
+            print(f"Tracer: Error recording mutation {operation} ({kind}): {e}")
+
+    @staticmethod
+    def record_binding(kind, name, obj, frame):
+        """
+        Records the initial state of a structure the interception mode reports being bound to
+        `name` (see mutation_tracking.bind), the first time it is bound. Later bindings, and
+        parts of an already recorded structure (a row, an adjacency list, a subtree), add nothing.
+        """
+        try:
+            if name in IGNORED_VARIABLES or name.startswith('_'):
+                return
+            watch_names = DataStructureTracker._watch_names
+            if watch_names is not None and name not in watch_names:
+                return
+            if DataStructureTracker._object_records.get(id(obj)) is not None:
+                return
+            if getattr(obj, "_tracer_owner", None) is not None:
+                return
+            if kind == "list":
+                ds_type = "arrays"
+            elif kind == "dict":
+                if not DataStructureTracker.is_graph(obj): return # Empty dicts are recorded on their first edge
+                ds_type = "graphs"
+            else:
+                if not DataStructureTracker.is_tree_node(obj): return
+                if DataStructureTracker.tracked_type(obj) is not None: return # A node inside a recorded tree
+                ds_type = "trees"
+
+            code_lines = DataStructureTracker._code_lines_for_trace
+            lineno = frame.f_lineno if frame is not None else len(code_lines)
+            line_content = code_lines[lineno - 1] if 0 <= lineno - 1 < len(code_lines) else ""
+            DataStructureTracker._record_object_state(
+                ds_type, obj, name, CREATE_OPERATIONS[ds_type], lineno, line_content, force=True, reindex=True)
+
+        except TypeError as te:
+            print(f"Tracer: TypeError serializing {name} ({kind}): {te}")
+        except Exception as e:
+            print(f"Tracer: Error recording creation of {name} ({kind}): {e}")
+
+    @staticmethod
+    def _drop_last_event(ds_type, ref):
+        """Consumer side of the statement coalescing in record_mutation."""
+        events = DataStructureTracker._data_structure_events[ds_type]
+        if events and events[-1].get("ref") == ref:
+            events.pop()
+
+    @staticmethod
+    def _find_variable_name(obj, frame):
+        """
+        Name of a variable bound to `obj`. The outermost binding wins (globals, then the
+        calling frames), so a tree mutated inside insert(node, ...) is still called "root".
+        """
+        def bound_name(scope):
+            for name, value in scope.items():
+                if value is obj and name not in IGNORED_VARIABLES and not name.startswith('_'):
+                    return name
+            return None
+
+        found = None
+        while frame is not None:
+            found = bound_name(frame.f_locals) or found
+            if frame.f_back is None or frame.f_back.f_globals is not frame.f_globals:
+                found = bound_name(frame.f_globals) or found
+                break
+            frame = frame.f_back
+        return found
+
+    @staticmethod
+    def _describe_argument(arg):
+        """A small JSON-friendly description of a mutation argument."""
+        if arg is None or isinstance(arg, (bool, int, float, str)):
+            return arg
+        if DataStructureTracker.is_tree_node(arg):
+            return {"node": DataStructureTracker.serialize_tree(arg).get("value")}
+        text = repr(arg)
+        return text if len(text) <= 80 else text[:77] + "..."
+
+    @staticmethod
+    def _index_tree_nodes(owner_record, node_index):
+        """Point every non-root node of a freshly serialized tree at its owning record."""
+        owners = DataStructureTracker._tree_node_owners
+        for node_id in owner_record["indexed_node_ids"]:
+            entry = owners.get(node_id)
+            if entry is not None and entry[1] is owner_record:
+                del owners[node_id]
+        indexed_node_ids = []
+        for node_id, (node, path, serialized_node) in node_index.items():
+            if node is owner_record["object"]:
+                continue
+            owners[node_id] = (node, owner_record, path, serialized_node)
+            indexed_node_ids.append(node_id)
+        owner_record["indexed_node_ids"] = indexed_node_ids
+
+    @staticmethod
+    def _record_alias(ds_type, name, target_record, path, operation, lineno, line_content):
+        """Record that `name` now refers to (part of) an already recorded object, without its content."""
+        DataStructureTracker._events.submit(
+            DataStructureTracker._build_alias_event, ds_type, name, target_record["ref"], target_record["name"], path,
+            operation, lineno, line_content, time.time())
+
+    @staticmethod
+    def _build_alias_event(ds_type, name, ref, target_name, path, operation, lineno, line_content, timestamp):
+        """Consumer side of _record_alias."""
+        binding_key = f"{ds_type}_{name}"
+        binding = (ref, path)
+        if DataStructureTracker._name_bindings.get(binding_key) == binding:
+            return # Same name, same object, no change: nothing new to say
+        DataStructureTracker._name_bindings[binding_key] = binding
+
+        event_data = {
+            "name": name,
+            "operation": operation,
+            "content": None,
+            "alias_of": target_name,
+            "ref": ref,
+            "timestamp": timestamp,
+            "location": f"line {lineno}",
+            "operation_details": {"code": line_content.strip()} if line_content else None,
+        }
+        if path:
+            event_data["path"] = list(path)
+        DataStructureTracker._data_structure_events[ds_type].append(event_data)
+
 
 # --- Trace Function and Helpers ---
 # These will be defined *inside* perform_code_analysis to access its scoped state variables.
 
-def perform_code_analysis(code_snippet: str) -> str:
+# DataStructureTracker keeps its state on the class, so only one analysis may run per
+# process at a time. Threaded servers queue here; the ASGI app uses worker processes.
+_analysis_lock = threading.Lock()
+
+
+def _stopped_execution_error(e_exit):
+    """The tracer's "error" entry for a snippet that raised SystemExit or KeyboardInterrupt."""
+    if isinstance(e_exit, SystemExit):
+        message = f"The code called exit() (exit status {e_exit.code!r})"
+    else:
+        message = "The code raised KeyboardInterrupt"
+    return {"message": message, "details": "".join(traceback.format_exception_only(type(e_exit), e_exit)).strip()}
+
+
+def perform_code_analysis(code_snippet: str, mode: str = "trace", watch=None) -> str:
     """
     Analyzes the given Python code snippet using sys.settrace to track data structures.
     This is the main entry point for tracing, replacing the MCP tool.
+    With mode="intercept" no line tracing happens at all; instead the snippet is
+    rewritten so its containers and tree nodes report their own mutations.
+    `watch` is an optional list of variable names to restrict tracing to; names from
+    "# trace:" comments in the snippet are added to it (see WATCH_PRAGMA).
     """
+    if mode not in TRACE_MODES:
+        raise ValueError(f"Unknown trace mode {mode!r}; expected one of {TRACE_MODES}")
+
+    with _analysis_lock:
+        try:
+            return _perform_code_analysis(code_snippet, mode, watch)
+        finally:
+            DataStructureTracker.close_event_queue() # Already drained, unless the analysis failed half-way
+
+
+def _perform_code_analysis(code_snippet: str, mode: str, watch=None) -> str:
     # Initialize/reset state for this specific analysis run
     DataStructureTracker.initialize_tracker_state()
-    DataStructureTracker.set_code_lines(code_snippet.strip().split('\n'))
+    # Set when the snippet could not run at all, or stopped the interpreter (see below); the
+    # result then carries it as its "error" and the analysis reports it instead of a trace.
+    execution_error = None
+    try:
+        compiled_snippet = get_compiled_snippet(code_snippet)
+    except SyntaxError as e_syntax:
+        compiled_snippet = None
+        print(f"Tracer: Error executing user code: {e_syntax}")
+        traceback.print_exc()
+        execution_error = {"message": f"Syntax error: {e_syntax.msg} (line {e_syntax.lineno})",
+                           "details": "".join(traceback.format_exception_only(type(e_syntax), e_syntax)).strip()}
+    if compiled_snippet is not None:
+        snippet_filename = compiled_snippet.filename
+        DataStructureTracker.set_code_lines(compiled_snippet.lines)
+        DataStructureTracker.set_operation_cache(compiled_snippet.operation_cache)
+    else:
+        snippet_filename = None
+        DataStructureTracker.set_code_lines(code_snippet.strip().split('\n'))
+
+    watch_names = set(watch or ()) | set(compiled_snippet.watch_pragma if compiled_snippet is not None else ())
+    watch_names = watch_names or None
+    DataStructureTracker.set_watch_names(watch_names)
+    if watch_names is not None:
+        print(f"Tracer: watching {sorted(watch_names)}")
+
+    if TRACE_EVENT_QUEUE:
+        DataStructureTracker.set_event_queue(event_queue.EventQueue(TRACE_EVENT_QUEUE_SIZE))
+
+    # Plain ints in a closure dict are much cheaper to bump per callback than the
+    # locked metrics registry; they are flushed to `metrics` once execution ends.
+    trace_stats = {"callbacks": 0, "skipped": 0}
+
+    # Stripped source lines of the snippet, indexed by lineno - 1 (precomputed once per snippet).
+    snippet_line_contents = compiled_snippet.line_contents if compiled_snippet is not None else []
+
+    # --- Frame filter ---
+    # Whether a frame is worth tracing depends only on its code object, so the
+    # decision is made once per code object and then looked up on every event.
+    frame_decisions = {} # code object -> bool
+
+    def should_trace_code(code):
+        func_name = code.co_name
+        filename = code.co_filename
+        # Filter out internal/library calls
+        return not (func_name.startswith('_') or
+                    'site-packages' in filename or
+                    '/lib/' in filename or
+                    (filename.startswith('<') and filename != snippet_filename) or # Allow tracing within the exec'd snippet
+                    func_name == 'trace_data_structures_internal' or # Avoid self-tracing
+                    DataStructureTracker.__module__ in filename) # Avoid tracing this module
+
+    def scan_current_frame(frame, event_operation_hint, lineno, line_content_str):
+        if watch_names is not None:
+            scan_watched_names(frame.f_locals if frame else None, event_operation_hint, lineno, line_content_str)
+            return
+        if frame and frame.f_locals:
+            for name, value in list(frame.f_locals.items()): # Iterate over a copy
+                if name.startswith('__') and name.endswith('__'): continue
+
+                if isinstance(value, list) or ndarray_tracking.is_ndarray(value):
+                    DataStructureTracker.record_data_structure_event("arrays", name, value, event_operation_hint, lineno, line_content_str)
+                elif DataStructureTracker.is_tree_node(value):
+                    DataStructureTracker.record_data_structure_event("trees", name, value, event_operation_hint, lineno, line_content_str)
+                elif DataStructureTracker.is_graph(value):
+                    DataStructureTracker.record_data_structure_event("graphs", name, value, event_operation_hint, lineno, line_content_str)
+
+    def scan_watched_names(scope, event_operation_hint, lineno, line_content_str):
+        """scan_current_frame with a watch list: classify the watched names, look up the rest by identity."""
+        if not scope:
+            return
+        for name, value in list(scope.items()):
+            if name in watch_names:
+                ds_type = DataStructureTracker.tracked_type(value) or classify(value)
+            else:
+                ds_type = DataStructureTracker.tracked_type(value)
+            if ds_type is not None:
+                DataStructureTracker.record_data_structure_event(ds_type, name, value, event_operation_hint, lineno, line_content_str)
+
+    def classify(value):
+        if isinstance(value, list) or ndarray_tracking.is_ndarray(value):
+            return "arrays"
+        if DataStructureTracker.is_tree_node(value):
+            return "trees"
+        if DataStructureTracker.is_graph(value):
+            return "graphs"
+        return None
 
     # --- Nested Trace Function ---
     # This function is defined inside perform_code_analysis to have access to 
     # its scope, particularly the tracker's state which is now managed by the class.
     def trace_data_structures_internal(frame, event, arg):
+        trace_stats["callbacks"] += 1
+        code = frame.f_code
+        is_traced = frame_decisions.get(code)
+        if is_traced is None:
+            is_traced = frame_decisions[code] = should_trace_code(code)
+        if not is_traced:
+            trace_stats["skipped"] += 1
+            # No local trace function: the interpreter stops sending line/return
+            # events for this frame (calls it makes still reach us as 'call' events).
+            return None
+
         try:
-            func_name = frame.f_code.co_name
-            filename = frame.f_code.co_filename
+            filename = code.co_filename
             lineno = frame.f_lineno
-            
-            # Filter out internal/library calls
-            if (func_name.startswith('_') or 
-                'site-packages' in filename or 
-                '/lib/' in filename or
-                (filename.startswith('<') and filename != '<string>') or # Allow tracing within <string> (exec'd code)
-                func_name == 'trace_data_structures_internal' or # Avoid self-tracing
-                DataStructureTracker.__module__ in filename): # Avoid tracing this module
-                return trace_data_structures_internal
 
             line_content_str = ""
             try:
-                if filename == '<string>': # Code executed by exec
-                    if 0 <= lineno - 1 < len(DataStructureTracker._code_lines_for_trace):
-                        line_content_str = DataStructureTracker._code_lines_for_trace[lineno - 1]
+                if filename == snippet_filename: # Code executed by exec
+                    if 0 <= lineno - 1 < len(snippet_line_contents):
+                        line_content_str = snippet_line_contents[lineno - 1]
                 else: # Code from a file
-                    line_content_str = linecache.getline(filename, lineno)
-                line_content_str = line_content_str.strip()
+                    line_content_str = linecache.getline(filename, lineno).strip()
             except Exception:
                 pass # Ignore errors fetching line content
 
-            # Helper to scan current frame
-            def scan_current_frame(event_operation_hint):
-                if frame and frame.f_locals:
-                    for name, value in list(frame.f_locals.items()): # Iterate over a copy
-                        if name.startswith('__') and name.endswith('__'): continue
-                        
-                        if isinstance(value, list):
-                            DataStructureTracker.record_data_structure_event("arrays", name, value, event_operation_hint, lineno, line_content_str)
-                        elif DataStructureTracker.is_tree_node(value):
-                            DataStructureTracker.record_data_structure_event("trees", name, value, event_operation_hint, lineno, line_content_str)
-                        elif DataStructureTracker.is_graph(value):
-                            DataStructureTracker.record_data_structure_event("graphs", name, value, event_operation_hint, lineno, line_content_str)
-            
             if event == 'line':
-                scan_current_frame("line_execution") # More descriptive hint
+                scan_current_frame(frame, "line_execution", lineno, line_content_str) # More descriptive hint
             elif event == 'call':
-                scan_current_frame("function_call_args")
+                scan_current_frame(frame, "function_call_args", lineno, line_content_str)
             elif event == 'return':
-                if isinstance(arg, list):
+                func_name = code.co_name
+                if watch_names is not None:
+                    # Return values have no name of their own: only record ones already reached through a watched name
+                    ds_type = DataStructureTracker.tracked_type(arg)
+                    if ds_type is not None:
+                        DataStructureTracker.record_data_structure_event(ds_type, f"{func_name}_return", arg, "return_value", lineno, line_content_str)
+                elif isinstance(arg, list):
                     DataStructureTracker.record_data_structure_event("arrays", f"{func_name}_return", arg, "return_value", lineno, line_content_str)
                 elif DataStructureTracker.is_tree_node(arg):
                     DataStructureTracker.record_data_structure_event("trees", f"{func_name}_return", arg, "return_value", lineno, line_content_str)
                 elif DataStructureTracker.is_graph(arg):
                     DataStructureTracker.record_data_structure_event("graphs", f"{func_name}_return", arg, "return_value", lineno, line_content_str)
-                scan_current_frame("function_return_locals") # Scan locals before function truly exits
+                scan_current_frame(frame, "function_return_locals", lineno, line_content_str) # Scan locals before function truly exits
         
         except Exception as e_trace:
             # print(f"Tracer: Error in trace_data_structures_internal: {e_trace}")
@@ -319,44 +967,74 @@ def perform_code_analysis(code_snippet: str) -> str:
         return trace_data_structures_internal
     # --- End of Nested Trace Function ---
 
-    # Prepare for execution
-    linecache.clearcache() # Clear linecache before new exec
-    # Add the current code snippet to linecache for <string>
-    # This makes linecache.getline('<string>', lineno) work during exec
-    linecache.cache['<string>'] = (
-        len(code_snippet), 
-        None, 
-        DataStructureTracker._code_lines_for_trace, 
-        '<string>'
-    )
+    # The snippet's source is already registered in linecache under its own
+    # filename by get_compiled_snippet, so tracebacks and getline() work during exec.
 
     exec_globals = {'__name__': '__main__'} # Clean global scope for exec
+    # exit()/sys.exit() or a KeyboardInterrupt raised by the snippet is not an Exception: it would
+    # leave the analysis (and, in a worker, take the executor or the event loop waiting on it)
+    # with it. It ends the run like any error, and is reported as the execution error.
 
-    # Set trace and execute
-    original_trace_func = sys.gettrace()
-    sys.settrace(trace_data_structures_internal)
-    
-    try:
-        exec(code_snippet, exec_globals)
-    except Exception as e_exec:
-        print(f"Tracer: Error executing user code: {e_exec}")
-        traceback.print_exc() # Log the traceback for debugging
-        # We can choose to include this error in the returned JSON if needed
-    finally:
-        sys.settrace(original_trace_func) # Restore original trace function (or None)
+    exec_start = time.perf_counter()
+    if mode == "intercept":
+        try:
+            if compiled_snippet is not None:
+                code_object = compiled_snippet.intercepted_code_object
+                exec_globals.update(mutation_tracking.interception_globals())
+                mutation_tracking.start_session(DataStructureTracker.record_mutation, DataStructureTracker.record_binding,
+                                                snippet_filename)
+                exec(code_object, exec_globals)
+        except Exception as e_exec:
+            print(f"Tracer: Error executing user code: {e_exec}")
+            traceback.print_exc()
+        except (SystemExit, KeyboardInterrupt) as e_exit:
+            print(f"Tracer: User code stopped the interpreter: {e_exit!r}")
+            execution_error = _stopped_execution_error(e_exit)
+        finally:
+            mutation_tracking.end_session()
+            metrics.record_phase("trace_exec", time.perf_counter() - exec_start)
+    else:
+        # Set trace and execute
+        original_trace_func = sys.gettrace()
+        sys.settrace(trace_data_structures_internal)
+
+        try:
+            if compiled_snippet is not None:
+                exec(compiled_snippet.code_object, exec_globals)
+        except Exception as e_exec:
+            print(f"Tracer: Error executing user code: {e_exec}")
+            traceback.print_exc() # Log the traceback for debugging
+            # We can choose to include this error in the returned JSON if needed
+        except (SystemExit, KeyboardInterrupt) as e_exit:
+            print(f"Tracer: User code stopped the interpreter: {e_exit!r}")
+            execution_error = _stopped_execution_error(e_exit)
+        finally:
+            sys.settrace(original_trace_func) # Restore original trace function (or None)
+            metrics.record_phase("trace_exec", time.perf_counter() - exec_start)
+
+    metrics.increment("trace_callbacks_total", trace_stats["callbacks"])
+    metrics.increment("trace_callbacks_skipped_total", trace_stats["skipped"])
 
     # After execution, capture final states of global variables from exec_globals
-    final_lineno = len(DataStructureTracker._code_lines_for_trace)
-    for name, value in exec_globals.items():
-        if name.startswith('__') or callable(value) or name in IGNORED_VARIABLES:
-            continue
-        
-        if isinstance(value, list):
-            DataStructureTracker.record_data_structure_event("arrays", name, value, "final_state", final_lineno, "global_scope_end")
-        elif DataStructureTracker.is_tree_node(value):
-            DataStructureTracker.record_data_structure_event("trees", name, value, "final_state", final_lineno, "global_scope_end")
-        elif DataStructureTracker.is_graph(value):
-            DataStructureTracker.record_data_structure_event("graphs", name, value, "final_state", final_lineno, "global_scope_end")
+    with metrics.phase("trace_final_scan"):
+        final_lineno = len(DataStructureTracker._code_lines_for_trace)
+        for name, value in exec_globals.items():
+            if name.startswith('__') or callable(value) or name in IGNORED_VARIABLES:
+                continue
+            if watch_names is not None and name not in watch_names and DataStructureTracker.tracked_type(value) is None:
+                continue
+
+            if isinstance(value, list) or ndarray_tracking.is_ndarray(value):
+                DataStructureTracker.record_data_structure_event("arrays", name, value, "final_state", final_lineno, "global_scope_end")
+            elif DataStructureTracker.is_tree_node(value):
+                DataStructureTracker.record_data_structure_event("trees", name, value, "final_state", final_lineno, "global_scope_end")
+            elif DataStructureTracker.is_graph(value):
+                DataStructureTracker.record_data_structure_event("graphs", name, value, "final_state", final_lineno, "global_scope_end")
+
+    # Every event must be built before the result is compiled
+    with metrics.phase("trace_event_drain"):
+        events = DataStructureTracker.close_event_queue()
+    metrics.increment("trace_event_queue_waits_total", events.waits)
 
     # Compile results
     result = {
@@ -367,9 +1045,14 @@ def perform_code_analysis(code_snippet: str) -> str:
         "data_structures": DataStructureTracker.get_tracked_events()
         # "error": execution_error_info # Optionally include execution error details
     }
+    if execution_error is not None:
+        result["error"] = execution_error
     
     try:
-        return json.dumps(result, default=str, indent=2)
+        with metrics.phase("trace_serialize"):
+            result_json = json.dumps(result, default=str, indent=2)
+        metrics.increment("serialized_bytes_total", len(result_json), {"stage": "trace"})
+        return result_json
     except Exception as e_json:
         print(f"Tracer: Error serializing final result to JSON: {e_json}")
         # Fallback error JSON
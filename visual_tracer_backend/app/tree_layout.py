@@ -0,0 +1,150 @@
+import math
+import os
+
+# --- Server-side tree layout ---
+# Every kept tree event gets a "layout" next to its "content", so the frontend can place
+# (and interpolate) nodes instead of running a D3 tree layout for every playback step:
+#
+#   "layout": {
+#       "x": [...],       Reingold-Tilford position, in units of one node separation, root at x = 0
+#       "depth": [...],   level below the root (the y coordinate, and the radius in the radial view)
+#       "angle": [...],   radial layout: x wrapped around the root, in radians
+#       "extent": {"min_x": ..., "max_x": ..., "depth": ...}
+#   }
+#
+# The lists hold one entry per node, in pre-order over `content`: a node, then its
+# "left", "right" and "children" subtrees in that order (the order TreeVisualizer uses
+# for its node paths), so no per-node keys are shipped.
+#
+# A subtree's Reingold-Tilford layout only depends on its shape (which child slots are
+# filled, recursively), not on the values. Shapes are interned: every distinct subtree
+# shape gets a small id, and its relative layout (child offsets and left/right contours)
+# is computed once per trace. Between steps, only subtrees whose structure changed have a
+# new shape and are laid out again; everything else is a dictionary lookup, and a step
+# whose whole tree kept its shape reuses the previous layout as is.
+
+TREE_LAYOUT = os.environ.get("TREE_LAYOUT", "1") == "1" # Set to 0 to ship trees without coordinates
+NODE_SEPARATION = 1.0 # Minimum horizontal distance between two nodes on the same level
+COORDINATE_DIGITS = 4
+
+
+class TreeLayoutCache:
+    """Interned subtree shapes and their relative layouts, shared by all steps of one trace."""
+
+    def __init__(self):
+        self.shape_ids = {}   # shape key -> shape id
+        self.shapes = []      # shape id -> (children key, child offsets, left contour, right contour)
+        self.tree_layouts = {} # root shape id -> finished "layout" document
+
+    def shape_id(self, children):
+        """`children` is a tuple of (slot, child shape id); slots are path suffixes (".left", ".children[2]")."""
+        shape_id = self.shape_ids.get(children)
+        if shape_id is None:
+            shape_id = len(self.shapes)
+            self.shapes.append((children,) + self._layout_shape(children))
+            self.shape_ids[children] = shape_id
+        return shape_id
+
+    def _layout_shape(self, children):
+        """Reingold-Tilford step: pack the child subtrees by their contours and center the parent."""
+        if not children:
+            return (), (0.0,), (0.0,)
+        positions = []
+        left_contour = right_contour = None # Of the children placed so far, per depth below the parent
+        for _, child_id in children:
+            _, _, child_left, child_right = self.shapes[child_id]
+            if right_contour is None:
+                position = 0.0
+                left_contour, right_contour = list(child_left), list(child_right)
+            else:
+                # Closest position that keeps this subtree NODE_SEPARATION right of its left neighbours on every level
+                position = max(right_contour[depth] - child_left[depth] + NODE_SEPARATION
+                               for depth in range(min(len(right_contour), len(child_left))))
+                for depth, x in enumerate(child_right):
+                    if depth < len(right_contour):
+                        right_contour[depth] = x + position
+                    else:
+                        right_contour.append(x + position)
+                left_contour.extend(x + position for x in child_left[len(left_contour):])
+            positions.append(position)
+
+        if len(children) == 1 and children[0][0] in (".left", ".right"):
+            # A lone binary child still leans to its side, so left and right stay distinguishable
+            center = positions[0] + (NODE_SEPARATION / 2 if children[0][0] == ".left" else -NODE_SEPARATION / 2)
+        else:
+            center = (positions[0] + positions[-1]) / 2
+        return (tuple(position - center for position in positions),
+                (0.0,) + tuple(x - center for x in left_contour),
+                (0.0,) + tuple(x - center for x in right_contour))
+
+    def layout(self, content):
+        """The "layout" document for one serialized tree (see serialize_tree)."""
+        root_id = self._intern(content)
+        layout = self.tree_layouts.get(root_id)
+        if layout is None:
+            layout = self._place(root_id)
+            self.tree_layouts[root_id] = layout
+        return layout
+
+    def _intern(self, content):
+        """Shape id of the whole tree, interning every subtree bottom-up (iterative, so deep trees are fine)."""
+        shape_of = {} # id(node dict) -> shape id
+        stack = [(content, None)]
+        while stack:
+            node, slots = stack.pop()
+            if slots is None:
+                slots = child_slots(node)
+                stack.append((node, slots))
+                stack.extend((child, None) for _, child in slots)
+            else:
+                shape_of[id(node)] = self.shape_id(tuple([(slot, shape_of[id(child)]) for slot, child in slots]))
+        return shape_of[id(content)]
+
+    def _place(self, root_id):
+        """
+        Absolute coordinates: the relative child offsets summed from the root down, in
+        pre-order. Only the shape table is walked, the content itself is not needed.
+        """
+        shapes = self.shapes
+        xs, depths = [], []
+        stack = [(root_id, 0.0, 0)]
+        while stack:
+            shape, x, depth = stack.pop()
+            xs.append(x)
+            depths.append(depth)
+            children, offsets = shapes[shape][0], shapes[shape][1]
+            for index in range(len(children) - 1, -1, -1):
+                stack.append((children[index][1], x + offsets[index], depth + 1))
+        _, _, left_contour, right_contour = self.shapes[root_id]
+        min_x, max_x = min(left_contour), max(right_contour)
+        # Leave one separation between the last and the first node around the circle
+        span = max_x - min_x + NODE_SEPARATION
+        return {
+            "x": [round(x, COORDINATE_DIGITS) for x in xs],
+            "depth": depths,
+            "angle": [round(2 * math.pi * (x - min_x) / span, COORDINATE_DIGITS) for x in xs],
+            "extent": {"min_x": round(min_x, COORDINATE_DIGITS), "max_x": round(max_x, COORDINATE_DIGITS),
+                       "depth": len(left_contour) - 1},
+        }
+
+
+def child_slots(node):
+    """(path suffix, child) in the order TreeVisualizer walks them: left, right, then children."""
+    slots = []
+    if isinstance(node.get("left"), dict):
+        slots.append((".left", node["left"]))
+    if isinstance(node.get("right"), dict):
+        slots.append((".right", node["right"]))
+    for index, child in enumerate(node.get("children") or []):
+        if isinstance(child, dict):
+            slots.append((f".children[{index}]", child))
+    return slots
+
+
+def add_layouts(tree_events):
+    """Attaches a "layout" to every filtered tree event with content (in place)."""
+    cache = TreeLayoutCache()
+    for event in tree_events:
+        if isinstance(event.get("content"), dict):
+            event["layout"] = cache.layout(event["content"])
+    return tree_events
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import re
+from collections import deque
+
+from . import tree_layout
+
+# --- Depth- and size-bounded tree views ---
+# GET /api/data/trees?max_depth=<d>&max_nodes=<n> returns every tree step cut down to the
+# first `d` levels and/or about `n` nodes (breadth-first from the root). Every subtree
+# that was cut off is replaced by a placeholder leaf:
+#
+#   {"value": "+120", "children": [],
+#    "collapsed": {"path": "root.left.right", "size": 120, "hash": "<16 hex digits>"}}
+#
+# "value" is a label, so views that know nothing about placeholders still draw them as a
+# node; "hash" identifies the subtree's content (equal hashes, equal subtrees), so a client
+# can keep an expanded region across steps until it changes. Paths use the node path
+# format of the tree view ("root", then ".left", ".right" or ".children[i]" per level).
+#
+# The cut is focused on what the step changed: the nodes that differ from the previous
+# step of the same tree, their ancestors and FOCUS_DEPTH levels below them are always
+# kept, whatever the depth or node budget. GET /api/data/trees/subtree returns the
+# subtree under one placeholder (bounded the same way) when the user expands it.
+#
+# The stored events keep the full trees; views are cut per request. A "layout" (see
+# tree_layout.py) is recomputed for the cut tree, where a placeholder is a single leaf.
+
+FOCUS_DEPTH = 2 # Levels kept below every changed node
+MAX_FOCUS_PATHS = 8 # Changed nodes a step is focused on (the first ones in pre-order)
+HASH_DIGITS = 16
+_PATH_PART = re.compile(r"\.(left|right)|\.children\[(\d+)\]")
+
+
+def subtree_at(content, path):
+    """The node at `path` ("root.left.children[2]") in a serialized tree, or None."""
+    if not path.startswith("root"):
+        return None
+    node, position = content, len("root")
+    while position < len(path):
+        match = _PATH_PART.match(path, position)
+        if match is None or not isinstance(node, dict):
+            return None
+        if match.group(1):
+            node = node.get(match.group(1))
+        else:
+            children = node.get("children") or []
+            index = int(match.group(2))
+            node = children[index] if index < len(children) else None
+        position = match.end()
+    return node if isinstance(node, dict) else None
+
+
+def changed_paths(previous_content, content):
+    """
+    Paths of the nodes whose value or child slots differ from the previous step (pre-order,
+    at most MAX_FOCUS_PATHS). A child that did not exist before counts as one changed node.
+    """
+    if not isinstance(previous_content, dict) or not isinstance(content, dict):
+        return []
+    paths = []
+    stack = [(previous_content, content, "root")]
+    while stack and len(paths) < MAX_FOCUS_PATHS:
+        previous, current, path = stack.pop()
+        previous_slots = dict(tree_layout.child_slots(previous))
+        current_slots = tree_layout.child_slots(current)
+        if previous.get("value") != current.get("value") or set(previous_slots) != {slot for slot, _ in current_slots}:
+            paths.append(path)
+        for slot, child in reversed(current_slots):
+            if slot in previous_slots:
+                stack.append((previous_slots[slot], child, path + slot))
+            else:
+                paths.append(path + slot)
+    return paths[:MAX_FOCUS_PATHS]
+
+
+def _subtree_summary(node):
+    """(node count, content hash) of a subtree that is cut off."""
+    size = 0
+    stack = [node]
+    while stack:
+        size += 1
+        stack.extend(child for _, child in tree_layout.child_slots(stack.pop()))
+    digest = hashlib.sha1(json.dumps(node, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return size, digest[:HASH_DIGITS]
+
+
+def _is_below(path, ancestor_path):
+    """`path` is `ancestor_path` or a node under it ("root.children[1]" is not under "root.children[10]")."""
+    return path.startswith(ancestor_path) and (len(path) == len(ancestor_path) or path[len(ancestor_path)] == ".")
+
+
+def _is_focused(path, focus_paths):
+    """On the way to a changed node, or at most FOCUS_DEPTH levels below one."""
+    for focus_path in focus_paths:
+        if _is_below(focus_path, path):
+            return True
+        if _is_below(path, focus_path) and path[len(focus_path):].count(".") <= FOCUS_DEPTH:
+            return True
+    return False
+
+
+def _shallow_copy(node):
+    """The node without its subtrees; a "children" list keeps its length, so child indices stay valid."""
+    copy = {key: value for key, value in node.items() if key not in ("left", "right", "children")}
+    if isinstance(node.get("children"), list):
+        copy["children"] = [None] * len(node["children"])
+    return copy
+
+
+def bound(content, max_depth=None, max_nodes=None, focus_paths=(), root_path="root"):
+    """A copy of `content` cut to `max_depth` levels / about `max_nodes` nodes (see above)."""
+    bounded_root = _shallow_copy(content)
+    kept = 1
+    queue = deque([(content, bounded_root, root_path, 0)])
+    while queue:
+        node, bounded_node, path, depth = queue.popleft()
+        for slot, child in tree_layout.child_slots(node):
+            child_path = path + slot
+            if (_is_focused(child_path, focus_paths)
+                    or ((max_depth is None or depth < max_depth) and (max_nodes is None or kept < max_nodes))):
+                bounded_child = _shallow_copy(child)
+                queue.append((child, bounded_child, child_path, depth + 1))
+                kept += 1
+            else:
+                size, digest = _subtree_summary(child)
+                bounded_child = {"value": f"+{size}", "children": [],
+                                 "collapsed": {"path": child_path, "size": size, "hash": digest}}
+            if slot.startswith(".children"):
+                bounded_node["children"][int(slot[len(".children["):-1])] = bounded_child
+            else:
+                bounded_node[slot[1:]] = bounded_child
+    return bounded_root
+
+
+def bound_events(tree_events, max_depth=None, max_nodes=None, start=0, previous_events=()):
+    """
+    Copies of the filtered tree events with bounded content, each with its "step" index
+    (for the subtree endpoint). `previous_events` are the steps before `start` (paging),
+    so the first returned step can still be focused on its changes.
+    """
+    last_content = {} # tree ref (or name) -> content of its previous step
+    for event in previous_events:
+        last_content[event.get("ref") or event.get("name")] = event.get("content")
+
+    layout_cache = tree_layout.TreeLayoutCache()
+    bounded_events = []
+    for step, event in enumerate(tree_events, start):
+        tree_key = event.get("ref") or event.get("name")
+        content = event.get("content")
+        previous_content = last_content.get(tree_key)
+        last_content[tree_key] = content
+        event = dict(event, step=step)
+        if isinstance(content, dict):
+            event["content"] = bound(content, max_depth, max_nodes, changed_paths(previous_content, content))
+            if "layout" in event:
+                event["layout"] = layout_cache.layout(event["content"])
+        bounded_events.append(event)
+    return bounded_events
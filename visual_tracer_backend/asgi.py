@@ -0,0 +1,9 @@
+from app.asgi import create_asgi_app # Import the ASGI application factory
+
+# ASGI entry point, the async counterpart of run.py. Serve it with an ASGI server, e.g.:
+#   pip install uvicorn
+#   uvicorn asgi:application --host 127.0.0.1 --port 8000
+# POST /api/analyze is handled asynchronously (tracing in worker processes, LLM calls
+# awaited); all other routes are served by the same Flask app as run.py.
+# ANALYSIS_EXECUTOR ("process" or "thread") and ANALYSIS_WORKERS configure the tracing pool.
+application = create_asgi_app()
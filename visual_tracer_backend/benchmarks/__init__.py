@@ -0,0 +1,2 @@
+# Benchmark harness for the tracer, the event filter and the /api/analyze pipeline.
+# Run from visual_tracer_backend/:  python -m benchmarks.run_benchmarks --help
@@ -0,0 +1,253 @@
+import random
+
+# --- Benchmark corpus ---
+# Each generator returns a self-contained Python snippet, written the way users
+# paste code into the frontend (module-level code, no imports of our modules).
+# Inputs are generated from a fixed seed so runs are comparable across machines.
+
+SEED = 1234
+
+
+def _random_values(n, seed=SEED, upper=None):
+    rng = random.Random(seed + n)
+    return [rng.randint(0, upper or n * 10) for _ in range(n)]
+
+
+def bubble_sort(n):
+    return (
+        f"arr = {_random_values(n)}\n"
+        "n = len(arr)\n"
+        "for a in range(n):\n"
+        "    for b in range(0, n - a - 1):\n"
+        "        if arr[b] > arr[b + 1]:\n"
+        "            arr[b], arr[b + 1] = arr[b + 1], arr[b]\n"
+    )
+
+
+def merge_sort(n):
+    return (
+        "def merge_sort(items):\n"
+        "    if len(items) <= 1:\n"
+        "        return items\n"
+        "    mid = len(items) // 2\n"
+        "    left = merge_sort(items[:mid])\n"
+        "    right = merge_sort(items[mid:])\n"
+        "    merged = []\n"
+        "    a = b = 0\n"
+        "    while a < len(left) and b < len(right):\n"
+        "        if left[a] <= right[b]:\n"
+        "            merged.append(left[a])\n"
+        "            a += 1\n"
+        "        else:\n"
+        "            merged.append(right[b])\n"
+        "            b += 1\n"
+        "    merged.extend(left[a:])\n"
+        "    merged.extend(right[b:])\n"
+        "    return merged\n"
+        "\n"
+        f"arr = {_random_values(n)}\n"
+        "arr = merge_sort(arr)\n"
+    )
+
+
+def quick_sort(n):
+    return (
+        "def partition(items, lo, hi):\n"
+        "    pivot = items[hi]\n"
+        "    store = lo\n"
+        "    for scan in range(lo, hi):\n"
+        "        if items[scan] < pivot:\n"
+        "            items[scan], items[store] = items[store], items[scan]\n"
+        "            store += 1\n"
+        "    items[store], items[hi] = items[hi], items[store]\n"
+        "    return store\n"
+        "\n"
+        "def quick_sort(items, lo, hi):\n"
+        "    if lo < hi:\n"
+        "        p = partition(items, lo, hi)\n"
+        "        quick_sort(items, lo, p - 1)\n"
+        "        quick_sort(items, p + 1, hi)\n"
+        "\n"
+        f"arr = {_random_values(n)}\n"
+        "quick_sort(arr, 0, len(arr) - 1)\n"
+    )
+
+
+_BST_PRELUDE = (
+    "class TreeNode:\n"
+    "    def __init__(self, value):\n"
+    "        self.value = value\n"
+    "        self.left = None\n"
+    "        self.right = None\n"
+    "\n"
+    "def insert(node, value):\n"
+    "    if node is None:\n"
+    "        return TreeNode(value)\n"
+    "    if value < node.value:\n"
+    "        node.left = insert(node.left, value)\n"
+    "    else:\n"
+    "        node.right = insert(node.right, value)\n"
+    "    return node\n"
+    "\n"
+)
+
+
+def bst_insert(n):
+    return (
+        _BST_PRELUDE
+        + f"values = {_random_values(n, upper=n * 100)}\n"
+        "root = None\n"
+        "for v in values:\n"
+        "    root = insert(root, v)\n"
+    )
+
+
+def bst_delete(n):
+    return (
+        _BST_PRELUDE
+        + "def delete(node, value):\n"
+        "    if node is None:\n"
+        "        return None\n"
+        "    if value < node.value:\n"
+        "        node.left = delete(node.left, value)\n"
+        "    elif value > node.value:\n"
+        "        node.right = delete(node.right, value)\n"
+        "    else:\n"
+        "        if node.left is None:\n"
+        "            return node.right\n"
+        "        if node.right is None:\n"
+        "            return node.left\n"
+        "        successor = node.right\n"
+        "        while successor.left is not None:\n"
+        "            successor = successor.left\n"
+        "        node.value = successor.value\n"
+        "        node.right = delete(node.right, successor.value)\n"
+        "    return node\n"
+        "\n"
+        f"values = {_random_values(n, upper=n * 100)}\n"
+        "root = None\n"
+        "for v in values:\n"
+        "    root = insert(root, v)\n"
+        "for v in values[::2]:\n"
+        "    root = delete(root, v)\n"
+    )
+
+
+def nary_tree(n, branching=3):
+    return (
+        "class Node:\n"
+        "    def __init__(self, data):\n"
+        "        self.data = data\n"
+        "        self.children = []\n"
+        "\n"
+        "root = Node(0)\n"
+        "frontier = [root]\n"
+        "created = 1\n"
+        f"while created < {n}:\n"
+        "    parent = frontier.pop(0)\n"
+        f"    for c in range({branching}):\n"
+        f"        if created >= {n}:\n"
+        "            break\n"
+        "        child = Node(created)\n"
+        "        parent.children.append(child)\n"
+        "        frontier.append(child)\n"
+        "        created += 1\n"
+    )
+
+
+def _graph_literal(n, edges_per_node, seed=SEED):
+    rng = random.Random(seed + n * 31 + edges_per_node)
+    graph = {}
+    for node in range(n):
+        targets = rng.sample(range(n), min(edges_per_node, n))
+        graph[str(node)] = [str(t) for t in targets if t != node]
+    return graph
+
+
+def _graph_builder(n, edges_per_node):
+    # Build the adjacency list edge by edge so the tracer sees add_edge-style updates.
+    graph = _graph_literal(n, edges_per_node)
+    edges = [(u, v) for u, targets in graph.items() for v in targets]
+    return (
+        f"edges = {edges}\n"
+        "graph = {}\n"
+        "for u, v in edges:\n"
+        "    if u not in graph:\n"
+        "        graph[u] = []\n"
+        "    graph[u].append(v)\n"
+    )
+
+
+def bfs(n, dense=False):
+    edges_per_node = max(2, n // 3) if dense else 2
+    return (
+        _graph_builder(n, edges_per_node)
+        + "visited = []\n"
+        "queue = ['0']\n"
+        "while queue:\n"
+        "    current = queue.pop(0)\n"
+        "    if current in visited:\n"
+        "        continue\n"
+        "    visited.append(current)\n"
+        "    for neighbor in graph.get(current, []):\n"
+        "        if neighbor not in visited:\n"
+        "            queue.append(neighbor)\n"
+    )
+
+
+def dfs(n, dense=False):
+    edges_per_node = max(2, n // 3) if dense else 2
+    return (
+        _graph_builder(n, edges_per_node)
+        + "visited = []\n"
+        "def dfs(g, start):\n"
+        "    stack = [start]\n"
+        "    while stack:\n"
+        "        current = stack.pop()\n"
+        "        if current not in visited:\n"
+        "            visited.append(current)\n"
+        "            for neighbor in g.get(current, []):\n"
+        "                stack.append(neighbor)\n"
+        "dfs(graph, '0')\n"
+    )
+
+
+def deep_recursion(depth):
+    return (
+        "def build(level, acc):\n"
+        "    acc.append(level)\n"
+        "    if level == 0:\n"
+        "        return acc\n"
+        "    return build(level - 1, acc)\n"
+        "\n"
+        f"path = build({depth}, [])\n"
+    )
+
+
+def build_corpus(quick=False):
+    """
+    Returns an ordered dict-like mapping of case name -> snippet.
+    `quick` keeps only the smallest size of each family (useful for smoke runs).
+    """
+    sort_sizes = (10,) if quick else (10, 50, 200)
+    tree_sizes = (15,) if quick else (15, 100, 400)
+    graph_sizes = (8,) if quick else (8, 40, 120)
+    recursion_depths = (50,) if quick else (50, 300)
+
+    cases = {}
+    for n in sort_sizes:
+        cases[f"bubble_sort_{n}"] = bubble_sort(n)
+        cases[f"merge_sort_{n}"] = merge_sort(n)
+        cases[f"quick_sort_{n}"] = quick_sort(n)
+    for n in tree_sizes:
+        cases[f"bst_insert_{n}"] = bst_insert(n)
+        cases[f"bst_delete_{n}"] = bst_delete(n)
+        cases[f"nary_tree_{n}"] = nary_tree(n)
+    for n in graph_sizes:
+        cases[f"bfs_sparse_{n}"] = bfs(n)
+        cases[f"bfs_dense_{n}"] = bfs(n, dense=True)
+        cases[f"dfs_sparse_{n}"] = dfs(n)
+        cases[f"dfs_dense_{n}"] = dfs(n, dense=True)
+    for depth in recursion_depths:
+        cases[f"deep_recursion_{depth}"] = deep_recursion(depth)
+    return cases
@@ -0,0 +1,382 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Allow running both as `python -m benchmarks.loadtest` and as a plain script.
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from app import llm_providers
+from benchmarks import corpus
+
+# --- Multi-user HTTP load test ---
+# Drives a running backend with concurrent virtual users. Each user loops over sessions
+# that do what the frontend does after "Analyze": POST /api/analyze with a snippet of the
+# benchmark corpus, then GET /api/data/<type> (with the frontend's LOD/bounding params)
+# and /api/visualization/<type> for every structure type, and /api/execution_data.
+# When the server has a trace store (TRACE_STORE_DIR), the GETs carry the trace_id that
+# /api/analyze returned; otherwise they read the "last analysis", like the frontend does.
+#
+# The concurrency is raised level by level (--concurrency 1,2,4,8); every level runs for
+# --duration seconds and reports p50/p95/p99 latency per endpoint and per session,
+# throughput and error rate. --stop-p95 ends the ramp at the first level whose session
+# p95 is above it.
+#
+# The LLM is replaced by a local Mistral stand-in (StubMistralServer) with configurable
+# latency and failure rate, so the numbers measure this server and not the Mistral API.
+# With --spawn the harness also starts the backend itself, pointed at the stub:
+#
+#   python -m benchmarks.loadtest --spawn --concurrency 1,4,16 --llm-latency 0.3
+#   python -m benchmarks.loadtest --spawn "gunicorn -c gunicorn.conf.py run:app" --llm-failure-rate 0.05
+#
+# Against a server started by hand, start it with MISTRAL_ENDPOINT set to the stub URL
+# the harness prints (--stub-port fixes the port), or without the stub (--no-stub).
+
+STRUCTURE_TYPES = ("arrays", "trees", "graphs")
+# The query parameters the frontend components send (see ArrayVisualizer/TreeVisualizer)
+FRONTEND_DATA_PARAMS = {"arrays": {"width": 500}, "trees": {"max_nodes": 500}, "graphs": {}}
+SERVER_START_TIMEOUT = 60
+
+
+class StubMistralServer:
+    """A local stand-in for POST /v1/chat/completions of the Mistral API, on its own thread."""
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, port=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0 # Accepted TCP connections: with keep-alive, far fewer than requests
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, reply = stub.reply(body)
+                payload = json.dumps(reply).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass # One line per LLM request would drown the report
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def counts(self):
+        with self._lock:
+            return self.requests, self.failures, self.connections
+
+    def reply(self, body):
+        """(status, JSON body) for one chat request: a selection taken from the prompt, or a 503."""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            failed = self._rng.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        time.sleep(delay)
+        if failed:
+            # 503 is in the SDK's retry list, so a failure costs retries and backoff, like a real outage
+            return 503, {"object": "error", "message": "Stub failure", "type": "service_unavailable"}
+        try:
+            prompt = json.loads(body)["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            prompt = ""
+        content = llm_providers.stub_reply(prompt) # The selection the prompt spells out
+        return 200, {
+            "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+
+
+def start_backend(command, port, stub_url):
+    """Starts the backend with `command` on `port`, pointed at the stub; waits until it answers."""
+    env = dict(os.environ, FLASK_RUN_PORT=str(port), FLASK_DEBUG="0")
+    env.setdefault("MISTRAL_API_KEY", "loadtest-stub-key")
+    if stub_url:
+        env["MISTRAL_ENDPOINT"] = stub_url
+    argv = shlex.split(command) if command else [sys.executable, "run.py"]
+    if argv[0] == "gunicorn":
+        argv += ["--bind", f"127.0.0.1:{port}"]
+    elif argv[0] == "uvicorn":
+        argv += ["--port", str(port)]
+    process = subprocess.Popen(argv, cwd=_BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}: {' '.join(argv)}")
+        try:
+            with urllib.request.urlopen(url + "/test", timeout=1):
+                return process, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Backend did not answer within {SERVER_START_TIMEOUT} s: {' '.join(argv)}")
+
+
+def _request(url, timeout, body=None):
+    """(seconds, HTTP status or None on a connection error/timeout, parsed JSON body or None)."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"} if data else {})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    except (urllib.error.URLError, OSError):
+        return time.perf_counter() - start, None, None
+    seconds = time.perf_counter() - start
+    try:
+        return seconds, status, json.loads(raw)
+    except ValueError:
+        return seconds, status, None
+
+
+def run_session(base_url, code_snippet, timeout):
+    """One analyze + follow-up GETs; returns [(endpoint label, seconds, status, ok), ...] and the session time."""
+    samples = []
+    start = time.perf_counter()
+    seconds, status, payload = _request(base_url + "/api/analyze", timeout, {"code": code_snippet})
+    samples.append(("POST /api/analyze", seconds, status, status == 200))
+    query = {}
+    if isinstance(payload, dict) and payload.get("trace_id"):
+        query["trace_id"] = payload["trace_id"]
+    for structure_type in STRUCTURE_TYPES:
+        params = urllib.parse.urlencode(dict(query, **FRONTEND_DATA_PARAMS[structure_type]))
+        seconds, status, data = _request(f"{base_url}/api/data/{structure_type}?{params}", timeout)
+        samples.append((f"GET /api/data/{structure_type}", seconds, status, status == 200))
+        params = urllib.parse.urlencode(query)
+        seconds, status, _ = _request(f"{base_url}/api/visualization/{structure_type}?{params}", timeout)
+        # A snippet without this structure type has no selection: the 404 is the expected answer
+        samples.append((f"GET /api/visualization/{structure_type}", seconds, status,
+                        status == 200 or (status == 404 and data == [])))
+    seconds, status, _ = _request(f"{base_url}/api/execution_data?{urllib.parse.urlencode(query)}", timeout)
+    samples.append(("GET /api/execution_data", seconds, status, status == 200))
+    return samples, time.perf_counter() - start
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list (None when empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _latency_summary(timings):
+    timings = sorted(timings)
+    return {
+        "p50": _percentile(timings, 50),
+        "p95": _percentile(timings, 95),
+        "p99": _percentile(timings, 99),
+        "max": timings[-1] if timings else None,
+    }
+
+
+def run_level(base_url, cases, concurrency, duration, timeout, seed, stub=None):
+    """Runs `concurrency` virtual users for `duration` seconds; returns the level's report."""
+    samples, sessions, failed_sessions = [], [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    names = list(cases)
+    llm_before = stub.counts() if stub else (0, 0, 0)
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index) # Every user walks its own, reproducible snippet mix
+        while time.perf_counter() < stop_at:
+            session_samples, session_seconds = run_session(base_url, cases[rng.choice(names)], timeout)
+            with lock:
+                samples.extend(session_samples)
+                sessions.append(session_seconds)
+                if not all(ok for _, _, _, ok in session_samples):
+                    failed_sessions[0] += 1
+
+    start = time.perf_counter()
+    users = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    elapsed = time.perf_counter() - start # Includes the sessions still running at the deadline
+
+    endpoints = {}
+    for label, seconds, status, ok in samples:
+        entry = endpoints.setdefault(label, {"timings": [], "errors": 0, "error_statuses": {}})
+        entry["timings"].append(seconds)
+        if not ok:
+            entry["errors"] += 1
+            status_key = str(status) if status is not None else "connection"
+            entry["error_statuses"][status_key] = entry["error_statuses"].get(status_key, 0) + 1
+    errors = sum(entry["errors"] for entry in endpoints.values())
+    llm_after = stub.counts() if stub else (0, 0, 0)
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "sessions": len(sessions),
+        "requests": len(samples),
+        "sessions_per_second": len(sessions) / elapsed if elapsed > 0 else None,
+        "requests_per_second": len(samples) / elapsed if elapsed > 0 else None,
+        "error_rate": errors / len(samples) if samples else None,
+        "failed_sessions": failed_sessions[0],
+        "session_latency": _latency_summary(sessions),
+        "endpoints": {
+            label: dict(_latency_summary(entry["timings"]), requests=len(entry["timings"]),
+                        errors=entry["errors"], error_statuses=entry["error_statuses"])
+            for label, entry in endpoints.items()
+        },
+        "llm_requests": llm_after[0] - llm_before[0],
+        "llm_failures": llm_after[1] - llm_before[1],
+        "llm_connections": llm_after[2] - llm_before[2],
+    }
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}" if seconds is not None else "-"
+
+
+def print_level(level):
+    session = level["session_latency"]
+    print(f"\nconcurrency {level['concurrency']}: {level['sessions']} sessions, "
+          f"{level['sessions_per_second']:.2f} sessions/s, {level['requests_per_second']:.1f} requests/s, "
+          f"error rate {level['error_rate'] or 0:.2%}, LLM {level['llm_requests']} requests / {level['llm_failures']} failed "
+          f"/ {level['llm_connections']} connections",
+          file=sys.stderr)
+    print(f"{'endpoint':<32}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}", file=sys.stderr)
+    rows = list(level["endpoints"].items()) + [("session", dict(session, requests=level["sessions"], errors=level["failed_sessions"]))]
+    for label, entry in rows:
+        print(f"{label:<32}{entry['requests']:>9}{entry['errors']:>8}"
+              f"{_ms(entry['p50']):>9}{_ms(entry['p95']):>9}{_ms(entry['p99']):>9}", file=sys.stderr)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=_BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the visual tracer backend with concurrent users.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Backend to test (ignored with --spawn).")
+    parser.add_argument("--spawn", nargs="?", const="", default=None, metavar="COMMAND",
+                        help="Start the backend (default: python run.py; or e.g. a gunicorn/uvicorn command) pointed at the stub.")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the spawned backend.")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated virtual user counts, run in order.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level.")
+    parser.add_argument("--stop-p95", type=float, help="Stop the ramp after a level whose session p95 (seconds) is above this.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (seconds).")
+    parser.add_argument("--full-corpus", action="store_true", help="Include the large corpus sizes (default: the smallest of each family).")
+    parser.add_argument("--filter", dest="case_filter", help="Only use snippets whose name contains this substring.")
+    parser.add_argument("--seed", type=int, default=corpus.SEED, help="Seed of the per-user snippet choice.")
+    parser.add_argument("--no-stub", action="store_true", help="Do not start the LLM stub (the server uses its own LLM settings).")
+    parser.add_argument("--stub-port", type=int, default=0, help="Port for the LLM stub (default: any free port).")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub LLM latency (seconds).")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Extra uniform random stub latency, up to this (seconds).")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Fraction of stub LLM requests answered with a 503.")
+    parser.add_argument("--output", "-o", help="Write the report as JSON to this path (default: stdout).")
+    args = parser.parse_args(argv)
+
+    cases = corpus.build_corpus(quick=not args.full_corpus)
+    if args.case_filter:
+        cases = {name: code for name, code in cases.items() if args.case_filter in name}
+    if not cases:
+        parser.error("No snippets match --filter")
+    levels = [int(value) for value in args.concurrency.split(",") if value.strip()]
+
+    stub = None
+    if not args.no_stub:
+        stub = StubMistralServer(args.llm_latency, args.llm_jitter, args.llm_failure_rate, args.stub_port).start()
+        print(f"LLM stub listening on {stub.url} (start a server by hand with MISTRAL_ENDPOINT={stub.url})", file=sys.stderr)
+
+    backend, base_url = None, args.url.rstrip("/")
+    try:
+        if args.spawn is not None:
+            backend, base_url = start_backend(args.spawn, args.port, stub.url if stub else None)
+            print(f"Started backend on {base_url}", file=sys.stderr)
+
+        report = {
+            "meta": {
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "git_revision": _git_revision(),
+                "url": base_url,
+                "spawned": args.spawn,
+                "snippets": list(cases),
+                "duration_seconds": args.duration,
+                "llm_stub": None if stub is None else {
+                    "latency_seconds": args.llm_latency, "jitter_seconds": args.llm_jitter,
+                    "failure_rate": args.llm_failure_rate,
+                },
+            },
+            "levels": [],
+        }
+        for concurrency in levels:
+            print(f"Running {concurrency} users for {args.duration:g} s...", file=sys.stderr)
+            level = run_level(base_url, cases, concurrency, args.duration, args.timeout, args.seed, stub)
+            report["levels"].append(level)
+            print_level(level)
+            p95 = level["session_latency"]["p95"]
+            if args.stop_p95 is not None and p95 is not None and p95 > args.stop_p95:
+                print(f"\nSession p95 {_ms(p95)} ms is above --stop-p95; stopping the ramp.", file=sys.stderr)
+                break
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait(timeout=10)
+        if stub is not None:
+            stub.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Wrote load test report to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Allow running both as `python -m benchmarks.run_benchmarks` and as a plain script.
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from app import tracer
+from app import data_processor
+from benchmarks import corpus
+
+STRUCTURE_TYPES = ("arrays", "trees", "graphs")
+
+
+def _quiet():
+    """Silences the print-based logging of the tracer/routes and the user's own prints."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def _timed(func, repeat):
+    """Runs func `repeat` times and returns (median_seconds, min_seconds, last_result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), min(timings), result
+
+
+def _run_untraced(code_snippet):
+    exec(compile(code_snippet, "<benchmark>", "exec"), {"__name__": "__main__"})
+
+
+def bench_case(name, code_snippet, repeat):
+    """Measures one corpus snippet: tracing overhead, event rate, peak memory and filter time."""
+    with _quiet():
+        untraced_median, untraced_min, _ = _timed(lambda: _run_untraced(code_snippet), repeat)
+        traced_median, traced_min, trace_json = _timed(lambda: tracer.perform_code_analysis(code_snippet), repeat)
+
+        # Peak memory is measured in a separate run because tracemalloc itself slows tracing down.
+        tracemalloc.start()
+        tracer.perform_code_analysis(code_snippet)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    raw_data = json.loads(trace_json).get("data_structures", {})
+    raw_counts = {t: len(raw_data.get(t, [])) for t in STRUCTURE_TYPES}
+    total_raw_events = sum(raw_counts.values())
+
+    filter_seconds = {}
+    filtered_counts = {}
+    for structure_type in STRUCTURE_TYPES:
+        events = raw_data.get(structure_type, [])
+        if not events:
+            continue
+        median, _, filtered = _timed(lambda: data_processor.filter_data_structure_events(events, structure_type), repeat)
+        filter_seconds[structure_type] = median
+        filtered_counts[structure_type] = len(filtered)
+
+    return {
+        "name": name,
+        "lines": code_snippet.count("\n"),
+        "untraced_seconds": untraced_median,
+        "untraced_min_seconds": untraced_min,
+        "traced_seconds": traced_median,
+        "traced_min_seconds": traced_min,
+        "tracing_overhead_ratio": traced_median / untraced_median if untraced_median > 0 else None,
+        "raw_events": raw_counts,
+        "events_per_second": total_raw_events / traced_median if traced_median > 0 else None,
+        "trace_json_bytes": len(trace_json),
+        "peak_memory_bytes": peak_bytes,
+        "filter_seconds": filter_seconds,
+        "filtered_events": filtered_counts,
+    }
+
+
+def bench_serialize_tree(sizes, repeat):
+    """Micro-benchmark of DataStructureTracker.serialize_tree on balanced binary trees."""
+
+    class _Node:
+        def __init__(self, value):
+            self.value = value
+            self.left = None
+            self.right = None
+
+    def build(lo, hi):
+        if lo > hi:
+            return None
+        mid = (lo + hi) // 2
+        node = _Node(mid)
+        node.left = build(lo, mid - 1)
+        node.right = build(mid + 1, hi)
+        return node
+
+    results = {}
+    for size in sizes:
+        root = build(0, size - 1)
+        median, best, _ = _timed(lambda: tracer.DataStructureTracker.serialize_tree(root), repeat)
+        results[str(size)] = {"seconds": median, "min_seconds": best, "nodes_per_second": size / median if median > 0 else None}
+    return results
+
+
+def bench_end_to_end(cases, repeat, llm_latency):
+    """Measures /api/analyze latency through the Flask test client with the LLM stubbed out."""
+    try:
+        os.environ.setdefault("MISTRAL_API_KEY", "benchmark-stub-key")
+        with _quiet():
+            from app import create_app
+            from app import llm_handler
+            from app import llm_providers
+            app = create_app()
+    except ImportError as e:
+        return {"skipped": f"Flask app unavailable: {e}"}
+
+    # Answers with the JSON the prompts ask for, after an optional delay that simulates network latency
+    llm_handler.set_provider(llm_providers.StubProvider(latency=llm_latency))
+    client = app.test_client()
+    results = {}
+    for name, code_snippet in cases.items():
+        def analyze():
+            response = client.post("/api/analyze", json={"code": code_snippet})
+            client.get("/api/execution_data")
+            return response.status_code
+        with _quiet():
+            median, best, status_code = _timed(analyze, repeat)
+        results[name] = {"seconds": median, "min_seconds": best, "status_code": status_code}
+    return {"llm_latency_seconds": llm_latency, "cases": results}
+
+
+_STARTUP_SCRIPT = (
+    "import time; start = time.perf_counter(); "
+    "from app import create_app; create_app(); "
+    "print(time.perf_counter() - start)"
+)
+
+
+def bench_startup(repeat):
+    """Measures import + create_app() of a fresh interpreter (the cold start of a worker process)."""
+    import_timings, process_timings = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT], cwd=_BACKEND_DIR,
+                                   capture_output=True, text=True)
+        process_timings.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            return {"skipped": f"App failed to start: {completed.stderr.strip().splitlines()[-1:]}"}
+        import_timings.append(float(completed.stdout.strip().splitlines()[-1]))
+    from app import STARTUP_TARGET_SECONDS
+    median = statistics.median(import_timings)
+    return {
+        "seconds": median,
+        "min_seconds": min(import_timings),
+        "process_seconds": statistics.median(process_timings), # Including interpreter start and exit
+        "target_seconds": STARTUP_TARGET_SECONDS,
+        "within_target": median <= STARTUP_TARGET_SECONDS,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=_BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare_results(current, baseline_path):
+    """Prints per-case ratios (current / baseline) for the headline timings."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nComparison against {baseline_path} (ratio < 1.0 means faster now):", file=sys.stderr)
+    print(f"{'case':<28}{'traced':>10}{'filter':>10}{'events/s':>12}", file=sys.stderr)
+    for name, case in current["cases"].items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        traced_ratio = case["traced_seconds"] / old["traced_seconds"] if old["traced_seconds"] else float("nan")
+        new_filter, old_filter = sum(case["filter_seconds"].values()), sum(old["filter_seconds"].values())
+        filter_ratio = new_filter / old_filter if old_filter else float("nan")
+        rate_ratio = (case["events_per_second"] or 0) / old["events_per_second"] if old.get("events_per_second") else float("nan")
+        print(f"{name:<28}{traced_ratio:>10.2f}{filter_ratio:>10.2f}{rate_ratio:>12.2f}", file=sys.stderr)
+    new_startup, old_startup = current.get("startup", {}).get("seconds"), baseline.get("startup", {}).get("seconds")
+    if new_startup and old_startup:
+        print(f"{'startup':<28}{new_startup / old_startup:>10.2f}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the visual tracer backend.")
+    parser.add_argument("--output", "-o", help="Write results as JSON to this path (default: stdout).")
+    parser.add_argument("--compare", help="Baseline JSON from a previous run to compare against.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per measurement (median is reported).")
+    parser.add_argument("--quick", action="store_true", help="Only run the smallest size of each case family.")
+    parser.add_argument("--filter", dest="case_filter", help="Only run cases whose name contains this substring.")
+    parser.add_argument("--skip-e2e", action="store_true", help="Skip the /api/analyze end-to-end measurements.")
+    parser.add_argument("--skip-startup", action="store_true", help="Skip the cold start (import + create_app) measurement.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated LLM latency (seconds) for the e2e run.")
+    args = parser.parse_args(argv)
+
+    cases = corpus.build_corpus(quick=args.quick)
+    if args.case_filter:
+        cases = {name: code for name, code in cases.items() if args.case_filter in name}
+
+    results = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git_revision": _git_revision(),
+            "repeat": args.repeat,
+            "quick": args.quick,
+        },
+        "cases": {},
+    }
+    for name, code_snippet in cases.items():
+        print(f"Benchmarking {name}...", file=sys.stderr)
+        results["cases"][name] = bench_case(name, code_snippet, args.repeat)
+
+    results["serialize_tree"] = bench_serialize_tree((127,) if args.quick else (127, 1023, 8191), args.repeat)
+
+    if not args.skip_e2e:
+        print("Benchmarking /api/analyze end to end...", file=sys.stderr)
+        results["end_to_end"] = bench_end_to_end(cases, args.repeat, args.llm_latency)
+
+    if not args.skip_startup:
+        print("Benchmarking cold start...", file=sys.stderr)
+        results["startup"] = bench_startup(args.repeat)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Wrote benchmark results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
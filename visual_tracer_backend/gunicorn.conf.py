@@ -0,0 +1,28 @@
+import os
+
+# --- Prefork server configuration ---
+# gunicorn -c gunicorn.conf.py run:app
+#
+# With preload_app the master imports the app and runs create_app() once, then forks the
+# workers, which start with the modules already loaded. Nothing that must not be shared
+# across a fork is created at startup: the LLM provider (and its connection pool) is made
+# on first use and per process (llm_handler.get_provider), and post_fork drops any provider
+# the master made anyway.
+#
+# One worker by default: the last analysis (routes._last_analysis_results) is kept per
+# process, and the frontend reads it back with GETs that carry no trace id, so with more
+# workers they could reach a worker that holds another analysis or none. Concurrency comes
+# from the worker's threads. More workers are only for clients that pass the trace_id
+# returned by /api/analyze with TRACE_STORE_DIR set (shared by every worker).
+
+bind = f"{os.environ.get('FLASK_RUN_HOST', '127.0.0.1')}:{os.environ.get('FLASK_RUN_PORT', '8000')}"
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120)) # /api/analyze waits for the trace and the LLM
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def post_fork(server, worker):
+    from app import llm_handler
+    llm_handler.reset_provider()
+    print(f"Worker {worker.pid} forked; the LLM provider will be created on first use.")
@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Headless tracing, the offline counterpart of run.py: traces a directory or glob of .py
+# files without starting the Flask server and writes, for every file, the same JSON
+# document GET /api/execution_data would return for it. Used to pre-compute traces for
+# course materials, e.g.
+#   python trace_cli.py course/week3 -o traces/week3
+#   python trace_cli.py "examples/**/*.py" -o traces --llm --workers 4
+# Files are traced in a pool of worker processes (one per core by default). The LLM is
+# only asked for visualizations with --llm; otherwise the default visualizations are written.
+
+# Same .env as the server (MISTRAL_API_KEY for --llm); loaded before app.llm_handler is imported.
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(dotenv_path=os.path.join(_BACKEND_DIR, '.env'))
+if _BACKEND_DIR not in sys.path:
+    sys.path.insert(0, _BACKEND_DIR)
+
+from app import analysis
+
+
+def find_snippets(sources):
+    """(path, base directory) for every .py file under the given directories, files or glob patterns."""
+    found = {} # path -> base directory (a file matched by two sources is traced once)
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, file_names in os.walk(source):
+                found.update((os.path.join(root, name), source) for name in sorted(file_names) if name.endswith(".py"))
+        else:
+            # A file or a glob pattern; outputs are named relative to the part before the first wildcard
+            base_dir = os.path.dirname(re.split(r"[*?\[]", source, maxsplit=1)[0]) or "."
+            found.update((path, base_dir) for path in sorted(glob.glob(source, recursive=True)) if path.endswith(".py"))
+    return list(found.items())
+
+
+def output_path(path, base_dir, output_dir):
+    """week3/sort.py -> <output_dir>/week3/sort.json (relative to the directory that was passed)."""
+    relative = os.path.relpath(path, base_dir)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + ".json")
+
+
+def trace_file(path, trace_mode="trace", with_llm=False, watch=None):
+    """
+    Worker entry point: traces one file and returns (execution_data, timing).
+    The tracer's logging and the snippet's own output (stdout and stderr) are discarded.
+    """
+    with open(path, encoding="utf-8") as f:
+        code_snippet = f.read()
+    timing = {}
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        start_time = time.perf_counter()
+        result = analysis.trace_and_filter(code_snippet, trace_mode, watch)
+        timing["trace_seconds"] = time.perf_counter() - start_time
+        visualizations = {}
+        if with_llm and not result["error"]:
+            start_time = time.perf_counter()
+            visualizations = analysis.select_visualizations(result)
+            timing["llm_seconds"] = time.perf_counter() - start_time
+    document = analysis.execution_data(result.get("code"), result, visualizations)
+    if result["error"]:
+        document["error"] = result["error"]
+    timing["steps"] = {structure_type: len(result.get(structure_type) or []) for structure_type in analysis.STRUCTURE_TYPES}
+    return document, timing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trace Python snippets offline, without the Flask server.")
+    parser.add_argument("sources", nargs="+", help="Directories (searched recursively), .py files or glob patterns.")
+    parser.add_argument("--output", "-o", required=True, help="Directory for the JSON results (one file per snippet).")
+    parser.add_argument("--mode", choices=analysis.tracer.TRACE_MODES, default="trace", help="Tracing mode, as in /api/analyze.")
+    parser.add_argument("--llm", action="store_true", help="Ask the LLM for visualizations (needs MISTRAL_API_KEY).")
+    parser.add_argument("--watch", help="Comma-separated variable names to trace in every file (added to its '# trace:' comments).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: one per core).")
+    args = parser.parse_args(argv)
+    watch = [name.strip() for name in args.watch.split(",") if name.strip()] if args.watch else None
+
+    snippets = find_snippets(args.sources)
+    if not snippets:
+        print("No .py files found.", file=sys.stderr)
+        return 1
+    print(f"Tracing {len(snippets)} files with {args.workers} workers...")
+
+    failures = 0
+    batch_start = time.perf_counter()
+    # "spawn": workers start from a clean interpreter instead of a copy of this one
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(trace_file, path, args.mode, args.llm, watch): (path, base_dir) for path, base_dir in snippets}
+        for future in as_completed(futures):
+            path, base_dir = futures[future]
+            try:
+                document, timing = future.result()
+            except (Exception, SystemExit) as e: # One file's failure (or exit()) must not end the run
+                failures += 1
+                print(f"FAILED  {path}: {e!r}")
+                continue
+            destination = output_path(path, base_dir, args.output)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, "w") as f:
+                json.dump(document, f, default=str)
+            steps = ", ".join(f"{count} {structure_type}" for structure_type, count in timing["steps"].items() if count)
+            llm_time = f", llm {timing['llm_seconds']:.3f}s" if "llm_seconds" in timing else ""
+            if "error" in document:
+                failures += 1
+                print(f"ERROR   {path}: trace {timing['trace_seconds']:.3f}s{llm_time} - {document['error']}")
+            else:
+                print(f"OK      {path}: trace {timing['trace_seconds']:.3f}s{llm_time} ({steps or 'no steps'}) -> {destination}")
+
+    total_seconds = time.perf_counter() - batch_start
+    print(f"Traced {len(snippets)} files in {total_seconds:.2f}s ({len(snippets) / total_seconds:.1f} files/s), {failures} failed.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())